@@ -0,0 +1,188 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Load test of the Chef config manager against a local stub Chef server
+
+Drives :meth:`ConfigManager.create_infrastructure`,
+:meth:`~ConfigManager.register_node`, :meth:`~ConfigManager.get_node_state`
+and :meth:`~ConfigManager.drop_infrastructure` with increasing numbers of
+nodes, and reports throughput, latency percentiles and the number of HTTP
+requests per operation as JSON::
+
+    python benchmarks/bench_configmanager.py --sizes 100 1000 10000 \\
+        --latency 0.002 --threads 8 --output results.json
+
+A client key is generated with ``openssl`` unless ``--client-key`` is given.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import occo.infobroker as ib
+from occo.configmanager import ConfigManager
+from chef_stub import ChefStubServer
+
+class BenchInfoBroker(object):
+    """
+    Answers the info broker queries made by the config manager.
+    """
+    def __init__(self, endpoint, client_key):
+        self.auth_data = dict(client_name='bench', client_key=client_key)
+        self.config_managers = [dict(type='chef', endpoint=endpoint)]
+        self.nodes = dict()
+
+    def get(self, key, *args, **kwargs):
+        if key == 'backends.auth_data':
+            return self.auth_data
+        elif key == 'config_managers':
+            return self.config_managers
+        elif key == 'node.find_one':
+            return self.nodes[kwargs['node_id']]
+        raise KeyError(key)
+
+def generate_key(directory):
+    path = os.path.join(directory, 'client.pem')
+    subprocess.check_call(['openssl', 'genrsa', '-out', path, '2048'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return path
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1,
+                int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(server, operation, items, threads):
+    """
+    Call ``operation`` for each item, using ``threads`` threads.
+
+    :returns: The result record of the operation.
+    """
+    def timed(item):
+        start = time.perf_counter()
+        operation(item)
+        return time.perf_counter() - start
+
+    server.reset_counts()
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(timed, items))
+    else:
+        latencies = [timed(item) for item in items]
+    elapsed = time.perf_counter() - start
+    requests = server.reset_counts()
+    latencies.sort()
+    total_requests = sum(requests.values())
+    return dict(ops=len(items),
+                seconds=elapsed,
+                ops_per_sec=len(items) / elapsed if elapsed else None,
+                p50=percentile(latencies, 50),
+                p99=percentile(latencies, 99),
+                requests=total_requests,
+                requests_per_op=float(total_requests) / len(items),
+                requests_by_kind=requests)
+
+def node_definition(infra_id, endpoint, index):
+    return dict(node_id='{0}-node-{1}'.format(infra_id, index),
+                name='worker',
+                infra_id=infra_id,
+                attributes={'bench.index': index},
+                config_management=dict(type='chef', endpoint=endpoint,
+                                       run_list=['recipe[bench]']))
+
+def run_size(server, broker, size, threads):
+    cm = ConfigManager()
+    cm.infobroker = broker
+    infra_id = 'bench-{0}'.format(uuid.uuid4().hex[:8])
+    node_defs = [node_definition(infra_id, server.url, i) for i in range(size)]
+    for node_def in node_defs:
+        broker.nodes[node_def['node_id']] = \
+            dict(resolved_node_definition=node_def)
+
+    results = dict()
+    results['create_infrastructure'] = measure(
+        server, cm.create_infrastructure, [infra_id], 1)
+    results['register_node'] = measure(
+        server, cm.register_node, node_defs, threads)
+    results['get_node_state'] = measure(
+        server, cm.get_node_state, node_defs, threads)
+    results['drop_infrastructure'] = measure(
+        server, cm.drop_infrastructure, [infra_id], 1)
+    results['backend_pool'] = cm.backend_pool.stats()
+    return results
+
+def print_summary(report, stream):
+    stream.write('{0:>7} {1:<22} {2:>10} {3:>10} {4:>10} {5:>8}\n'.format(
+        'nodes', 'operation', 'ops/s', 'p50 ms', 'p99 ms', 'req/op'))
+    for size, results in sorted(report['results'].items(), key=lambda i: int(i[0])):
+        for name, r in results.items():
+            if 'ops' not in r:
+                continue
+            stream.write('{0:>7} {1:<22} {2:>10.1f} {3:>10.2f} {4:>10.2f} '
+                         '{5:>8.2f}\n'.format(size, name, r['ops_per_sec'],
+                                              r['p50'] * 1000, r['p99'] * 1000,
+                                              r['requests_per_op']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='Numbers of nodes to benchmark with')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Artificial latency of the stub server (seconds)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of concurrent callers')
+    parser.add_argument('--client-key', help='Path of a PEM client key')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args(argv)
+
+    server = ChefStubServer(latency=args.latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            client_key = args.client_key or generate_key(tmp)
+            broker = BenchInfoBroker(server.url, client_key)
+            ib.real_main_info_broker = broker
+            report = dict(
+                timestamp=time.time(),
+                python=platform.python_version(),
+                latency=args.latency,
+                threads=args.threads,
+                results=dict((str(size), run_size(server, broker, size, args.threads))
+                             for size in args.sizes))
+    finally:
+        server.stop()
+
+    print_summary(report, sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Memory footprint of the node status table
+
+Stores the status of many nodes in a
+:class:`~occo.configmanager.state.NodeStatusTable`, and in the equivalent
+dictionary-per-node representation indexed the same way, and reports the
+memory allocated by each as JSON::
+
+    python benchmarks/bench_node_table.py --nodes 100000 --infras 100
+
+Node ids, infrastructure ids and backend keys are allocated up front and
+shared by both representations, so only the cost of the structures is
+measured. Lookup and per-infrastructure iteration times are reported too.
+
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+
+import occo.constants.status as status
+from occo.configmanager.state import NodeStatusTable
+
+STATES = (status.READY, status.PENDING, status.UNKNOWN)
+
+def make_inputs(nodes, infras, backends):
+    infra_ids = [str(uuid.uuid4()) for _ in range(infras)]
+    backend_keys = [('chef', 'https://chef{0}.example.com'.format(i), 'x' * 40)
+                    for i in range(backends)]
+    return [(str(uuid.uuid4()), infra_ids[i % infras],
+             backend_keys[i % backends], STATES[i % len(STATES)])
+            for i in range(nodes)]
+
+def build_table(inputs):
+    table = NodeStatusTable(maxsize=None)
+    now = time.monotonic()
+    for node_id, infra_id, backend, state in inputs:
+        table.put(node_id, state, 0, now + 10, infra_id, backend)
+    return table
+
+def build_dicts(inputs):
+    records, by_infra = dict(), dict()
+    now = time.monotonic()
+    for node_id, infra_id, backend, state in inputs:
+        record = dict(node_id=node_id, infra_id=infra_id, backend=backend,
+                      status=state, streak=0, checked=now, expires=now + 10)
+        records[node_id] = record
+        by_infra.setdefault(infra_id, dict())[node_id] = record
+    return records, by_infra
+
+def measure_memory(build, inputs):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(inputs)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def timed(fun, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fun()
+    return (time.perf_counter() - start) / repeat
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--infras', type=int, default=100)
+    parser.add_argument('--backends', type=int, default=4)
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args(argv)
+
+    inputs = make_inputs(args.nodes, args.infras, args.backends)
+    node_ids = [i[0] for i in inputs]
+    infra_id = inputs[0][1]
+
+    table, table_bytes = measure_memory(build_table, inputs)
+    (records, by_infra), dict_bytes = measure_memory(build_dicts, inputs)
+
+    report = dict(
+        python=sys.version.split()[0],
+        nodes=args.nodes,
+        infrastructures=args.infras,
+        table=dict(
+            bytes=table_bytes,
+            bytes_per_node=float(table_bytes) / args.nodes,
+            lookup_ns=timed(lambda: [table.get(n) for n in node_ids], 3)
+                      / args.nodes * 1e9,
+            infra_iteration_us=timed(
+                lambda: [r.status for r in table.infrastructure(infra_id)],
+                100) * 1e6),
+        dicts=dict(
+            bytes=dict_bytes,
+            bytes_per_node=float(dict_bytes) / args.nodes,
+            lookup_ns=timed(lambda: [records.get(n) for n in node_ids], 3)
+                      / args.nodes * 1e9,
+            infra_iteration_us=timed(
+                lambda: [r['status'] for r in list(by_infra[infra_id].values())],
+                100) * 1e6))
+    report['saving'] = 1 - float(table_bytes) / dict_bytes
+
+    sys.stderr.write('{0:<6} {1:>12} {2:>10}\n'.format('', 'bytes', 'B/node'))
+    for name in ('table', 'dicts'):
+        r = report[name]
+        sys.stderr.write('{0:<6} {1:>12} {2:>10.1f}\n'.format(
+            name, r['bytes'], r['bytes_per_node']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
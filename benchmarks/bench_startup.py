@@ -0,0 +1,93 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Startup time of a process using the config manager
+
+Each scenario is run in fresh interpreters; the time from the first import
+to the first instantiated backend is reported as JSON, together with whether
+``pychef`` got imported::
+
+    python benchmarks/bench_startup.py --runs 20 --protocol dummy
+
+The ``eager`` scenario imports every plugin module up front, as before lazy
+plugin loading; ``lazy`` relies on the plugin being imported on demand.
+
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+EAGER_IMPORTS = """
+import occo.plugins.configmanager.chef
+import occo.plugins.configmanager.dummy
+import occo.plugins.configmanager.puppet_solo
+"""
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import sys, json
+{imports}
+from occo.configmanager import ConfigManager
+cm = ConfigManager.instantiate(protocol={protocol!r})
+json.dump(dict(seconds=time.perf_counter() - start,
+               chef_imported='chef' in sys.modules), sys.stdout)
+"""
+
+def run_once(imports, protocol):
+    script = SCRIPT.format(imports=imports, protocol=protocol)
+    out = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(out.decode('utf-8'))
+
+def run_scenario(imports, protocol, runs):
+    results = [run_once(imports, protocol) for _ in range(runs)]
+    times = sorted(r['seconds'] for r in results)
+    return dict(runs=runs,
+                median=statistics.median(times),
+                min=times[0],
+                max=times[-1],
+                chef_imported=any(r['chef_imported'] for r in results))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of interpreters per scenario')
+    parser.add_argument('--protocol', default='dummy',
+                        help='Protocol of the backend to instantiate')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args(argv)
+
+    report = dict(
+        python=sys.version.split()[0],
+        protocol=args.protocol,
+        eager=run_scenario(EAGER_IMPORTS, args.protocol, args.runs),
+        lazy=run_scenario('', args.protocol, args.runs))
+    report['speedup'] = report['eager']['median'] / report['lazy']['median']
+
+    for name in ('eager', 'lazy'):
+        r = report[name]
+        sys.stderr.write('{0:<6} median {1:8.1f} ms  pychef imported: {2}\n'
+                         .format(name, r['median'] * 1000, r['chef_imported']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
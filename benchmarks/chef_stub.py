@@ -0,0 +1,218 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" In-memory stand-in for the Chef server endpoints used by the Chef plugin
+
+Emulates ``/nodes``, ``/roles``, ``/environments``, ``/clients`` and
+``/search`` (full and partial search), with a configurable artificial
+latency. Requests are not authenticated. Intended for benchmarks only.
+
+"""
+
+__all__ = [ 'ChefStubServer' ]
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+COLLECTIONS = ('nodes', 'roles', 'environments', 'clients')
+SEARCH_INDEXES = dict(node='nodes', role='roles',
+                      environment='environments', client='clients')
+
+class NotFound(Exception):
+    pass
+
+class Conflict(Exception):
+    pass
+
+TERM = re.compile(r'(\w+):(\((?:[^)\\]|\\.)*\)|(?:[^ \\]|\\.)+)')
+
+def unescape(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+def parse_query(query):
+    """
+    Parse the subset of the Solr query syntax used by the Chef plugin:
+    ``*:*``, ``field:value``, ``field:prefix*`` and ``field:(a OR b ...)``,
+    combined with implicit AND.
+
+    :returns: A list of ``(field, [(value, is_prefix), ...])`` terms.
+    """
+    if query.strip() == '*:*':
+        return list()
+    terms = list()
+    for field, value in TERM.findall(query):
+        if value.startswith('('):
+            raw = re.split(r' OR ', value[1:-1])
+        else:
+            raw = [value]
+        alternatives = list()
+        for v in raw:
+            is_prefix = v.endswith('*') and not v.endswith('\\*')
+            alternatives.append(
+                (unescape(v[:-1] if is_prefix else v), is_prefix))
+        terms.append((field, alternatives))
+    return terms
+
+def lookup(obj, path):
+    """
+    Resolve an attribute path on a stored object the way partial search
+    does: top-level keys first, then the merged node attributes.
+    """
+    for source in [obj] + [obj.get(level, dict()) for level in
+                           ('automatic', 'override', 'normal', 'default')]:
+        value = source
+        for key in path:
+            if isinstance(value, dict) and key in value:
+                value = value[key]
+            else:
+                break
+        else:
+            return value
+    return None
+
+class ChefStore(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = dict((c, dict()) for c in COLLECTIONS)
+
+    def matches(self, obj, terms):
+        for field, alternatives in terms:
+            value = lookup(obj, [field])
+            value = '' if value is None else str(value)
+            if not any(value.startswith(v) if is_prefix else value == v
+                       for v, is_prefix in alternatives):
+                return False
+        return True
+
+    def search(self, index, query, start, rows, keys=None):
+        collection = self.data[SEARCH_INDEXES[index]]
+        terms = parse_query(query)
+        with self.lock:
+            found = [obj for _, obj in sorted(collection.items())
+                     if self.matches(obj, terms)]
+        page = found[start:start + rows]
+        if keys is None:
+            result_rows = page
+        else:
+            result_rows = [dict(url='', data=dict((k, lookup(obj, path))
+                                                  for k, path in keys.items()))
+                           for obj in page]
+        return dict(total=len(found), start=start, rows=result_rows)
+
+    def handle(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'search':
+            q = query.get('q', ['*:*'])[0]
+            start = int(query.get('start', ['0'])[0])
+            rows = int(query.get('rows', ['1000'])[0])
+            return self.search(parts[1], q, start, rows,
+                               body if method == 'POST' else None)
+
+        collection = self.data[parts[0]]
+        with self.lock:
+            if len(parts) == 1:
+                if method == 'GET':
+                    return dict((name, '/{0}/{1}'.format(parts[0], name))
+                                for name in collection)
+                if body['name'] in collection:
+                    raise Conflict()
+                collection[body['name']] = body
+                return dict(uri='/{0}/{1}'.format(parts[0], body['name']))
+
+            name = parts[1]
+            if name not in collection:
+                raise NotFound()
+            if method == 'PUT':
+                collection[name] = body
+            elif method == 'DELETE':
+                return collection.pop(name)
+            return collection[name]
+
+class ChefStubServer(object):
+    """
+    A threaded HTTP server emulating a Chef server.
+
+    :param float latency: Artificial delay of each response in seconds.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.store = ChefStore()
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_any(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                server.count(self.command, url.path)
+                if server.latency:
+                    time.sleep(server.latency)
+                try:
+                    code, result = 200, server.store.handle(
+                        self.command, url.path, parse_qs(url.query), body)
+                except NotFound:
+                    code, result = 404, dict(error=['Not found'])
+                except Conflict:
+                    code, result = 409, dict(error=['Conflict'])
+                data = json.dumps(result).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.httpd.server_address)
+
+    def count(self, method, path):
+        kind = path.strip('/').split('/')[0]
+        with self.counts_lock:
+            self.counts['{0} {1}'.format(method, kind)] += 1
+
+    def reset_counts(self):
+        with self.counts_lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+        return counts
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='chef-stub')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
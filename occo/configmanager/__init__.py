@@ -18,151 +18,673 @@
 
 """
 
-__all__  = [ 'ConfigManager', 'ConfigManagerProvider', 'CMSchemaChecker' ]
+__all__  = [ 'ConfigManager', 'ConfigManagerProvider', 'CMSchemaChecker',
+             'ConfigManagerError', 'CommandBatch' ]
 
-import occo.util.factory as factory
 import occo.util as util
 import occo.infobroker as ib
+import occo.constants.status as status
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from occo.exceptions import SchemaError
+from occo.configmanager.cache import TTLCache, SingleFlight, canonical_hash
+from occo.configmanager.pool import BackendPool, section_endpoint, \
+    endpoint_matches
+from occo.configmanager.state import NodeStateCache
+from occo.configmanager.metrics import Metrics, backend_labels
+from occo.configmanager.plugins import LazyMultiBackend, load_plugin
+from occo.configmanager.batch import CommandBatch
+from occo.configmanager.limiter import limiter_stats
 
 log = logging.getLogger('occo.configmanager')
 
+class ConfigManagerError(Exception):
+    """
+    Raised when an operation failed in one or more config manager sections.
+
+    :ivar dict errors: Maps the label of each failed section to the exception
+        raised there.
+    """
+    def __init__(self, message, errors):
+        Exception.__init__(self, message)
+        self.errors = errors
+
+def dotted_attribute(attribute):
+    """
+    Normalise an attribute specification, either a dotted string or a
+    sequence of keys, to a dotted string.
+    """
+    return \
+        attribute if isinstance(attribute, str) \
+        else '.'.join(attribute) if hasattr(attribute, '__iter__') \
+        else util.f_raise(TypeError(
+            'Unknown attribute specification: {0}'.format(attribute)))
+
+def section_label(index, cfg):
+    return '#{0} {1} ({2})'.format(
+        index, cfg.get('type'), section_endpoint(cfg) or '<undefined>')
+
+def section_error(errors, count):
+    """
+    Log the errors of failed config manager sections, and create the
+    :exc:`ConfigManagerError` reporting them.
+
+    :param dict errors: Maps section labels to exceptions.
+    :param int count: The number of sections operated on.
+    """
+    for label, ex in errors.items():
+        log.error("[CM] Operation failed in section %s: %s", label, ex)
+    return ConfigManagerError(
+        'Operation failed in {0} of {1} config manager section(s): {2}'
+        .format(len(errors), count, ', '.join(sorted(errors))),
+        errors)
+
+def node_config_management(data):
+    """
+    The ``config_management`` section of a node definition or instance data.
+    Nodes without one are served by the ``dummy`` backend.
+    """
+    cfg = data.get('config_management')
+    if not cfg:
+        cfg = data.get('resolved_node_definition',dict()).get('config_management',None)
+    if not cfg:
+        cfg = dict(type='dummy',name='dummy')
+    return cfg
+
 class Command(object):
     def __init__(self):
         pass
     def perform(self, config_manager):
         raise NotImplementedError()
+    def perform_async(self, config_manager):
+        """
+        Awaitable variant of :meth:`perform`.
+
+        Backends override this with a coroutine to perform the command
+        without blocking the event loop. By default, :meth:`perform` is run
+        in the default executor of the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(None, self.perform, config_manager)
+
+class CMSchemaChecker(LazyMultiBackend):
+    """
+    Validates ``config_management`` sections.
+
+    Backends declare their keys in ``req_keys`` and ``opt_keys``; these are
+    compiled into sets when the checker is created. Checker instances are
+    stateless, so one instance per protocol is shared through
+    :meth:`get_checker`.
+
+    :meth:`check_sections` validates many sections at once, reporting every
+    invalid section.
+    """
+    req_keys = []
+    opt_keys = []
+
+    checkers = dict()
+    checkers_lock = threading.Lock()
 
-class CMSchemaChecker(factory.MultiBackend):
     def __init__(self):
-        return
+        self.compile_keys()
+
+    def compile_keys(self):
+        self.req_key_set = frozenset(self.req_keys)
+        self.valid_key_set = frozenset(self.req_keys) | frozenset(self.opt_keys)
+
+    @classmethod
+    def get_checker(cls, protocol):
+        """
+        Return the shared checker instance of a protocol.
+        """
+        checker = cls.checkers.get(protocol)
+        if checker is None:
+            with cls.checkers_lock:
+                checker = cls.checkers.get(protocol)
+                if checker is None:
+                    checker = cls.checkers[protocol] = \
+                        cls.instantiate(protocol=protocol)
+        return checker
 
     def perform_check(self, data):
-        raise NotImplementedError()
+        missing_keys = self.get_missing_keys(data, self.req_keys)
+        if missing_keys:
+            msg = "Missing key(s): " + ', '.join(str(key) for key in missing_keys)
+            raise SchemaError(msg)
+        invalid_keys = self.get_invalid_keys(data, self.valid_key_set)
+        if invalid_keys:
+            msg = "Unknown key(s): " + ', '.join(str(key) for key in invalid_keys)
+            raise SchemaError(msg)
+        return True
 
     def get_missing_keys(self, data, req_keys):
-        missing_keys = list()
-        for rkey in req_keys:
-            if rkey not in data:
-                missing_keys.append(rkey)
-        return missing_keys
+        return [rkey for rkey in req_keys if rkey not in data]
 
     def get_invalid_keys(self, data, valid_keys):
-        invalid_keys = list()
-        for key in data:
-            if key not in valid_keys:
-                invalid_keys.append(key)
-        return invalid_keys
+        if not isinstance(valid_keys, (set, frozenset)):
+            valid_keys = frozenset(valid_keys)
+        return [key for key in data if key not in valid_keys]
+
+    @classmethod
+    def check_section(cls, data):
+        """
+        Validate a single section, using the checker of its protocol.
+
+        :returns: The error message, or :data:`None` if the section is valid.
+        """
+        protocol = data.get('type') if isinstance(data, dict) else None
+        if protocol is None:
+            return "Missing key(s): type"
+        # Errors importing the plugin are not schema errors; let them raise
+        load_plugin(cls, protocol)
+        if protocol not in getattr(cls, 'backends', dict()):
+            return "Unknown config manager type: {0!r}".format(protocol)
+        checker = cls.get_checker(protocol)
+        try:
+            checker.perform_check(data)
+        except SchemaError as ex:
+            return str(ex)
+        return None
+
+    @classmethod
+    def get_errors(cls, sections):
+        """
+        Validate a list of sections, each with the checker of its protocol.
+
+        :returns: A list of ``(index, message)`` pairs, one for each invalid
+            section.
+        """
+        errors = list()
+        for index, data in enumerate(sections):
+            message = cls.check_section(data)
+            if message is not None:
+                errors.append((index, message))
+        return errors
+
+    @classmethod
+    def check_sections(cls, sections):
+        """
+        Validate a list of sections, reporting all errors at once.
+
+        :raises SchemaError: if any of the sections is invalid; its
+            ``errors`` attribute holds the result of :meth:`get_errors`.
+        """
+        errors = cls.get_errors(sections)
+        if errors:
+            ex = SchemaError('Invalid config manager section(s): ' + '; '.join(
+                '#{0}: {1}'.format(index, message) for index, message in errors))
+            ex.errors = errors
+            raise ex
+        return True
 
 @ib.provider
 class ConfigManagerProvider(ib.InfoProvider):
     """Abstract interface of a config manager provider.
 
+    Node states are cached briefly and concurrent queries of the same node
+    are coalesced; see :class:`~occo.configmanager.state.NodeStateCache`.
+    Bulk queries (``node.service.state.bulk``) only query the nodes missing
+    from this cache, with one bulk query per backend. States of whole
+    infrastructures (``infrastructure.service.state``) are cached for
+    ``infrastructure_state_ttl`` seconds, and also fill the node state cache.
+    The lifetimes can be set in the configuration of the provider with the
+    keys of the same name.
+
     .. todo:: Service Composer documentation.
     """
+    ready_state_ttl = 10
+    pending_state_ttl = 1
+    max_pending_state_ttl = 8
+    other_state_ttl = 1
+    infrastructure_state_ttl = 2
+
     def __init__(self, config_manager, **config):
         self.__dict__.update(config)
         self.config_manager = config_manager
+        self.state_cache = NodeStateCache(
+            ready_ttl=self.ready_state_ttl,
+            pending_ttl=self.pending_state_ttl,
+            max_pending_ttl=self.max_pending_state_ttl,
+            other_ttl=self.other_state_ttl)
+        self.infra_state_cache = TTLCache(ttl=self.infrastructure_state_ttl)
+        self.infra_in_flight = SingleFlight()
 
     @ib.provides('node.service.state')
     def service_status(self, instance_data):
-        return self.config_manager.get_node_state(instance_data)
-
-class ConfigManager(factory.MultiBackend):
-    def __init__(self):
+        def query():
+            cm = self.config_manager.instantiate_cm_with_node_def(instance_data)
+            state = self.config_manager.perform_command(
+                cm, cm.cri_get_node_state(instance_data))
+            return state, getattr(cm, 'backend_key', None)
+        return self.state_cache.fetch(
+            instance_data['node_id'], query, instance_data.get('infra_id'))
+
+    @ib.provides('node.service.state.bulk')
+    def service_status_bulk(self, instance_data_list):
+        """
+        The states of many nodes.
+
+        :returns: A dictionary mapping node ids to states.
+        """
+        states, missing = dict(), list()
+        for instance_data in instance_data_list:
+            state = self.state_cache.get(instance_data['node_id'])
+            if state is None:
+                missing.append(instance_data)
+            else:
+                states[instance_data['node_id']] = state
+        if missing:
+            cfgmgr = self.config_manager
+            for cm, group in cfgmgr.group_by_backend(missing):
+                backend = getattr(cm, 'backend_key', None)
+                result = cfgmgr.perform_command(cm, cm.cri_get_node_states(group))
+                for instance_data in group:
+                    node_id = instance_data['node_id']
+                    states[node_id] = self.state_cache.put(
+                        node_id, result.get(node_id, status.UNKNOWN),
+                        instance_data.get('infra_id'), backend)
+        return states
+
+    @ib.provides('infrastructure.service.state')
+    def infrastructure_status(self, infra_id):
+        """
+        The states of the nodes of an infrastructure.
+
+        :returns: A dictionary mapping node ids to states.
+        :raises ConfigManagerError: if querying a config manager section of
+            the infrastructure failed (see
+            :meth:`ConfigManager.get_infrastructure_state`).
+        """
+        def query():
+            states = self.config_manager.get_infrastructure_state(infra_id)
+            for node_id, state in states.items():
+                self.state_cache.put(node_id, state, infra_id)
+            self.infra_state_cache.set(infra_id, states)
+            return states
+
+        states = self.infra_state_cache.get(infra_id)
+        if states is None:
+            states = self.infra_in_flight.do(infra_id, query)
+        return dict(states)
+
+    @ib.provides('config_manager.metrics')
+    def metrics(self, format='dict'):
+        """
+        The metrics collected by the config manager: latency histograms,
+        call and error counts of commands and backend instantiation.
+
+        :param str format: ``dict``, or ``prometheus`` for the Prometheus
+            text exposition format.
+        """
+        metrics = self.config_manager.metrics
+        return metrics.prometheus_text() if format == 'prometheus' \
+            else metrics.snapshot()
+
+    @ib.provides('config_manager.limiters')
+    def limiters(self):
+        """
+        The state of the adaptive concurrency limiter of each endpoint: the
+        current ``limit``, the number of requests ``in_flight`` and
+        ``queued``, and counters.
+        """
+        return limiter_stats()
+
+class ConfigManager(LazyMultiBackend):
+    """
+    Facade of the config manager backends.
+
+    Backend instances are kept in a :class:`~occo.configmanager.pool.BackendPool`
+    and reused across operations.
+
+    Infrastructure-level operations are performed on the config manager
+    sections in parallel, using at most ``max_workers`` threads.
+
+    The authentication data of config manager sections and the
+    ``config_managers`` of infrastructures are cached, so the info broker is
+    not queried on every operation.
+
+    :param int backend_pool_size: Maximum number of pooled backend instances.
+    :param float backend_pool_ttl: Lifetime of a pooled backend in seconds.
+    :param int max_workers: Size of the worker pool.
+    :param int resolution_cache_size: Maximum number of cached auth data and
+        ``config_managers`` entries, each.
+    :param float resolution_cache_ttl: Lifetime of the cached entries in
+        seconds.
+    :param bool collect_metrics: Whether to record the latency of commands
+        and backend instantiation in :attr:`metrics`.
+    """
+    def __init__(self, backend_pool_size=64, backend_pool_ttl=600,
+                 max_workers=8, resolution_cache_size=1024,
+                 resolution_cache_ttl=300, collect_metrics=False):
         self.infobroker = ib.main_info_broker
-        self.config_managers = None
+        self.metrics = Metrics(enabled=collect_metrics)
+        self.auth_data_cache = TTLCache(resolution_cache_size, resolution_cache_ttl)
+        self.config_managers_cache = TTLCache(resolution_cache_size, resolution_cache_ttl)
+        self.backend_pool = BackendPool(ConfigManager.instantiate,
+                                        backend_pool_size, backend_pool_ttl)
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
         return
 
+    def get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='occo-configmanager')
+            return self.executor
+
     def cri_register_node(self, resolved_node_definition):
         raise NotImplementedError()
 
+    def cri_register_nodes(self, resolved_node_definitions):
+        raise NotImplementedError()
+
     def cri_drop_node(self, instance_data):
         raise NotImplementedError()
 
     def cri_get_node_state(self, instance_data):
         raise NotImplementedError()
 
+    def cri_get_node_states(self, instance_data_list):
+        raise NotImplementedError()
+
     def cri_create_infrastructure(self, infra_id):
         raise NotImplementedError()
 
     def cri_drop_infrastructure(self, infra_id):
         raise NotImplementedError()
 
+    def cri_get_infrastructure_state(self, infra_id):
+        raise NotImplementedError()
+
     def cri_get_node_attribute(self, node_id, attribute):
         raise NotImplementedError()
 
+    def cri_get_node_attributes(self, node_id, attributes):
+        raise NotImplementedError()
+
     def cri_infra_exists(self, infra_id):
         raise NotImplementedError()
 
     def cri_resolve_attributes(self, node_def):
         raise NotImplementedError()
 
+    def perform_command(self, cm, command):
+        """
+        Perform a command on a backend, recording its latency.
+        """
+        metrics = self.metrics
+        if not metrics.enabled:
+            return command.perform(cm)
+        protocol, endpoint = backend_labels(cm)
+        return metrics.timed(
+            'occo_configmanager_command',
+            (('protocol', protocol), ('command', type(command).__name__),
+             ('endpoint', endpoint)),
+            command.perform, cm)
+
+    def command_batch(self):
+        """
+        Create a :class:`~occo.configmanager.batch.CommandBatch` whose
+        commands are performed with :meth:`perform_command` on the shared
+        executor of this facade.
+        """
+        return CommandBatch(perform=self.perform_command,
+                            executor=self.get_executor())
+
+    def timed_instantiation(self, method, cfg):
+        return self.metrics.timed(
+            'occo_configmanager_instantiate',
+            (('protocol', cfg.get('type')), ('method', method.__name__),
+             ('endpoint', cfg.get('endpoint', ''))),
+            method, cfg)
+
     def instantiate_cm_with_node_def(self, data):
-        cfg = data.get('config_management')
-        if not cfg:
-            cfg = data.get('resolved_node_definition',dict()).get('config_management',None)
-        if not cfg:
-            cfg = dict(type='dummy',name='dummy')
-        auth_data = ib.real_main_info_broker.get('backends.auth_data',"config_management",cfg) 
-        return ConfigManager.instantiate(\
-               protocol=cfg['type'],\
-               auth_data=auth_data,\
-               **cfg)
+        cfg = node_config_management(data)
+        if self.metrics.enabled:
+            return self.timed_instantiation(self.instantiate_cm_for_node, cfg)
+        return self.instantiate_cm_for_node(cfg)
+
+    def instantiate_cm_for_node(self, cfg):
+        auth_data = self.get_auth_data(ib.real_main_info_broker, cfg)
+        return self.backend_pool.get(cfg, auth_data)
 
     def instantiate_cm_with_config_section(self, cfg):
-        auth_data = self.infobroker.get('backends.auth_data',"config_management",cfg)
-        return ConfigManager.instantiate(\
-               protocol=cfg['type'],\
-               auth_data=auth_data,\
-               **cfg)
+        if self.metrics.enabled:
+            return self.timed_instantiation(self.instantiate_cm_for_section, cfg)
+        return self.instantiate_cm_for_section(cfg)
+
+    def instantiate_cm_for_section(self, cfg):
+        auth_data = self.get_auth_data(self.infobroker, cfg)
+        return self.backend_pool.get(cfg, auth_data)
+
+    def get_auth_data(self, infobroker, cfg):
+        """
+        Resolve the authentication data of a config manager section, caching
+        it by the content of the section. Missing auth data is not cached.
+        """
+        key = (cfg.get('type'), section_endpoint(cfg), canonical_hash(cfg))
+        auth_data = self.auth_data_cache.get(key)
+        if auth_data is None:
+            auth_data = infobroker.get('backends.auth_data',"config_management",cfg)
+            if auth_data:
+                self.auth_data_cache.set(key, auth_data)
+        return auth_data
+
+    def get_config_managers(self, infra_id):
+        """
+        Resolve the config manager sections of an infrastructure.
+        """
+        return self.config_managers_cache.get_or_set(
+            infra_id, lambda: self.infobroker.get('config_managers', infra_id))
+
+    def invalidate_infrastructure(self, infra_id):
+        """
+        Forget the cached ``config_managers`` of an infrastructure.
+        """
+        self.config_managers_cache.pop(infra_id)
+
+    def invalidate_backends(self, protocol=None, endpoint=None):
+        """
+        Drop pooled backend instances and cached authentication data, so they
+        are resolved and re-created on next use. Must be called when the
+        credentials of an endpoint are rotated.
+        """
+        def matches(key):
+            return (protocol is None or key[0] == protocol) \
+                and endpoint_matches(key[1], endpoint)
+        self.auth_data_cache.discard_if(matches)
+        return self.backend_pool.invalidate(protocol, endpoint)
 
     def register_node(self, resolved_node_definition):
         cm = self.instantiate_cm_with_node_def(resolved_node_definition)
-        return cm.cri_register_node(resolved_node_definition).perform(cm)
+        return self.perform_command(cm, cm.cri_register_node(resolved_node_definition))
+
+    def register_nodes(self, resolved_node_definitions):
+        """
+        Register many nodes at once. The nodes are grouped by backend, and
+        each backend registers its group concurrently, ensuring each role
+        only once.
+
+        :returns: A dictionary mapping each node id to :data:`None` if the
+            node has been registered, or to the exception raised otherwise.
+            Nodes missing from the answer of their backend (e.g. in dry-run
+            mode) have not failed.
+        """
+        groups = self.group_by_backend(resolved_node_definitions)
+        def register(group):
+            cm, node_defs = group
+            result = self.perform_command(cm, cm.cri_register_nodes(node_defs))
+            return dict((d['node_id'], result.get(d['node_id']))
+                        for d in node_defs)
+        results = dict()
+        if len(groups) == 1:
+            results.update(register(groups[0]))
+        else:
+            for result in self.get_executor().map(register, groups):
+                results.update(result)
+        return results
 
     def drop_node(self, instance_data):
         cm = self.instantiate_cm_with_node_def(instance_data)
-        return cm.cri_drop_node(instance_data).perform(cm)
+        return self.perform_command(cm, cm.cri_drop_node(instance_data))
 
     def get_node_state(self, instance_data):
         cm = self.instantiate_cm_with_node_def(instance_data)
-        return cm.cri_get_node_state(instance_data).perform(cm)
+        return self.perform_command(cm, cm.cri_get_node_state(instance_data))
+
+    def group_by_backend(self, data_list):
+        """
+        Group node definitions or instance data by the backend serving them.
+
+        :returns: A list of ``(backend, [data, ...])`` pairs.
+        """
+        groups = dict()
+        for data in data_list:
+            cm = self.instantiate_cm_with_node_def(data)
+            groups.setdefault(cm.backend_key, (cm, list()))[1].append(data)
+        return list(groups.values())
+
+    def get_node_states(self, instance_data_list):
+        """
+        Query the state of many nodes at once, using a single bulk query per
+        backend instead of one query per node.
+
+        :returns: A dictionary mapping node ids to node states. Nodes missing
+            from the answer of their backend (e.g. in dry-run mode) are
+            unknown.
+        """
+        states = dict()
+        for cm, group in self.group_by_backend(instance_data_list):
+            result = self.perform_command(cm, cm.cri_get_node_states(group))
+            states.update((i['node_id'], result.get(i['node_id'], status.UNKNOWN))
+                          for i in group)
+        return states
+
+    def for_each_section(self, infra_id, operation, stop=None):
+        """
+        Perform an operation on each config manager section of an
+        infrastructure, in parallel.
+
+        :param operation: Called as ``operation(cfg, backend)``.
+        :param stop: If specified, results are checked by this predicate as
+            they arrive, and the first matching result is returned
+            immediately; pending operations are cancelled.
+
+        :returns: The list of results, in the order of the sections; or the
+            first result matching ``stop``.
+        :raises ConfigManagerError: if any of the operations failed.
+        """
+        sections = list(self.get_config_managers(infra_id))
+
+        def task(cfg):
+            return operation(cfg, self.instantiate_cm_with_config_section(cfg))
+
+        results, errors = [None] * len(sections), dict()
+        if len(sections) == 1:
+            try:
+                results[0] = task(sections[0])
+            except Exception as ex:
+                errors[section_label(0, sections[0])] = ex
+        else:
+            executor = self.get_executor()
+            futures = dict((executor.submit(task, cfg), i)
+                           for i, cfg in enumerate(sections))
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures[future]
+                    try:
+                        results[i] = future.result()
+                    except Exception as ex:
+                        errors[section_label(i, sections[i])] = ex
+                        continue
+                    if stop is not None and stop(results[i]):
+                        for f in pending:
+                            f.cancel()
+                        return results[i]
+
+        if errors:
+            raise section_error(errors, len(sections))
+        if stop is not None:
+            for result in results:
+                if stop(result):
+                    return result
+        return results
 
     def create_infrastructure(self, infra_id):
         log.debug("[CM] Building necessary environments for infrastructure %r", infra_id)
-        self.config_managers = self.infobroker.get('config_managers',infra_id) if self.config_managers is None else self.config_managers
-        for cfg in self.config_managers:
-            cm = self.instantiate_cm_with_config_section(cfg)
-            cm.cri_create_infrastructure(infra_id).perform(cm)
+        self.for_each_section(
+            infra_id,
+            lambda cfg, cm: self.perform_command(cm, cm.cri_create_infrastructure(infra_id)))
 
     def drop_infrastructure(self, infra_id):
         log.debug("[CM] Destroying environments for infrastructure %r", infra_id)
-        self.config_managers = self.infobroker.get('config_managers', infra_id) if self.config_managers is None else self.config_managers
-        for cfg in self.config_managers:
-            cm = self.instantiate_cm_with_config_section(cfg)
-            cm.cri_drop_infrastructure(infra_id).perform(cm)
+        try:
+            return self.for_each_section(
+                infra_id,
+                lambda cfg, cm: self.perform_command(cm, cm.cri_drop_infrastructure(infra_id)))
+        finally:
+            self.invalidate_infrastructure(infra_id)
 
     def infrastructure_exists(self, infra_id):
         log.debug("[CM] Checking necessary environments for infrastructure %r", infra_id)
-        self.config_managers = self.infobroker.get('config_managers', infra_id) if self.config_managers is None else self.config_managers
-        for cfg in self.config_managers:
-            cm = self.instantiate_cm_with_config_section(cfg)
-            retval = cm.cri_infrastructure_exists(infra_id).perform(cm)
+        def check(cfg, cm):
+            retval = self.perform_command(cm, cm.cri_infrastructure_exists(infra_id))
             if retval is False:
                 log.debug("[CM] Environment for %r (%r) is not ready", cfg['type'], cfg.get("endpoint","<undefined>"))
-                break
             else:
                 log.debug("[CM] Environment for %r (%r) is ready", cfg['type'], cfg.get("endpoint","<undefined>"))
-        return retval
+            return retval
+        retval = self.for_each_section(
+            infra_id, check, stop=lambda result: result is False)
+        return False if retval is False else True
+
+    def get_infrastructure_state(self, infra_id):
+        """
+        Query the state of every node of an infrastructure known to its
+        config managers, with a single bulk query per section.
+
+        Backends that do not track nodes (``dummy`` and ``puppet_solo``)
+        report the nodes they serve ready, as listed by the info broker.
+
+        :returns: A dictionary mapping node ids to node states.
+        :raises ConfigManagerError: if any of the queries failed.
+        """
+        log.debug("[CM] Querying node states of infrastructure %r", infra_id)
+        states = dict()
+        for result in self.for_each_section(
+                infra_id, lambda cfg, cm: self.perform_command(
+                    cm, cm.cri_get_infrastructure_state(infra_id))):
+            states.update(result)
+        return states
 
     def get_node_attribute(self, node_id, attribute):
         node = self.infobroker.get('node.find_one', node_id = node_id)
         cfg = node['resolved_node_definition']
         cm = self.instantiate_cm_with_node_def(cfg)
-        return cm.cri_get_node_attribute(node_id, attribute).perform(cm)
+        return self.perform_command(cm, cm.cri_get_node_attribute(node_id, attribute))
+
+    def get_node_attributes(self, node_id, attributes):
+        """
+        Query many attributes of a node at once.
+
+        :param attributes: A list of attribute specifications, each a dotted
+            string or a sequence of keys.
+        :returns: A dictionary mapping the dotted form of each attribute to
+            its value.
+        """
+        node = self.infobroker.get('node.find_one', node_id = node_id)
+        cfg = node['resolved_node_definition']
+        cm = self.instantiate_cm_with_node_def(cfg)
+        return self.perform_command(
+            cm, cm.cri_get_node_attributes(node_id, attributes))
 
     def resolve_attributes(self, node_def):
         cm = self.instantiate_cm_with_node_def(node_def)
-        return cm.cri_resolve_attributes(node_def).perform(cm)
+        return self.perform_command(cm, cm.cri_resolve_attributes(node_def))
@@ -0,0 +1,198 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Asyncio interface of the Configuration Manager module
+
+"""
+
+__all__ = [ 'AsyncConfigManager' ]
+
+import asyncio
+import inspect
+import logging
+import time
+import occo.constants.status as status
+from occo.configmanager import ConfigManager, section_label, section_error
+from occo.configmanager.metrics import backend_labels
+
+log = logging.getLogger('occo.configmanager')
+
+async def await_command(command, cm):
+    """
+    Await the :meth:`~occo.configmanager.Command.perform_async` of a command.
+
+    In dry-run mode, wet methods return their value immediately instead of an
+    awaitable; this is handled here.
+    """
+    result = command.perform_async(cm)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+class AsyncConfigManager(object):
+    """
+    Asyncio facade of :class:`~occo.configmanager.ConfigManager`.
+
+    Backend instances and their configuration are resolved through the
+    wrapped synchronous facade, so the two can be used side by side. Commands
+    are performed through their
+    :meth:`~occo.configmanager.Command.perform_async` method, so backends
+    that support it do not block the event loop.
+
+    :param config_manager: The synchronous facade to use; a new one is created
+        if unspecified.
+    """
+    def __init__(self, config_manager=None):
+        self.config_manager = config_manager or ConfigManager()
+
+    async def perform(self, command, cm):
+        """
+        Perform a command on a backend, recording its latency in the metrics
+        of the wrapped facade.
+        """
+        metrics = self.config_manager.metrics
+        if not metrics.enabled:
+            return await await_command(command, cm)
+        protocol, endpoint = backend_labels(cm)
+        labels = (('protocol', protocol), ('command', type(command).__name__),
+                  ('endpoint', endpoint))
+        start = time.perf_counter()
+        try:
+            result = await await_command(command, cm)
+        except Exception:
+            metrics.observe('occo_configmanager_command', labels,
+                            time.perf_counter() - start, True)
+            raise
+        metrics.observe('occo_configmanager_command', labels,
+                        time.perf_counter() - start)
+        return result
+
+    async def register_node(self, resolved_node_definition):
+        cm = self.config_manager.instantiate_cm_with_node_def(resolved_node_definition)
+        return await self.perform(cm.cri_register_node(resolved_node_definition), cm)
+
+    async def register_nodes(self, resolved_node_definitions):
+        """
+        Register many nodes at once. The nodes are grouped by backend, and
+        each backend registers its group, ensuring each role only once.
+
+        :returns: A dictionary mapping each node id to :data:`None` if the
+            node has been registered, or to the exception raised otherwise.
+            Nodes missing from the answer of their backend (e.g. in dry-run
+            mode) have not failed.
+        """
+        groups = self.config_manager.group_by_backend(resolved_node_definitions)
+        results = dict()
+        answers = await asyncio.gather(
+            *[self.perform(cm.cri_register_nodes(group), cm)
+              for cm, group in groups])
+        for (cm, group), result in zip(groups, answers):
+            results.update((d['node_id'], result.get(d['node_id']))
+                           for d in group)
+        return results
+
+    async def drop_node(self, instance_data):
+        cm = self.config_manager.instantiate_cm_with_node_def(instance_data)
+        return await self.perform(cm.cri_drop_node(instance_data), cm)
+
+    async def get_node_state(self, instance_data):
+        cm = self.config_manager.instantiate_cm_with_node_def(instance_data)
+        return await self.perform(cm.cri_get_node_state(instance_data), cm)
+
+    async def get_node_states(self, instance_data_list):
+        states = dict()
+        groups = self.config_manager.group_by_backend(instance_data_list)
+        results = await asyncio.gather(
+            *[self.perform(cm.cri_get_node_states(group), cm) for cm, group in groups])
+        for (cm, group), result in zip(groups, results):
+            states.update((i['node_id'], result.get(i['node_id'], status.UNKNOWN))
+                          for i in group)
+        return states
+
+    def config_sections(self, infra_id):
+        cfgmgr = self.config_manager
+        return [cfgmgr.instantiate_cm_with_config_section(cfg)
+                for cfg in cfgmgr.get_config_managers(infra_id)]
+
+    async def create_infrastructure(self, infra_id):
+        log.debug("[CM] Building necessary environments for infrastructure %r", infra_id)
+        await asyncio.gather(
+            *[self.perform(cm.cri_create_infrastructure(infra_id), cm)
+              for cm in self.config_sections(infra_id)])
+
+    async def drop_infrastructure(self, infra_id):
+        log.debug("[CM] Destroying environments for infrastructure %r", infra_id)
+        try:
+            return await asyncio.gather(
+                *[self.perform(cm.cri_drop_infrastructure(infra_id), cm)
+                  for cm in self.config_sections(infra_id)])
+        finally:
+            self.config_manager.invalidate_infrastructure(infra_id)
+
+    async def infrastructure_exists(self, infra_id):
+        log.debug("[CM] Checking necessary environments for infrastructure %r", infra_id)
+        results = await asyncio.gather(
+            *[self.perform(cm.cri_infrastructure_exists(infra_id), cm)
+              for cm in self.config_sections(infra_id)])
+        return all(results)
+
+    async def get_infrastructure_state(self, infra_id):
+        """
+        Awaitable variant of
+        :meth:`~occo.configmanager.ConfigManager.get_infrastructure_state`.
+
+        :raises ConfigManagerError: if any of the queries failed.
+        """
+        cfgmgr = self.config_manager
+        sections = list(cfgmgr.get_config_managers(infra_id))
+        async def query(cfg):
+            cm = cfgmgr.instantiate_cm_with_config_section(cfg)
+            return await self.perform(cm.cri_get_infrastructure_state(infra_id), cm)
+        results = await asyncio.gather(
+            *[query(cfg) for cfg in sections], return_exceptions=True)
+        states, errors = dict(), dict()
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                errors[section_label(i, sections[i])] = result
+            else:
+                states.update(result)
+        if errors:
+            raise section_error(errors, len(sections))
+        return states
+
+    async def get_node_attribute(self, node_id, attribute):
+        node = self.config_manager.infobroker.get('node.find_one', node_id = node_id)
+        cm = self.config_manager.instantiate_cm_with_node_def(
+            node['resolved_node_definition'])
+        return await self.perform(cm.cri_get_node_attribute(node_id, attribute), cm)
+
+    async def get_node_attributes(self, node_id, attributes):
+        node = self.config_manager.infobroker.get('node.find_one', node_id = node_id)
+        cm = self.config_manager.instantiate_cm_with_node_def(
+            node['resolved_node_definition'])
+        return await self.perform(cm.cri_get_node_attributes(node_id, attributes), cm)
+
+    async def resolve_attributes(self, node_def):
+        cm = self.config_manager.instantiate_cm_with_node_def(node_def)
+        return await self.perform(cm.cri_resolve_attributes(node_def), cm)
+
+    async def close(self):
+        """
+        Release the asynchronous resources (e.g. HTTP sessions) held by the
+        pooled backends.
+        """
+        for cm in self.config_manager.backend_pool.values():
+            close = getattr(cm, 'close_async', None)
+            if close is not None:
+                await close()
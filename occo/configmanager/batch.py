@@ -0,0 +1,166 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Concurrent execution of Configuration Manager commands
+
+"""
+
+__all__ = [ 'CommandBatch', 'BatchResult', 'DependencyFailed' ]
+
+import logging
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+log = logging.getLogger('occo.configmanager')
+
+BatchResult = namedtuple('BatchResult', 'command value error')
+BatchResult.__doc__ = """
+Outcome of a command in a :class:`CommandBatch`: either ``value`` is the
+result of the command, or ``error`` is the exception it raised.
+"""
+
+class DependencyFailed(Exception):
+    """
+    Recorded as the error of a command that was not performed because one of
+    its dependencies failed.
+
+    :ivar int dependency: The index of the failed dependency.
+    """
+    def __init__(self, index, dependency):
+        Exception.__init__(
+            self, 'Command #{0} skipped: dependency #{1} failed'
+            .format(index, dependency))
+        self.dependency = dependency
+
+def perform(cm, command):
+    return command.perform(cm)
+
+class CommandBatch(object):
+    """
+    A set of commands with dependencies among them.
+
+    Commands are performed concurrently, each as soon as all of its
+    dependencies have completed. If a dependency fails, the commands
+    depending on it (directly or indirectly) are not performed.
+
+    Example::
+
+        batch = config_manager.command_batch()
+        env = batch.add(cm, cm.cri_create_infrastructure(infra_id))
+        for node_def in node_defs:
+            batch.add(cm, cm.cri_register_node(node_def), depends_on=[env])
+        results = batch.run()
+
+    :param perform: Called as ``perform(cm, command)`` to perform a command.
+    :param executor: The executor to perform the commands with. If
+        unspecified, a new one is created with ``max_workers`` threads for
+        each :meth:`run`.
+    :param int max_workers: Maximum number of concurrently performed
+        commands if no executor is specified.
+    """
+    def __init__(self, perform=perform, executor=None, max_workers=8):
+        self.perform = perform
+        self.executor = executor
+        self.max_workers = max_workers
+        self.steps = list()
+
+    def add(self, cm, command, depends_on=()):
+        """
+        Add a command to the batch.
+
+        :param cm: The backend to perform the command on.
+        :param depends_on: Handles of commands that must complete before this
+            one is performed.
+        :returns: The handle of the command, to be used in ``depends_on``.
+        """
+        index = len(self.steps)
+        depends_on = frozenset(depends_on)
+        for d in depends_on:
+            if not 0 <= d < index:
+                raise ValueError(
+                    'Unknown dependency of command #{0}: {1!r}'.format(index, d))
+        self.steps.append((cm, command, depends_on))
+        return index
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self):
+        """
+        Perform the commands.
+
+        :returns: A list of :class:`BatchResult`, in the order the commands
+            were added.
+        """
+        steps = self.steps
+        results = [None] * len(steps)
+        waiting = [len(deps) for _, _, deps in steps]
+        failed_dependency = [None] * len(steps)
+        dependents = [list() for _ in steps]
+        for i, (_, _, deps) in enumerate(steps):
+            for d in deps:
+                dependents[d].append(i)
+
+        executor = self.executor
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='occo-configmanager-batch')
+
+        futures = dict()
+        ready = deque(i for i, n in enumerate(waiting) if n == 0)
+        try:
+            while ready or futures:
+                # Completing a command may make others ready; commands
+                # skipped because of a failed dependency complete at once.
+                while ready:
+                    i = ready.popleft()
+                    cm, command, _ = steps[i]
+                    if failed_dependency[i] is None:
+                        futures[executor.submit(self.perform, cm, command)] = i
+                        continue
+                    results[i] = BatchResult(
+                        command, None, DependencyFailed(i, failed_dependency[i]))
+                    self.release(i, results, dependents, waiting,
+                                 failed_dependency, ready)
+
+                if not futures:
+                    break
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    command = steps[i][1]
+                    try:
+                        results[i] = BatchResult(command, future.result(), None)
+                    except Exception as ex:
+                        log.error('[CM] Command #%d (%s) failed: %s',
+                                  i, type(command).__name__, ex)
+                        results[i] = BatchResult(command, None, ex)
+                    self.release(i, results, dependents, waiting,
+                                 failed_dependency, ready)
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False)
+        return results
+
+    def release(self, i, results, dependents, waiting, failed_dependency,
+                ready):
+        # Command #i has completed; update the commands depending on it.
+        for j in dependents[i]:
+            waiting[j] -= 1
+            if results[i].error is not None and failed_dependency[j] is None:
+                failed_dependency[j] = i
+            if waiting[j] == 0:
+                ready.append(j)
@@ -0,0 +1,248 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Caching primitives for the Configuration Manager module
+
+"""
+
+__all__ = [ 'TTLCache', 'SingleFlight', 'canonical_hash' ]
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+def canonical_hash(data, sort_keys=True):
+    """
+    Compute a stable digest of a JSON-like data structure.
+
+    :param data: Dictionaries, lists and scalars; anything else is hashed by
+        its ``repr``.
+    :param bool sort_keys: When :data:`False`, the order of dictionary keys is
+        significant, i.e. differently ordered dictionaries hash differently.
+    """
+    dump = json.dumps(data, sort_keys=sort_keys, default=repr,
+                      separators=(',', ':'))
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+class TTLCache(object):
+    """
+    Thread-safe, size-bounded LRU mapping with optional expiry of entries.
+
+    :param int maxsize: Maximum number of entries; the least recently used
+        entry is evicted when exceeded. :data:`None` means unbounded.
+    :param float ttl: Default lifetime of entries in seconds; :data:`None`
+        means entries do not expire.
+    :param on_discard: Called as ``on_discard(key, value)``, without holding
+        the lock, for each value dropped by the cache: expired, evicted,
+        replaced, removed by :meth:`discard_if` or :meth:`clear`, or created
+        by :meth:`get_or_set` but not stored. Values removed by :meth:`pop`
+        are returned to the caller instead.
+    """
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic,
+                 on_discard=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.on_discard = on_discard
+        self.lock = threading.RLock()
+        self.data = OrderedDict()
+        self.discarded = list()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _discard(self, key, value):
+        # Must be called with the lock held
+        if self.on_discard is not None:
+            self.discarded.append((key, value))
+
+    def _notify(self):
+        # Must be called without holding the lock
+        if self.on_discard is None:
+            return
+        with self.lock:
+            discarded, self.discarded = self.discarded, list()
+        for key, value in discarded:
+            self.on_discard(key, value)
+
+    def _lookup(self, key):
+        # Must be called with the lock held
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= self.clock():
+            del self.data[key]
+            self.expirations += 1
+            self._discard(key, entry[0])
+            return None
+        self.data.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, ttl):
+        # Must be called with the lock held
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.clock() + ttl
+        old = self.data.get(key)
+        if old is not None and old[0] is not value:
+            self._discard(key, old[0])
+        self.data[key] = (value, expires)
+        self.data.move_to_end(key)
+        while self.maxsize is not None and len(self.data) > self.maxsize:
+            evicted, entry = self.data.popitem(last=False)
+            self.evictions += 1
+            self._discard(evicted, entry[0])
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._notify()
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._store(key, value, ttl)
+        self._notify()
+
+    def get_or_set(self, key, factory, ttl=None):
+        """
+        Return the cached value for ``key``, calling ``factory()`` to create
+        it on a miss. The factory is called without holding the lock; if
+        another thread stores a value in the meantime, that value wins.
+        """
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._notify()
+        if entry is not None:
+            return entry[0]
+        value = factory()
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self._store(key, value, ttl)
+            else:
+                self._discard(key, value)
+                value = entry[0]
+        self._notify()
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def discard_if(self, predicate):
+        """
+        Remove every entry whose key satisfies ``predicate``.
+
+        :returns: The number of removed entries.
+        """
+        with self.lock:
+            keys = [k for k in self.data if predicate(k)]
+            for k in keys:
+                self._discard(k, self.data.pop(k)[0])
+        self._notify()
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            for key, entry in self.data.items():
+                self._discard(key, entry[0])
+            self.data.clear()
+        self._notify()
+
+    def keys(self):
+        """
+        A snapshot of the stored keys, including expired ones that have not
+        been purged yet.
+        """
+        with self.lock:
+            return list(self.data)
+
+    def values(self):
+        """
+        A snapshot of the stored values, including expired ones that have not
+        been purged yet.
+        """
+        with self.lock:
+            return [entry[0] for entry in self.data.values()]
+
+    def items(self):
+        """
+        A snapshot of the stored ``(key, value)`` pairs, including expired
+        ones that have not been purged yet.
+        """
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.data.items()]
+
+    def __contains__(self, key):
+        with self.lock:
+            found = self._lookup(key) is not None
+        self._notify()
+        return found
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        with self.lock:
+            return dict(size=len(self.data), maxsize=self.maxsize,
+                        hits=self.hits, misses=self.misses,
+                        evictions=self.evictions,
+                        expirations=self.expirations)
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls made with the same key: while a call is in
+    flight, further callers wait for its result instead of calling again.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+
+    def do(self, key, fun):
+        """
+        Return ``fun()``, or the result of the identical call in flight.
+        Exceptions are propagated to every waiting caller.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = fun()
+        except BaseException as ex:
+            call.set_exception(ex)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def __len__(self):
+        return len(self.calls)
@@ -0,0 +1,263 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Adaptive concurrency limiting of requests to configuration management
+servers
+
+"""
+
+__all__ = [ 'AdaptiveLimiter', 'LimiterTimeout', 'get_limiter',
+            'limiter_stats' ]
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger('occo.configmanager')
+
+class LimiterTimeout(Exception):
+    """
+    Raised when a request could not be started because the queue of the
+    limiter was full, or the request waited too long in it.
+    """
+    pass
+
+class AdaptiveLimiter(object):
+    """
+    Limits the number of requests in flight, adapting the limit with AIMD
+    (additive increase, multiplicative decrease):
+
+    - When a request succeeds in time while at least half of the limit is
+      used, the limit grows by ``1/limit``, i.e. by about one per round trip.
+    - When a request signals overload (an error or a latency above the
+      threshold), the limit is multiplied by ``backoff``; at most once per
+      round trip, so a burst of failures counts once.
+
+    Requests of different kinds (e.g. fetching a node and searching) take
+    different times even on an idle server, so latencies are compared per
+    request class, given to :meth:`release`. The latency threshold of a class
+    is ``latency_tolerance`` times its baseline latency, but at least
+    ``min_latency_threshold`` seconds. The baseline is the lowest latency
+    observed, drifting towards the latencies under the threshold with a time
+    constant of ``baseline_window`` seconds, so it follows lasting changes of
+    the server, but not the queueing of a burst.
+
+    Requests over the limit wait in a queue of at most ``max_queue`` entries
+    for at most ``max_wait`` seconds.
+    """
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=100,
+                 backoff=0.75, latency_tolerance=2.0,
+                 min_latency_threshold=0.05, baseline_window=600,
+                 max_queue=1000, max_wait=30, clock=time.monotonic):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_threshold = min_latency_threshold
+        self.baseline_window = baseline_window
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        # request class -> [baseline latency, time of last update]
+        self.baselines = dict()
+        # (event loop, future) of the coroutines waiting in acquire_async
+        self.async_waiters = collections.deque()
+        self.last_decrease = None
+        self.completed = self.overloads = self.rejected = self.timeouts = 0
+
+    def acquire(self):
+        """
+        Wait until a request may be started.
+
+        :returns: The start time of the request, to be passed to
+            :meth:`release`.
+        :raises LimiterTimeout: if the queue is full, or the wait timed out.
+        """
+        with self.cond:
+            if self.in_flight >= int(self.limit):
+                if self.queued >= self.max_queue:
+                    self.rejected += 1
+                    raise LimiterTimeout(
+                        'Too many queued requests ({0})'.format(self.queued))
+                deadline = self.clock() + self.max_wait
+                self.queued += 1
+                try:
+                    while self.in_flight >= int(self.limit):
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise LimiterTimeout(
+                                'Request waited more than {0}s in queue'
+                                .format(self.max_wait))
+                        self.cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            return self.clock()
+
+    async def acquire_async(self):
+        """
+        Awaitable variant of :meth:`acquire`. Waiting coroutines are granted
+        slots by :meth:`release` through the event loop, without blocking a
+        thread. If the waiting coroutine is cancelled, its slot is given back.
+        """
+        with self.cond:
+            if self.in_flight < int(self.limit) and not self.async_waiters:
+                self.in_flight += 1
+                return self.clock()
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise LimiterTimeout(
+                    'Too many queued requests ({0})'.format(self.queued))
+            loop = asyncio.get_event_loop()
+            waiter = (loop, loop.create_future())
+            self.async_waiters.append(waiter)
+            self.queued += 1
+        future = waiter[1]
+        try:
+            return await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self.withdraw(waiter)
+            with self.cond:
+                self.timeouts += 1
+            raise LimiterTimeout('Request waited more than {0}s in queue'
+                                 .format(self.max_wait))
+        except asyncio.CancelledError:
+            self.withdraw(waiter)
+            raise
+
+    def withdraw(self, waiter):
+        """
+        Remove an asynchronous waiter that gave up waiting. If it has been
+        granted a slot meanwhile, the slot is given back.
+        """
+        loop, future = waiter
+        with self.cond:
+            try:
+                self.async_waiters.remove(waiter)
+            except ValueError:
+                pass
+            else:
+                self.queued -= 1
+                return
+        # Granted; if the grant has already been delivered, it is ours to
+        # give back. Otherwise it is given back on delivery (see deliver).
+        if future.done() and not future.cancelled():
+            self.abandon()
+
+    def grant(self):
+        """
+        Hand free slots to the asynchronous waiters. Must be called with the
+        lock held.
+        """
+        while self.async_waiters and self.in_flight < int(self.limit):
+            loop, future = self.async_waiters.popleft()
+            self.queued -= 1
+            self.in_flight += 1
+            try:
+                loop.call_soon_threadsafe(self.deliver, future, self.clock())
+            except RuntimeError:
+                # Event loop closed
+                self.in_flight -= 1
+
+    def deliver(self, future, start):
+        if future.done():
+            # Cancelled before the grant arrived
+            self.abandon()
+        else:
+            future.set_result(start)
+
+    def abandon(self):
+        """
+        Give back a slot without recording a request.
+        """
+        with self.cond:
+            self.in_flight -= 1
+            self.grant()
+            self.cond.notify_all()
+
+    def release(self, start, overloaded=False, request_class=None):
+        """
+        Record the completion of a request started at ``start``.
+
+        :param bool overloaded: Whether the request failed in a way that
+            signals overload of the server.
+        :param request_class: The kind of the request; its latency is compared
+            to the latencies of the same kind only.
+        """
+        now = self.clock()
+        latency = now - start
+        with self.cond:
+            used = 2 * self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.completed += 1
+            entry = self.baselines.get(request_class)
+            if entry is None or latency < entry[0]:
+                entry = self.baselines[request_class] = [latency, now]
+            threshold = max(self.min_latency_threshold,
+                            entry[0] * self.latency_tolerance)
+            if latency <= threshold:
+                # Slow latencies are overload, not a change of the baseline
+                weight = min(1.0, (now - entry[1]) / self.baseline_window)
+                entry[0] += (latency - entry[0]) * weight
+                entry[1] = now
+            if overloaded or latency > threshold:
+                self.overloads += 1
+                if self.last_decrease is None \
+                        or now - self.last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.last_decrease = now
+                    log.debug('[CM] Concurrency limit decreased to %d',
+                              int(self.limit))
+            elif used:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.grant()
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return dict(limit=int(self.limit), in_flight=self.in_flight,
+                        queued=self.queued, max_queue=self.max_queue,
+                        baseline_latency=dict(
+                            (k, v[0]) for k, v in self.baselines.items()),
+                        completed=self.completed, overloads=self.overloads,
+                        rejected=self.rejected, timeouts=self.timeouts)
+
+limiters = dict()
+limiters_lock = threading.Lock()
+
+def get_limiter(endpoint, **kwargs):
+    """
+    Return the limiter shared by every user of ``endpoint``, creating it with
+    ``kwargs`` if necessary.
+    """
+    with limiters_lock:
+        limiter = limiters.get(endpoint)
+        if limiter is None:
+            limiter = limiters[endpoint] = AdaptiveLimiter(**kwargs)
+        return limiter
+
+def limiter_stats():
+    """
+    The current state of the limiter of each endpoint.
+    """
+    with limiters_lock:
+        items = list(limiters.items())
+    return dict((endpoint, limiter.stats()) for endpoint, limiter in items)
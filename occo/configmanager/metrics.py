@@ -0,0 +1,150 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Latency metrics of the Configuration Manager module
+
+"""
+
+__all__ = [ 'Metrics', 'backend_labels' ]
+
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def backend_labels(cm):
+    """
+    Return the ``(protocol, endpoint)`` labels of a backend instance, as
+    recorded by :class:`~occo.configmanager.pool.BackendPool`.
+    """
+    key = getattr(cm, 'backend_key', None)
+    if key is None:
+        return (type(cm).__name__, '')
+    return (key[0], key[1] or '')
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+class Metrics(object):
+    """
+    Collects latency histograms, call counts and error counts of labelled
+    operations.
+
+    When disabled, :meth:`timed` calls the function directly; the overhead is
+    a single attribute check.
+
+    :param bool enabled: Whether to collect metrics.
+    :param buckets: Upper bounds of the histogram buckets in seconds.
+    """
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # (name, label names) -> label values -> Histogram
+        self.series = dict()
+
+    def observe(self, name, labels, seconds, error=False):
+        """
+        Record an observation.
+
+        :param str name: Name of the metric.
+        :param labels: Sequence of ``(label, value)`` pairs.
+        """
+        label_names = tuple(l for l, _ in labels)
+        label_values = tuple(v for _, v in labels)
+        with self.lock:
+            family = self.series.setdefault((name, label_names), dict())
+            hist = family.get(label_values)
+            if hist is None:
+                hist = family[label_values] = Histogram(self.buckets)
+            hist.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist.sum += seconds
+            hist.count += 1
+            if error:
+                hist.errors += 1
+
+    def timed(self, name, labels, fun, *args):
+        """
+        Call ``fun(*args)`` and record its latency and whether it raised.
+        """
+        if not self.enabled:
+            return fun(*args)
+        start = time.perf_counter()
+        try:
+            result = fun(*args)
+        except Exception:
+            self.observe(name, labels, time.perf_counter() - start, True)
+            raise
+        self.observe(name, labels, time.perf_counter() - start)
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+    def snapshot(self):
+        """
+        Return the collected metrics as plain data, e.g. for the info broker.
+        Bucket counts are cumulative, keyed by their upper bound.
+        """
+        result = dict()
+        with self.lock:
+            for (name, label_names), family in self.series.items():
+                entries = result.setdefault(name, list())
+                for label_values, hist in family.items():
+                    cumulative, buckets = 0, dict()
+                    for bound, count in zip(self.buckets + ('+Inf',), hist.counts):
+                        cumulative += count
+                        buckets[str(bound)] = cumulative
+                    entries.append(dict(
+                        labels=dict(zip(label_names, label_values)),
+                        count=hist.count, errors=hist.errors, sum=hist.sum,
+                        buckets=buckets))
+        return result
+
+    def prometheus_text(self):
+        """
+        Return the collected metrics in the Prometheus text exposition
+        format. Each metric is exported as a histogram (``<name>_seconds``)
+        and an error counter (``<name>_errors_total``).
+        """
+        def fmt_labels(pairs):
+            return '{' + ','.join(
+                '{0}="{1}"'.format(k, str(v).replace('\\', '\\\\')
+                                             .replace('"', '\\"')
+                                             .replace('\n', '\\n'))
+                for k, v in pairs) + '}'
+
+        lines = list()
+        for name, entries in sorted(self.snapshot().items()):
+            lines.append('# TYPE {0}_seconds histogram'.format(name))
+            for e in entries:
+                labels = sorted(e['labels'].items())
+                for bound, count in e['buckets'].items():
+                    lines.append('{0}_seconds_bucket{1} {2}'.format(
+                        name, fmt_labels(labels + [('le', bound)]), count))
+                lines.append('{0}_seconds_sum{1} {2}'.format(
+                    name, fmt_labels(labels), e['sum']))
+                lines.append('{0}_seconds_count{1} {2}'.format(
+                    name, fmt_labels(labels), e['count']))
+            lines.append('# TYPE {0}_errors_total counter'.format(name))
+            for e in entries:
+                lines.append('{0}_errors_total{1} {2}'.format(
+                    name, fmt_labels(sorted(e['labels'].items())), e['errors']))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,209 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" On-disk mirror of configuration management server state
+
+Records the roles, environments and node states seen on configuration
+management servers in an SQLite database, so a restarted process can serve
+them before it has talked to the servers again.
+
+Writes are buffered and flushed in the background, so recording is cheap
+on the hot path; at most :data:`FLUSH_INTERVAL` seconds of changes are lost
+if the process dies.
+
+"""
+
+__all__ = [ 'LocalMirror', 'get_mirror' ]
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger('occo.configmanager')
+
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roles (
+    endpoint TEXT NOT NULL, name TEXT NOT NULL, seen REAL NOT NULL,
+    PRIMARY KEY (endpoint, name));
+CREATE TABLE IF NOT EXISTS environments (
+    endpoint TEXT NOT NULL, name TEXT NOT NULL, seen REAL NOT NULL,
+    PRIMARY KEY (endpoint, name));
+CREATE TABLE IF NOT EXISTS node_states (
+    endpoint TEXT NOT NULL, name TEXT NOT NULL, state TEXT NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (endpoint, name));
+"""
+
+TABLES = ('roles', 'environments', 'node_states')
+
+class LocalMirror(object):
+    """
+    SQLite-backed record of roles, environments and node states, per
+    endpoint. Thread-safe.
+
+    :param str path: The database file.
+    """
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, clock=time.time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        # table -> (endpoint, name) -> row to insert, or None to delete
+        self.pending = dict((table, dict()) for table in TABLES)
+        self.flusher = None
+        self.closed = False
+
+    def record(self, table, endpoint, name, *values):
+        with self.lock:
+            self.pending[table][(endpoint, name)] = \
+                (endpoint, name) + values + (self.clock(),)
+            self.start_flusher()
+
+    def forget(self, table, endpoint, name):
+        with self.lock:
+            self.pending[table][(endpoint, name)] = None
+            self.start_flusher()
+
+    def start_flusher(self):
+        # Must be called with the lock held
+        if self.flusher is None and not self.closed:
+            self.flusher = threading.Timer(self.flush_interval, self.flush)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def flush(self):
+        """
+        Write the buffered changes to the database.
+        """
+        with self.lock:
+            self.flusher = None
+            pending = self.pending
+            self.pending = dict((table, dict()) for table in TABLES)
+            try:
+                for table, changes in pending.items():
+                    deleted = [key for key, row in changes.items() if row is None]
+                    rows = [row for row in changes.values() if row is not None]
+                    if deleted:
+                        self.db.executemany(
+                            'DELETE FROM {0} WHERE endpoint=? AND name=?'
+                            .format(table), deleted)
+                    if rows:
+                        self.db.executemany(
+                            'INSERT OR REPLACE INTO {0} VALUES ({1})'.format(
+                                table, ','.join('?' * len(rows[0]))), rows)
+                self.db.commit()
+            except sqlite3.Error as ex:
+                log.error('[CM] Writing local mirror %r failed: %s',
+                          self.path, ex)
+
+    def query(self, table, columns, endpoint, max_age=None):
+        """
+        :param float max_age: If specified, rows recorded more than this many
+            seconds ago are ignored.
+        """
+        self.flush()
+        since = -1 if max_age is None else self.clock() - max_age
+        with self.lock:
+            return self.db.execute(
+                'SELECT {0} FROM {1} WHERE endpoint=? AND seen>=?'.format(
+                    columns, table), (endpoint, since)).fetchall()
+
+    def record_role(self, endpoint, name):
+        self.record('roles', endpoint, name)
+
+    def forget_role(self, endpoint, name):
+        self.forget('roles', endpoint, name)
+
+    def roles(self, endpoint, max_age=None):
+        return [name for name, in
+                self.query('roles', 'name', endpoint, max_age)]
+
+    def record_environment(self, endpoint, name):
+        self.record('environments', endpoint, name)
+
+    def forget_environment(self, endpoint, name):
+        self.forget('environments', endpoint, name)
+
+    def environments(self, endpoint, max_age=None):
+        return [name for name, in
+                self.query('environments', 'name', endpoint, max_age)]
+
+    def record_node_state(self, endpoint, name, state):
+        self.record('node_states', endpoint, name, state)
+
+    def forget_node_state(self, endpoint, name):
+        self.forget('node_states', endpoint, name)
+
+    def node_states(self, endpoint, max_age=None):
+        """
+        :returns: A dictionary mapping node names to ``(state, seen)`` pairs,
+            ``seen`` being the time the state was recorded.
+        """
+        return dict((name, (state, seen)) for name, state, seen in
+                    self.query('node_states', 'name, state, seen', endpoint,
+                               max_age))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.flusher is not None:
+                self.flusher.cancel()
+        self.flush()
+        with self.lock:
+            self.db.close()
+
+mirrors = dict()
+mirrors_lock = threading.Lock()
+warm_started = set()
+
+def get_mirror(path):
+    """
+    Return the mirror stored in ``path``, shared by every user of the file
+    in this process.
+    """
+    with mirrors_lock:
+        mirror = mirrors.get(path)
+        if mirror is None:
+            mirror = mirrors[path] = LocalMirror(path)
+        return mirror
+
+def claim_warm_start(path, endpoint):
+    """
+    Whether the state of ``endpoint`` recorded in the mirror ``path`` is to
+    be loaded: only the first time it is asked for in this process. Later
+    backend instances (e.g. re-created by the backend pool) find the server
+    state in their caches or on the server.
+    """
+    with mirrors_lock:
+        if (path, endpoint) in warm_started:
+            return False
+        warm_started.add((path, endpoint))
+        return True
+
+@atexit.register
+def close_mirrors():
+    with mirrors_lock:
+        items = list(mirrors.values())
+        mirrors.clear()
+    for mirror in items:
+        mirror.close()
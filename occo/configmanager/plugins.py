@@ -0,0 +1,110 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Lazy loading of Configuration Manager plugins
+
+Plugin modules register their backends with :func:`occo.util.factory.register`
+when imported. Instead of importing every plugin (and its dependencies) up
+front, the module implementing a protocol is imported the first time a
+backend is instantiated for that protocol.
+
+The module of a protocol is looked up in :data:`PLUGIN_MODULES` (the plugins
+shipped with this package), then among the entry points of the
+:data:`ENTRY_POINT_GROUP` group, where the name of each entry point is the
+protocol and its value is the module, e.g.::
+
+    entry_points={
+        'occo.configmanager.plugins': [
+            'my_protocol = my_package.my_plugin',
+        ],
+    }
+
+"""
+
+__all__ = [ 'LazyMultiBackend', 'PLUGIN_MODULES', 'ENTRY_POINT_GROUP',
+            'plugin_module', 'load_plugin' ]
+
+import importlib
+import logging
+import threading
+import occo.util.factory as factory
+
+log = logging.getLogger('occo.configmanager')
+
+ENTRY_POINT_GROUP = 'occo.configmanager.plugins'
+
+PLUGIN_MODULES = dict(
+    chef='occo.plugins.configmanager.chef',
+    chef_sharded='occo.plugins.configmanager.chef_sharded',
+    dummy='occo.plugins.configmanager.dummy',
+    puppet_solo='occo.plugins.configmanager.puppet_solo',
+)
+
+entry_point_lock = threading.Lock()
+entry_point_modules = None
+
+def get_entry_point_modules():
+    """
+    Scan the installed distributions for plugin entry points, once.
+
+    :returns: A dictionary mapping protocols to module names.
+    """
+    global entry_point_modules
+    with entry_point_lock:
+        if entry_point_modules is None:
+            modules = dict()
+            try:
+                from importlib.metadata import entry_points
+            except ImportError:
+                import pkg_resources
+                for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+                    modules[ep.name] = ep.module_name
+            else:
+                eps = entry_points()
+                eps = eps.select(group=ENTRY_POINT_GROUP) \
+                    if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, [])
+                for ep in eps:
+                    modules[ep.name] = ep.value.split(':')[0].strip()
+            entry_point_modules = modules
+        return entry_point_modules
+
+def plugin_module(protocol):
+    """
+    Return the name of the module implementing ``protocol``, or :data:`None`
+    if unknown.
+    """
+    return PLUGIN_MODULES.get(protocol) or get_entry_point_modules().get(protocol)
+
+def load_plugin(base, protocol):
+    """
+    Import the module implementing ``protocol`` unless a backend of ``base``
+    is already registered for it.
+    """
+    if protocol in getattr(base, 'backends', dict()):
+        return
+    module = plugin_module(protocol)
+    if module is not None:
+        log.debug('[CM] Loading plugin module %r for protocol %r',
+                  module, protocol)
+        importlib.import_module(module)
+
+class LazyMultiBackend(factory.MultiBackend):
+    """
+    :class:`~occo.util.factory.MultiBackend` that imports the plugin module
+    of a protocol on its first instantiation.
+    """
+    @classmethod
+    def instantiate(cls, protocol, *args, **kwargs):
+        load_plugin(cls, protocol)
+        return super(LazyMultiBackend, cls).instantiate(protocol, *args, **kwargs)
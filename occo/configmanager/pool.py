@@ -0,0 +1,123 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Pool of Configuration Manager backend instances
+
+"""
+
+__all__ = [ 'BackendPool', 'backend_key', 'section_endpoint',
+            'BACKEND_OPTIONS' ]
+
+import logging
+from occo.configmanager.cache import TTLCache, canonical_hash
+
+log = logging.getLogger('occo.configmanager')
+
+BACKEND_OPTIONS = ('max_connections', 'mirror', 'mirror_max_age',
+                   'virtual_nodes')
+
+def section_endpoint(cfg):
+    """
+    The endpoint of a ``config_management`` section; for sections listing
+    several ``endpoints`` (e.g. sharded backends), the sorted list of these
+    joined with commas.
+    """
+    endpoint = cfg.get('endpoint')
+    if endpoint is None and cfg.get('endpoints'):
+        endpoint = ','.join(sorted(cfg['endpoints']))
+    return endpoint
+
+def endpoint_matches(key_endpoint, endpoint):
+    return endpoint is None or \
+        endpoint in (key_endpoint or '').split(',')
+
+def backend_key(cfg, auth_data):
+    """
+    Identify the backend instance serving a ``config_management`` section.
+
+    The key consists of the protocol, the endpoint, a digest of the
+    authentication data, so the credentials themselves are never kept in the
+    key, and a digest of the options the backend is constructed with
+    (:data:`BACKEND_OPTIONS`). Any other key of the section (e.g.
+    ``run_list``) is node-specific and is deliberately ignored.
+    """
+    options = dict((k, cfg[k]) for k in BACKEND_OPTIONS if k in cfg)
+    return (cfg['type'], section_endpoint(cfg), canonical_hash(auth_data),
+            canonical_hash(options))
+
+class BackendPool(object):
+    """
+    Bounded pool of backend instances, so repeated operations against the
+    same endpoint reuse an already initialised backend (e.g. a
+    :class:`chef.ChefAPI` with its key already parsed).
+
+    :param factory: Called as ``factory(protocol=..., auth_data=..., **cfg)``
+        to create a backend on a miss; typically
+        :meth:`ConfigManager.instantiate`.
+    :param int maxsize: Maximum number of pooled instances (LRU eviction).
+    :param float ttl: Lifetime of a pooled instance in seconds.
+
+    Instances leaving the pool (evicted, expired or invalidated) are closed
+    by calling their ``close()`` method, if they have one, so their
+    connections are released.
+    """
+    def __init__(self, factory, maxsize=64, ttl=600):
+        self.factory = factory
+        self.instances = TTLCache(maxsize=maxsize, ttl=ttl,
+                                  on_discard=self.discard)
+
+    def get(self, cfg, auth_data):
+        key = backend_key(cfg, auth_data)
+        return self.instances.get_or_set(
+            key, lambda: self.create(key, cfg, auth_data))
+
+    def create(self, key, cfg, auth_data):
+        log.debug("[CM] Instantiating %r backend for %r",
+                  cfg['type'], key[1] or '<undefined>')
+        instance = self.factory(protocol=cfg['type'], auth_data=auth_data, **cfg)
+        instance.backend_key = key
+        return instance
+
+    def discard(self, key, instance):
+        close = getattr(instance, 'close', None)
+        if close is None:
+            return
+        log.debug("[CM] Closing %r backend for %r",
+                  key[0], key[1] or '<undefined>')
+        try:
+            close()
+        except Exception:
+            log.exception("[CM] Closing %r backend for %r failed:",
+                          key[0], key[1] or '<undefined>')
+
+    def invalidate(self, protocol=None, endpoint=None):
+        """
+        Drop pooled instances, e.g. after credentials have been rotated.
+        Without arguments, every instance is dropped. Instances using several
+        endpoints are dropped if any of them matches ``endpoint``.
+
+        :returns: The number of dropped instances.
+        """
+        def matches(key):
+            return (protocol is None or key[0] == protocol) \
+                and endpoint_matches(key[1], endpoint)
+        count = self.instances.discard_if(matches)
+        log.debug("[CM] Invalidated %d pooled backend instance(s)", count)
+        return count
+
+    def values(self):
+        return self.instances.values()
+
+    def stats(self):
+        return self.instances.stats()
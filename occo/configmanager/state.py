@@ -0,0 +1,250 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Node state caching for the Configuration Manager module
+
+"""
+
+__all__ = [ 'NodeStateCache', 'NodeStatusTable', 'NodeStatusRecord' ]
+
+import itertools
+import threading
+import time
+import occo.constants.status as status
+from occo.configmanager.cache import SingleFlight
+
+class NodeStatusRecord(object):
+    """
+    The last known status of a node.
+
+    Records are kept for every tracked node, so they have no instance
+    dictionary; the strings and backend keys they refer to are shared.
+
+    :ivar backend: The key of the backend serving the node (see
+        :func:`~occo.configmanager.pool.backend_key`).
+    :ivar status: One of the :mod:`occo.constants.status` values.
+    :ivar int streak: Number of consecutive pending results before this one.
+    :ivar float checked: When the status was queried.
+    :ivar float expires: When the status must be queried again.
+    """
+    __slots__ = ('node_id', 'infra_id', 'backend', 'status', 'streak',
+                 'checked', 'expires')
+
+    def __init__(self, node_id, infra_id, backend, status, streak, checked,
+                 expires):
+        self.node_id = node_id
+        self.infra_id = infra_id
+        self.backend = backend
+        self.status = status
+        self.streak = streak
+        self.checked = checked
+        self.expires = expires
+
+class NodeStatusTable(object):
+    """
+    Thread-safe table of :class:`NodeStatusRecord` objects, indexed by node
+    id and by infrastructure id.
+
+    :param int maxsize: Maximum number of records. When exceeded, expired
+        records are purged, then the least recently updated ones, down to 90%
+        of ``maxsize``.
+    """
+    def __init__(self, maxsize=100000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.records = dict()
+        self.by_infra = dict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, node_id):
+        record = self.records.get(node_id)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def put(self, node_id, state, streak, expires, infra_id=None, backend=None):
+        with self.lock:
+            old = self.records.pop(node_id, None)
+            if old is not None:
+                if infra_id is None:
+                    infra_id = old.infra_id
+                if backend is None:
+                    backend = old.backend
+                self.unindex(old)
+            record = NodeStatusRecord(node_id, infra_id, backend, state,
+                                      streak, self.clock(), expires)
+            self.records[node_id] = record
+            if infra_id is not None:
+                self.by_infra.setdefault(infra_id, dict())[node_id] = record
+            if self.maxsize is not None and len(self.records) > self.maxsize:
+                self.shrink()
+            return record
+
+    def unindex(self, record):
+        # Must be called with the lock held
+        infra = self.by_infra.get(record.infra_id)
+        if infra is not None:
+            infra.pop(record.node_id, None)
+            if not infra:
+                del self.by_infra[record.infra_id]
+
+    def shrink(self):
+        # Must be called with the lock held. Shrinks to 90% of maxsize, so
+        # the cost of the scan is amortised over many insertions.
+        target = self.maxsize - self.maxsize // 10
+        now = self.clock()
+        for record in [r for r in self.records.values() if r.expires <= now]:
+            self.remove_record(record)
+        excess = len(self.records) - target
+        if excess > 0:
+            for record in list(itertools.islice(self.records.values(), excess)):
+                self.remove_record(record)
+
+    def remove_record(self, record):
+        # Must be called with the lock held
+        del self.records[record.node_id]
+        self.unindex(record)
+        self.evictions += 1
+
+    def pop(self, node_id):
+        with self.lock:
+            record = self.records.pop(node_id, None)
+            if record is not None:
+                self.unindex(record)
+            return record
+
+    def infrastructure(self, infra_id):
+        """
+        A snapshot of the records of an infrastructure.
+        """
+        with self.lock:
+            return list(self.by_infra.get(infra_id, dict()).values())
+
+    def pop_infrastructure(self, infra_id):
+        with self.lock:
+            records = self.by_infra.pop(infra_id, dict())
+            for node_id in records:
+                del self.records[node_id]
+            return len(records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.by_infra.clear()
+
+    def __len__(self):
+        return len(self.records)
+
+    def stats(self):
+        return dict(size=len(self.records), maxsize=self.maxsize,
+                    infrastructures=len(self.by_infra), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+class NodeStateCache(object):
+    """
+    Short-lived cache of node states with request coalescing.
+
+    The lifetime of an entry depends on the state: ready nodes rarely change,
+    so they are cached for ``ready_ttl`` seconds. Pending nodes are re-polled
+    with exponential backoff: after ``n`` consecutive pending results, the
+    state is cached for ``pending_ttl * 2**n`` seconds, at most
+    ``max_pending_ttl``. Any other state is cached for ``other_ttl`` seconds.
+
+    Concurrent queries of the same node share a single fetch. States are
+    stored in a :class:`NodeStatusTable`.
+    """
+    def __init__(self, ready_ttl=10, pending_ttl=1, max_pending_ttl=8,
+                 other_ttl=1, maxsize=100000, clock=time.monotonic):
+        self.ready_ttl = ready_ttl
+        self.pending_ttl = pending_ttl
+        self.max_pending_ttl = max_pending_ttl
+        self.other_ttl = other_ttl
+        self.clock = clock
+        # Expired records are kept until replaced, so the pending streak
+        # survives the expiry of the state.
+        self.table = NodeStatusTable(maxsize=maxsize, clock=clock)
+        self.in_flight = SingleFlight()
+
+    def ttl(self, state, streak):
+        if state == status.READY:
+            return self.ready_ttl
+        elif state == status.PENDING:
+            return min(self.pending_ttl * 2 ** streak, self.max_pending_ttl)
+        return self.other_ttl
+
+    def get(self, node_id):
+        """
+        Return the cached state of the node, or :data:`None`.
+        """
+        record = self.table.get(node_id)
+        if record is None or record.expires <= self.clock():
+            return None
+        return record.status
+
+    def put(self, node_id, state, infra_id=None, backend=None):
+        record = self.table.get(node_id)
+        streak = 0
+        if state == status.PENDING and record is not None \
+                and record.status == status.PENDING:
+            streak = record.streak + 1
+        self.table.put(node_id, state, streak,
+                       self.clock() + self.ttl(state, streak),
+                       infra_id, backend)
+        return state
+
+    def fetch(self, node_id, fun, infra_id=None):
+        """
+        Return the cached state of the node; or query it with ``fun()``,
+        coalescing concurrent queries, and cache the result.
+
+        :param fun: Returns the state, or a ``(state, backend key)`` pair.
+        """
+        state = self.get(node_id)
+        if state is not None:
+            return state
+
+        def query():
+            result = fun()
+            state, backend = result if isinstance(result, tuple) \
+                else (result, None)
+            return self.put(node_id, state, infra_id, backend)
+        return self.in_flight.do(node_id, query)
+
+    def infrastructure(self, infra_id):
+        """
+        The cached, unexpired states of the nodes of an infrastructure.
+
+        :returns: A dictionary mapping node ids to states.
+        """
+        now = self.clock()
+        return dict((r.node_id, r.status)
+                    for r in self.table.infrastructure(infra_id)
+                    if r.expires > now)
+
+    def invalidate(self, node_id=None):
+        if node_id is None:
+            self.table.clear()
+        else:
+            self.table.pop(node_id)
+
+    def invalidate_infrastructure(self, infra_id):
+        self.table.pop_infrastructure(infra_id)
+
+    def stats(self):
+        stats = self.table.stats()
+        stats['in_flight'] = len(self.in_flight)
+        return stats
@@ -22,17 +22,51 @@
 
 __all__  = [ 'ChefConfigManager' ]
 
-from occo.configmanager import ConfigManager, Command, CMSchemaChecker
+from occo.configmanager import ConfigManager, Command, CMSchemaChecker, \
+    dotted_attribute
+from occo.configmanager.cache import TTLCache, canonical_hash
+from occo.configmanager.limiter import get_limiter, LimiterTimeout
+from occo.configmanager.mirror import get_mirror, claim_warm_start
 import occo.util as util
 import occo.util.factory as factory
 import logging
+import asyncio
+import datetime
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import chef
-from chef.exceptions import ChefServerNotFoundError
-from occo.exceptions import SchemaError
+import requests
+import requests.adapters
+from urllib.parse import urlencode
+from chef.auth import sign_request
+from chef.exceptions import ChefServerError, ChefServerNotFoundError
+from chef.utils import json as chef_json
 import occo.constants.status as status
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 PROTOCOL_ID='chef'
 
+MAX_CONNECTIONS=10
+SEARCH_CHUNK_SIZE=100
+REGISTRATION_CONCURRENCY=8
+TEARDOWN_CONCURRENCY=8
+ROLE_CACHE_SIZE=4096
+ROLE_CACHE_TTL=300
+ATTRIBUTE_CACHE_SIZE=4096
+ATTRIBUTE_CACHE_TTL=300
+ENVIRONMENT_CACHE_SIZE=1024
+ENVIRONMENT_EXISTS_TTL=30
+ENVIRONMENT_MISSING_TTL=5
+SAVED_NODE_CACHE_SIZE=10000
+SAVED_NODE_CACHE_TTL=300
+MIRROR_MAX_AGE=3600
+QUERY_SPECIAL_CHARS=re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/ ])')
+
 log = logging.getLogger('occo.configmanager')
 
 class DummyCommand(Command):
@@ -43,31 +77,411 @@ class DummyCommand(Command):
     def perform(self, cm):
         return self.retval
 
+def escape_query(value):
+    """
+    Escape a value for use in a Chef (Lucene) search query.
+    """
+    return QUERY_SPECIAL_CHARS.sub(r'\\\1', str(value))
+
+def names_query(node_names):
+    """
+    Search query matching any of the given node names.
+    """
+    return 'name:({0})'.format(
+        ' OR '.join(escape_query(name) for name in node_names))
+
+def partial_search(api, index, query, keys, rows=1000):
+    """
+    Run a paginated partial search on the Chef server.
+
+    Only the requested ``keys`` of the matching objects are transferred,
+    instead of the complete objects returned by :class:`chef.Search`.
+
+    :param api: The :class:`chef.ChefAPI` to use.
+    :param str index: The index to search (``node``, ``role``, etc.).
+    :param str query: The search query.
+    :param dict keys: Maps result keys to attribute paths (lists of keys).
+
+    :returns: A generator of dictionaries, one for each matching object.
+    """
+    start = 0
+    while True:
+        url = '/search/{0}?{1}'.format(
+            index, urlencode(dict(q=query, rows=rows, start=start)))
+        result = api.api_request('POST', url, data=keys)
+        found = result.get('rows', list())
+        for row in found:
+            yield row.get('data', dict())
+        start += len(found)
+        if not found or start >= result.get('total', 0):
+            break
+
+async def partial_search_async(async_api, index, query, keys, rows=1000):
+    """
+    Coroutine variant of :func:`partial_search`.
+
+    :returns: The list of matching objects.
+    """
+    start, found = 0, list()
+    while True:
+        url = '/search/{0}?{1}'.format(
+            index, urlencode(dict(q=query, rows=rows, start=start)))
+        result = await async_api.request('POST', url, data=keys)
+        page = result.get('rows', list())
+        found.extend(row.get('data', dict()) for row in page)
+        start += len(page)
+        if not page or start >= result.get('total', 0):
+            return found
+
+def is_overload(status_code):
+    return status_code == 429 or status_code >= 500
+
+def request_class(method, path):
+    """
+    The kind of a request to the Chef server, e.g. ``'GET /nodes'``, by which
+    the limiter compares its latency (see
+    :class:`~occo.configmanager.limiter.AdaptiveLimiter`).
+    """
+    return '{0} /{1}'.format(
+        method, path.split('?', 1)[0].lstrip('/').split('/', 1)[0])
+
+class PooledChefAPI(chef.ChefAPI):
+    """
+    :class:`chef.ChefAPI` sending its requests through a keep-alive
+    :class:`requests.Session`, instead of opening a new connection for each
+    request.
+
+    Requests are admitted by the adaptive concurrency limiter of the endpoint
+    (see :class:`~occo.configmanager.limiter.AdaptiveLimiter`), shared by
+    every instance using the same endpoint. Error responses 429 and 5xx,
+    connection errors and slow responses shrink its limit. The limit never
+    exceeds ``max_connections``, so admitted requests do not wait for a
+    connection, which would count as server latency.
+
+    :param int max_connections: The maximum number of connections kept open
+        to the endpoint.
+    """
+    def __init__(self, url, key, client, max_connections=MAX_CONNECTIONS, **kwargs):
+        chef.ChefAPI.__init__(self, url, key, client, **kwargs)
+        self.max_connections = max_connections
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.limiter = get_limiter(url, initial_limit=max_connections,
+                                   max_limit=max_connections)
+
+    def _request(self, method, url, data, headers):
+        try:
+            start = self.limiter.acquire()
+        except LimiterTimeout as ex:
+            raise ChefServerError(str(ex))
+        overloaded = True
+        try:
+            response = self.session.request(method, url, headers=headers,
+                                            data=data, verify=self.ssl_verify)
+            overloaded = is_overload(response.status_code)
+            return response
+        finally:
+            self.limiter.release(start, overloaded, request_class(
+                method, url[len(self.url):]))
+
+    def connection_stats(self):
+        """
+        Connection reuse statistics: the number of ``requests`` sent, the
+        number of ``connections`` opened for them, and the number of requests
+        that ``reused`` an open connection.
+        """
+        pools = self.adapter.poolmanager.pools
+        num_requests = num_connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return dict(max_connections=self.max_connections,
+                    requests=num_requests, connections=num_connections,
+                    reused=max(num_requests - num_connections, 0))
+
+    def close(self):
+        self.session.close()
+
+class AsyncChefAPI(object):
+    """
+    Non-blocking counterpart of :class:`chef.ChefAPI`, built on
+    :mod:`aiohttp`. Requests are signed with the key and client name of the
+    wrapped synchronous API object.
+
+    An HTTP session is created lazily for the running event loop, keeping at
+    most ``max_connections`` connections open.
+    """
+    def __init__(self, chefapi, max_connections=MAX_CONNECTIONS):
+        self.chefapi = chefapi
+        self.max_connections = max_connections
+        self.session = None
+        self.loop = None
+
+    def get_session(self):
+        loop = asyncio.get_event_loop()
+        if self.session is None or self.session.closed or self.loop is not loop:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections))
+            self.loop = loop
+        return self.session
+
+    def sign(self, method, path, body):
+        api = self.chefapi
+        headers = dict(api.headers)
+        headers['accept'] = 'application/json'
+        if body is not None:
+            headers['content-type'] = 'application/json'
+        headers['x-chef-version'] = api.version
+        headers.update(sign_request(
+            key=api.key, http_method=method,
+            path=api.parsed_url.path+path.split('?', 1)[0], body=body,
+            host=api.parsed_url.netloc, timestamp=datetime.datetime.utcnow(),
+            user_id=api.client))
+        return dict((k.capitalize(), v) for k, v in headers.items())
+
+    async def request(self, method, path, data=None):
+        """
+        Perform a signed request; the counterpart of
+        :meth:`chef.ChefAPI.api_request`.
+
+        :raises chef.exceptions.ChefServerError: on connection or HTTP errors.
+        """
+        body = None if data is None else chef_json.dumps(data)
+        headers = self.sign(method, path, body)
+        kwargs = dict() if self.chefapi.ssl_verify else dict(ssl=False)
+        limiter = self.chefapi.limiter
+        try:
+            start = await limiter.acquire_async()
+        except LimiterTimeout as ex:
+            raise ChefServerError(str(ex))
+        overloaded = True
+        try:
+            async with self.get_session().request(
+                    method, self.chefapi.url + path, data=body,
+                    headers=headers, **kwargs) as response:
+                overloaded = is_overload(response.status)
+                if response.status >= 400:
+                    raise ChefServerError.from_error(
+                        response.reason, code=response.status)
+                return await response.json(content_type=None)
+        except aiohttp.ClientError as ex:
+            raise ChefServerError(str(ex))
+        except asyncio.CancelledError:
+            overloaded = False
+            raise
+        finally:
+            limiter.release(start, overloaded, request_class(method, path))
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def close_soon(self):
+        """
+        Close the session from any thread, on the event loop it belongs to.
+        Sessions of event loops already closed cannot be closed anymore.
+        """
+        session, loop = self.session, self.loop
+        self.session = None
+        if session is not None and not session.closed \
+                and loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+def node_state(ohai_time):
+    """
+    Map the ``ohai_time`` attribute of an existing node to its state: a node
+    is ready when it has reported back to the server at least once.
+    """
+    return status.PENDING if ohai_time is None else status.READY
+
 class GetNodeState(Command):
     def __init__(self, instance_data):
         Command.__init__(self)
         self.instance_data = instance_data
     
-    def chef_exists(self, cm, chef_object):
+    def chef_get(self, cm, chef_object):
         try:
-            cm.chefapi.api_request('GET', chef_object.url, data=chef_object)
-            return True
+            return cm.chefapi.api_request('GET', chef_object.url)
         except ChefServerNotFoundError:
-            return False
+            return None
     
     @util.wet_method('ready')
     def perform(self, cm):
         node_id = self.instance_data['node_id']
+        mirrored = cm.mirrored_node_state(node_id)
+        if mirrored is not None:
+            return mirrored
         log.debug("[CM] Querying node state for %r", node_id)
-        node = chef.Node(node_id, api=cm.chefapi)
-        if self.chef_exists(cm, node):
-            if 'ohai_time' in node.attributes:
-                return status.READY
+        node = chef.Node(node_id, api=cm.chefapi, skip_load=True)
+        data = self.chef_get(cm, node)
+        if data is None:
+            return status.UNKNOWN
+        ohai_time = data.get('automatic', dict()).get('ohai_time')
+        cm.observe_ohai_time(node_id, ohai_time)
+        return node_state(ohai_time)
+
+    @util.wet_method('ready')
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        mirrored = cm.mirrored_node_state(self.instance_data['node_id'])
+        if mirrored is not None:
+            return mirrored
+        node = chef.Node(self.instance_data['node_id'],
+                         api=cm.chefapi, skip_load=True)
+        try:
+            data = await cm.async_chefapi.request('GET', node.url)
+        except ChefServerNotFoundError:
+            return status.UNKNOWN
+        ohai_time = data.get('automatic', dict()).get('ohai_time')
+        cm.observe_ohai_time(node.name, ohai_time)
+        return node_state(ohai_time)
+
+class GetNodeStates(Command):
+    """
+    Query the state of many nodes using partial searches, each covering
+    :data:`SEARCH_CHUNK_SIZE` nodes.
+
+    Nodes that are missing from the search results (e.g. because they have
+    not been indexed yet) are queried one by one; or, with ``search_only``,
+    reported unknown.
+    """
+    keys = dict(name=['name'], ohai_time=['ohai_time'])
+
+    def __init__(self, instance_data_list, search_only=False):
+        Command.__init__(self)
+        self.instance_data_list = instance_data_list
+        self.search_only = search_only
+
+    def search_query(self, node_names):
+        return names_query(node_names)
+
+    def mirrored(self, cm):
+        found = dict()
+        for instance_data in self.instance_data_list:
+            name = cm.node_name(instance_data)
+            state = cm.mirrored_node_state(name)
+            if state is not None:
+                found[name] = state
+        return found
+
+    def chunks(self, cm, found):
+        names, seen = list(), set(found)
+        for instance_data in self.instance_data_list:
+            name = cm.node_name(instance_data)
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+        for i in range(0, len(names), SEARCH_CHUNK_SIZE):
+            yield names[i:i+SEARCH_CHUNK_SIZE]
+
+    @util.wet_method(dict())
+    def perform(self, cm):
+        log.debug("[CM] Querying node state for %d nodes",
+                  len(self.instance_data_list))
+        found = self.mirrored(cm)
+        for names in self.chunks(cm, found):
+            for row in partial_search(cm.chefapi, 'node',
+                                      self.search_query(names), self.keys):
+                cm.observe_ohai_time(row['name'], row.get('ohai_time'))
+                found[row['name']] = node_state(row.get('ohai_time'))
+
+        states = dict()
+        for instance_data in self.instance_data_list:
+            name = cm.node_name(instance_data)
+            if name in found:
+                states[instance_data['node_id']] = found[name]
+            elif self.search_only:
+                states[instance_data['node_id']] = status.UNKNOWN
             else:
-                return status.PENDING
+                states[instance_data['node_id']] = \
+                    GetNodeState(instance_data).perform(cm)
+        return states
+
+    @util.wet_method(dict())
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        found = self.mirrored(cm)
+        results = await asyncio.gather(*[
+            partial_search_async(cm.async_chefapi, 'node',
+                                 self.search_query(names), self.keys)
+            for names in self.chunks(cm, found)])
+        for rows in results:
+            for row in rows:
+                cm.observe_ohai_time(row['name'], row.get('ohai_time'))
+                found[row['name']] = node_state(row.get('ohai_time'))
+
+        missing = [i for i in self.instance_data_list
+                   if cm.node_name(i) not in found]
+        if self.search_only:
+            missing_states = [status.UNKNOWN] * len(missing)
         else:
-            return status.UNKNOWN
+            missing_states = await asyncio.gather(
+                *[GetNodeState(i).perform_async(cm) for i in missing])
+        states = dict((i['node_id'], found[cm.node_name(i)])
+                      for i in self.instance_data_list
+                      if cm.node_name(i) in found)
+        states.update(
+            (i['node_id'], state) for i, state in zip(missing, missing_states))
+        return states
         
+class GetInfrastructureState(Command):
+    """
+    Query the state of every node in the environment of an infrastructure,
+    using a single paginated partial search.
+
+    Nodes that have not been indexed yet are missing from the result.
+    """
+    keys = dict(name=['name'], ohai_time=['ohai_time'])
+
+    def __init__(self, infra_id):
+        Command.__init__(self)
+        self.infra_id = infra_id
+
+    def search_query(self):
+        return 'chef_environment:{0}'.format(escape_query(self.infra_id))
+
+    def states(self, cm, rows):
+        states = dict()
+        for row in rows:
+            cm.observe_ohai_time(row['name'], row.get('ohai_time'))
+            states[row['name']] = node_state(row.get('ohai_time'))
+        return states
+
+    @util.wet_method(dict())
+    def perform(self, cm):
+        log.debug("[CM] Querying node states of infrastructure %r",
+                  self.infra_id)
+        return self.states(cm, partial_search(
+            cm.chefapi, 'node', self.search_query(), self.keys))
+
+    @util.wet_method(dict())
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        return self.states(cm, await partial_search_async(
+            cm.async_chefapi, 'node', self.search_query(), self.keys))
+
+def load_node(cm, node_id):
+    """
+    Load a node from the server.
+
+    :raises chef.exceptions.ChefServerNotFoundError: if the node does not
+        exist; :class:`chef.Node` would represent it with an empty node.
+    """
+    node = chef.Node(node_id, api=cm.chefapi)
+    if not node.exists:
+        raise ChefServerNotFoundError(
+            'Node {0!r} does not exist'.format(node_id), 404)
+    return node
+
 class GetNodeAttribute(Command):
     def __init__(self, node_id, attribute):
         Command.__init__(self)
@@ -76,30 +490,80 @@ class GetNodeAttribute(Command):
 
     @util.wet_method('dummy-value')
     def perform(self, cm):
-        node = chef.Node(self.node_id, api=cm.chefapi)
-        dotted_attr = \
-            attribute if isinstance(self.attribute, str) \
-            else '.'.join(self.attribute) if hasattr(self.attribute, '__iter__') \
-            else util.f_raise(TypeError(
-                'Unknown attribute specification: {0}'.format(self.attribute)))
+        node = load_node(cm, self.node_id)
+        dotted_attr = dotted_attribute(self.attribute)
         try:
             return node.attributes.get_dotted(dotted_attr)
         except KeyError:
             raise KeyError('Unresolved node attribute: %s', dotted_attr)
 
+class GetNodeAttributes(Command):
+    """
+    Query many attributes of a node in one partial search, transferring only
+    the requested attributes.
+
+    Results are cached by the backend until the node is re-registered or its
+    ``ohai_time`` changes (i.e. chef-client has run again); only attributes
+    missing from the cache are queried.
+
+    :raises chef.exceptions.ChefServerNotFoundError: if the node does not
+        exist.
+    """
+    OHAI_TIME_KEY = '__ohai_time__'
+
+    def __init__(self, node_id, attributes):
+        Command.__init__(self)
+        self.node_id = node_id
+        self.attributes = attributes
+
+    def search(self, cm, dotted_attrs):
+        keys = dict((a, a.split('.')) for a in dotted_attrs)
+        keys[self.OHAI_TIME_KEY] = ['ohai_time']
+        query = 'name:{0}'.format(escape_query(self.node_id))
+        for row in partial_search(cm.chefapi, 'node', query, keys):
+            ohai_time = row.pop(self.OHAI_TIME_KEY, None)
+            return ohai_time, row
+        # Not indexed yet
+        node = load_node(cm, self.node_id)
+        values = dict()
+        for a in dotted_attrs:
+            if node.attributes.has_dotted(a):
+                values[a] = node.attributes.get_dotted(a)
+        return node.attributes.get('ohai_time'), values
+
+    @util.wet_method(dict())
+    def perform(self, cm):
+        dotted_attrs = [dotted_attribute(a) for a in self.attributes]
+        values = cm.cached_node_attributes(self.node_id)
+        missing = [a for a in dotted_attrs if a not in values]
+        if missing:
+            log.debug("[CM] Querying attributes %r of node %r",
+                      missing, self.node_id)
+            ohai_time, found = self.search(cm, missing)
+            values = cm.cache_node_attributes(self.node_id, ohai_time, found)
+        unresolved = [a for a in dotted_attrs if values.get(a) is None]
+        if unresolved:
+            raise KeyError('Unresolved node attribute(s): {0}'.format(
+                ', '.join(unresolved)))
+        return dict((a, values[a]) for a in dotted_attrs)
+
 class RegisterNode(Command):
+    """
+    Register a node and its role.
+
+    Saving the node is skipped if the same backend has saved an identical
+    payload (run list, environment and normal attributes) for it within
+    :data:`SAVED_NODE_CACHE_TTL` seconds, so retries and re-registrations of
+    unchanged nodes do not rewrite them.
+    """
     def __init__(self, resolved_node_definition):
         Command.__init__(self)
         self.resolved_node_definition = resolved_node_definition
 
     def ensure_role(self, cm):
-        roles = cm.list_roles()
         role = cm.role_name(self.resolved_node_definition)
-        if role in roles:
+        if not cm.ensure_role(role):
             log.debug('Role %r already exists', role)
-        else:
-            log.info('Registering role %r', role)
-            chef.Role(role, api=cm.chefapi).save()
 
     def cond_prepend(self, lst, item):
         if not item in lst:
@@ -120,20 +584,165 @@ class RegisterNode(Command):
         for k, v in self.resolved_node_definition['attributes'].items():
             dest_attrs.set_dotted(k, v)
 
+    def build_node(self, cm, n):
+        n.chef_environment = self.resolved_node_definition['infra_id']
+        n.run_list = self.assemble_run_list(cm)
+        self.assemble_attributes(n.normal)
+        return n
+
+    def payload_hash(self, cm):
+        return canonical_hash(dict(
+            run_list=self.assemble_run_list(cm),
+            chef_environment=self.resolved_node_definition['infra_id'],
+            normal=self.resolved_node_definition['attributes']))
+
+    def save_node(self, cm):
+        """
+        :returns: :data:`False` if saving was skipped, :data:`True` otherwise.
+        """
+        name = cm.node_name(self.resolved_node_definition)
+        digest = self.payload_hash(cm)
+        if cm.is_node_saved(name, digest):
+            log.debug('[CM] Node %r is unchanged, not saving', name)
+            return False
+        cm.forget_saved_node(name)
+        n = chef.Node(name, api=cm.chefapi)
+        self.build_node(cm, n).save()
+        cm.forget_node_attributes(name)
+        cm.remember_saved_node(
+            name, self.resolved_node_definition['infra_id'], digest)
+        return True
+
     @util.wet_method()
     def perform(self, cm):
         log.info("[CM] Registering node: %r", self.resolved_node_definition['name'])
 
         self.ensure_role(cm)
+        self.save_node(cm)
 
-        n = chef.Node(cm.node_name(self.resolved_node_definition),
-                      api=cm.chefapi)
-        n.chef_environment = self.resolved_node_definition['infra_id']
-        n.run_list = self.assemble_run_list(cm)
-        self.assemble_attributes(n.normal)
-        n.save()
+        log.debug("[CM] Done")
+
+    async def ensure_role_async(self, cm):
+        role = cm.role_name(self.resolved_node_definition)
+        if not await cm.ensure_role_async(role):
+            log.debug('Role %r already exists', role)
+
+    @util.wet_method()
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        log.info("[CM] Registering node: %r", self.resolved_node_definition['name'])
+
+        await self.ensure_role_async(cm)
+        await self.save_node_async(cm)
+
+        log.debug("[CM] Done")
+
+    async def save_node_async(self, cm):
+        """
+        Awaitable variant of :meth:`save_node`.
+        """
+        name = cm.node_name(self.resolved_node_definition)
+        digest = self.payload_hash(cm)
+        if cm.is_node_saved(name, digest):
+            log.debug('[CM] Node %r is unchanged, not saving', name)
+            return False
+        cm.forget_saved_node(name)
+        try:
+            data = await cm.async_chefapi.request('GET', '/nodes/' + name)
+            n = chef.Node.from_search(data, api=cm.chefapi)
+        except ChefServerNotFoundError:
+            n = chef.Node(name, api=cm.chefapi, skip_load=True)
+        self.build_node(cm, n)
+        if n.exists:
+            await cm.async_chefapi.request('PUT', n.url, data=n)
+        else:
+            await cm.async_chefapi.request('POST', chef.Node.url, data=n)
+        cm.forget_node_attributes(name)
+        cm.remember_saved_node(
+            name, self.resolved_node_definition['infra_id'], digest)
+        return True
+
+class RegisterNodes(Command):
+    """
+    Register many nodes at once. Each role is ensured only once, then the
+    nodes are saved using :data:`REGISTRATION_CONCURRENCY` threads.
+    """
+    def __init__(self, resolved_node_definitions):
+        Command.__init__(self)
+        self.resolved_node_definitions = resolved_node_definitions
+
+    @util.wet_method(dict())
+    def perform(self, cm):
+        """
+        :returns: A dictionary mapping each node id to :data:`None` if the
+            node has been registered, or to the exception raised otherwise.
+        """
+        log.info("[CM] Registering %d nodes", len(self.resolved_node_definitions))
+        role_errors = dict()
+        for role in sorted(set(cm.role_name(d)
+                               for d in self.resolved_node_definitions)):
+            try:
+                if not cm.ensure_role(role):
+                    log.debug('Role %r already exists', role)
+            except Exception as ex:
+                log.error('[CM] Registering role %r failed: %s', role, ex)
+                role_errors[role] = ex
+
+        def register(node_def):
+            role_error = role_errors.get(cm.role_name(node_def))
+            if role_error is not None:
+                raise role_error
+            RegisterNode(node_def).save_node(cm)
 
+        results = dict()
+        with ThreadPoolExecutor(max_workers=REGISTRATION_CONCURRENCY) as executor:
+            futures = [(d['node_id'], executor.submit(register, d))
+                       for d in self.resolved_node_definitions]
+        for node_id, future in futures:
+            try:
+                future.result()
+                results[node_id] = None
+            except Exception as ex:
+                log.error('[CM] Registering node %r failed: %s', node_id, ex)
+                results[node_id] = ex
         log.debug("[CM] Done")
+        return results
+
+    @util.wet_method(dict())
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        log.info("[CM] Registering %d nodes", len(self.resolved_node_definitions))
+        roles = sorted(set(cm.role_name(d)
+                           for d in self.resolved_node_definitions))
+        role_results = await asyncio.gather(
+            *[cm.ensure_role_async(role) for role in roles],
+            return_exceptions=True)
+        role_errors = dict()
+        for role, result in zip(roles, role_results):
+            if isinstance(result, Exception):
+                log.error('[CM] Registering role %r failed: %s', role, result)
+                role_errors[role] = result
+
+        async def register(node_def):
+            role_error = role_errors.get(cm.role_name(node_def))
+            if role_error is not None:
+                raise role_error
+            await RegisterNode(node_def).save_node_async(cm)
+
+        node_results = await asyncio.gather(
+            *[register(d) for d in self.resolved_node_definitions],
+            return_exceptions=True)
+        results = dict()
+        for node_def, result in zip(self.resolved_node_definitions, node_results):
+            if isinstance(result, Exception):
+                log.error('[CM] Registering node %r failed: %s',
+                          node_def['node_id'], result)
+            results[node_def['node_id']] = \
+                result if isinstance(result, Exception) else None
+        log.debug("[CM] Done")
+        return results
 
 class DropNode(Command):
     def __init__(self, instance_data):
@@ -149,6 +758,7 @@ class DropNode(Command):
         """
         node_id = cm.node_name(self.instance_data)
         log.debug("[CM] Dropping node %r", node_id)
+        cm.forget_node(node_id)
         try:
             chef.Node(node_id, api=cm.chefapi).delete()
             log.debug("[CM] Done")
@@ -156,6 +766,20 @@ class DropNode(Command):
             log.exception('Error dropping node:')
             log.info('[CM] Dropping node failed - ignoring.')
 
+    @util.wet_method()
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        node_id = cm.node_name(self.instance_data)
+        log.debug("[CM] Dropping node %r", node_id)
+        cm.forget_node(node_id)
+        try:
+            await cm.async_chefapi.request('DELETE', '/nodes/' + node_id)
+            log.debug("[CM] Done")
+        except Exception as ex:
+            log.exception('Error dropping node:')
+            log.info('[CM] Dropping node failed - ignoring.')
+
 class InfrastructureExists(Command):
     def __init__(self, infra_id):
         Command.__init__(self)
@@ -163,7 +787,22 @@ class InfrastructureExists(Command):
     
     @util.wet_method(True)
     def perform(self, cm):
-        return self.infra_id in cm.list_environments()
+        return cm.environment_exists(self.infra_id)
+
+    @util.wet_method(True)
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        exists = cm.known_environments.get(self.infra_id)
+        if exists is None:
+            try:
+                await cm.async_chefapi.request(
+                    'GET', '/environments/' + self.infra_id)
+                exists = True
+            except ChefServerNotFoundError:
+                exists = False
+            cm.remember_environment(self.infra_id, exists)
+        return exists
 
 class CreateInfrastructure(Command):
     def __init__(self, infra_id):
@@ -174,37 +813,103 @@ class CreateInfrastructure(Command):
     def perform(self, cm):
         log.debug("[CM] Creating environment %r", self.infra_id)
         chef.Environment(self.infra_id, api=cm.chefapi).save()
+        cm.remember_environment(self.infra_id, True)
+        log.debug("[CM] Done")
+
+    @util.wet_method()
+    async def perform_async(self, cm):
+        if cm.async_chefapi is None:
+            return await Command.perform_async(self, cm)
+        log.debug("[CM] Creating environment %r", self.infra_id)
+        env = chef.Environment(self.infra_id, api=cm.chefapi, skip_load=True)
+        try:
+            await cm.async_chefapi.request('PUT', env.url, data=env)
+        except ChefServerNotFoundError:
+            await cm.async_chefapi.request('POST', chef.Environment.url, data=env)
+        cm.remember_environment(self.infra_id, True)
         log.debug("[CM] Done")
 
 class DropInfrastructure(Command):
+    """
+    Delete the environment and associated data: the roles of the
+    infrastructure, the nodes in the environment and their clients.
+
+    Objects to be deleted are looked up with searches scoped to the
+    infrastructure, and deleted using :data:`TEARDOWN_CONCURRENCY` threads.
+    The environment itself is deleted last.
+    """
     def __init__(self, infra_id):
         Command.__init__(self)
         self.infra_id = infra_id
-    
+
+    def find_roles(self, cm):
+        prefix = '{0}_'.format(self.infra_id)
+        query = 'name:{0}*'.format(escape_query(prefix))
+        roles = set(row['name'] for row in partial_search(
+            cm.chefapi, 'role', query, dict(name=['name'])))
+        # Roles created recently may not have been indexed yet
+        roles.update(r for r in cm.known_roles.keys() if r.startswith(prefix))
+        return sorted(roles)
+
+    def find_nodes(self, cm):
+        query = 'chef_environment:{0}'.format(escape_query(self.infra_id))
+        return sorted(row['name'] for row in partial_search(
+            cm.chefapi, 'node', query, dict(name=['name'])))
+
+    def delete(self, cm, url):
+        log.debug("[CM] Removing %r", url)
+        try:
+            cm.chefapi.api_request('DELETE', url)
+            return 'deleted'
+        except ChefServerNotFoundError:
+            return 'skipped'
+
     @util.wet_method()
     def perform(self, cm):
         """
-        Delete the environment and associated data.
-
+        :returns: A summary dictionary; ``deleted`` and ``skipped`` (already
+            missing) list the paths of the objects, ``failed`` maps paths to
+            error messages.
         """
-        filter = '{0}_'.format(self.infra_id)
-        for role in cm.list_roles():
-            if role.startswith(filter):
-                log.debug("[CM] Removing role: %r", role)
+        log.debug("[CM] Dropping infrastructure %r", self.infra_id)
+        summary = dict(deleted=list(), skipped=list(), failed=dict())
+
+        def delete_all(urls):
+            with ThreadPoolExecutor(max_workers=TEARDOWN_CONCURRENCY) as executor:
+                futures = [(url, executor.submit(self.delete, cm, url))
+                           for url in urls]
+            for url, future in futures:
                 try:
-                    chef.Role(role, api=cm.chefapi).delete()
-                    log.debug("[CM] Done")
+                    summary[future.result()].append(url.lstrip('/'))
                 except Exception as ex:
-                    log.exception('Error removing role:')
-                    log.info('[CM] Removing role failed - ignoring.')
+                    log.error('[CM] Removing %r failed: %s', url, ex)
+                    summary['failed'][url.lstrip('/')] = str(ex)
 
-        log.debug("[CM] Dropping environment %r", self.infra_id)
+        cm.forget_saved_nodes(self.infra_id)
+        urls = list()
         try:
-            chef.Environment(self.infra_id, api=cm.chefapi).delete()
-            log.debug("[CM] Done")
+            for role in self.find_roles(cm):
+                cm.forget_role(role)
+                urls.append('{0}/{1}'.format(chef.Role.url, role))
+            for node in self.find_nodes(cm):
+                cm.forget_node(node)
+                urls.append('{0}/{1}'.format(chef.Node.url, node))
+                urls.append('{0}/{1}'.format(chef.Client.url, node))
         except Exception as ex:
-            log.exception('Error dropping environment:')
-            log.info('[CM] drop_infrastructure failed - ignoring.')
+            log.exception('Error looking up objects of infrastructure:')
+            summary['failed']['search'] = str(ex)
+        delete_all(urls)
+        env_url = '{0}/{1}'.format(chef.Environment.url, self.infra_id)
+        delete_all([env_url])
+        if env_url.lstrip('/') in summary['failed']:
+            cm.known_environments.pop(self.infra_id)
+        else:
+            cm.remember_environment(self.infra_id, False)
+
+        log.info('[CM] Dropped infrastructure %r: %d deleted, %d skipped, '
+                 '%d failed', self.infra_id, len(summary['deleted']),
+                 len(summary['skipped']), len(summary['failed']))
+        return summary
 
 
 @factory.register(ConfigManager, 'chef')
@@ -212,10 +917,30 @@ class ChefConfigManager(ConfigManager):
     """
     Chef implementation of :class:`occo.configmanager.ConfigManager`.
 
+    Existing roles are remembered for :data:`ROLE_CACHE_TTL` seconds, so
+    registering many nodes of the same type checks the role only once.
+    Whether an environment exists is remembered for
+    :data:`ENVIRONMENT_EXISTS_TTL` seconds if it does, and for
+    :data:`ENVIRONMENT_MISSING_TTL` seconds if it does not; creating or
+    dropping an infrastructure updates this immediately.
+
+    Every command performed by an instance shares its keep-alive connection
+    pool (see :class:`PooledChefAPI`); its size can be set with the
+    ``max_connections`` key of the config manager section.
+
+    If the ``mirror`` key of the config manager section specifies a file, the
+    known roles and environments and the last seen node states are recorded
+    in it (see :class:`~occo.configmanager.mirror.LocalMirror`). The first
+    instance of the endpoint in the process serves these immediately, while
+    they are revalidated against the server in a background thread. Entries
+    recorded more than ``mirror_max_age`` seconds ago (default:
+    :data:`MIRROR_MAX_AGE`) are ignored.
+
     .. todo:: Store instance name too so it can be used in logging.
     """
     @util.wet_method()
-    def __init__(self, endpoint, auth_data, **cfg):
+    def __init__(self, endpoint, auth_data, max_connections=MAX_CONNECTIONS,
+                 mirror=None, mirror_max_age=MIRROR_MAX_AGE, **cfg):
         if not auth_data:
             msg = "Authorisation information is not set for the target Chef Server ("+str(endpoint)+")!"
             log.error(msg)
@@ -224,7 +949,91 @@ class ChefConfigManager(ConfigManager):
         config['client'] = auth_data['client_name']
         config['key'] = auth_data['client_key']
         config['url'] = endpoint
-        self.chefapi = chef.ChefAPI(**config)
+        config['max_connections'] = max_connections
+        self.chefapi = PooledChefAPI(**config)
+        self.async_chefapi = \
+            AsyncChefAPI(self.chefapi, max_connections) if aiohttp else None
+        self.known_roles = TTLCache(maxsize=ROLE_CACHE_SIZE, ttl=ROLE_CACHE_TTL)
+        self.role_lock = threading.Lock()
+        self.node_attributes = TTLCache(maxsize=ATTRIBUTE_CACHE_SIZE,
+                                        ttl=ATTRIBUTE_CACHE_TTL)
+        self.known_environments = TTLCache(maxsize=ENVIRONMENT_CACHE_SIZE)
+        self.saved_nodes = TTLCache(maxsize=SAVED_NODE_CACHE_SIZE,
+                                    ttl=SAVED_NODE_CACHE_TTL)
+        self.mirror = get_mirror(mirror) if mirror else None
+        self.mirror_max_age = mirror_max_age
+        self.mirrored_states = dict()
+        self.revalidated = threading.Event()
+        if self.mirror is not None and claim_warm_start(mirror, endpoint):
+            self.warm_start()
+        else:
+            self.revalidated.set()
+
+    def warm_start(self):
+        """
+        Load the state recorded in the mirror, and start revalidating it.
+        """
+        endpoint, max_age = self.chefapi.url, self.mirror_max_age
+        for role in self.mirror.roles(endpoint, max_age):
+            self.known_roles.set(role, True)
+        for env in self.mirror.environments(endpoint, max_age):
+            self.known_environments.set(env, True, ENVIRONMENT_EXISTS_TTL)
+        self.mirrored_states = self.mirror.node_states(endpoint, max_age)
+        log.info('[CM] Loaded %d roles, %d environments and %d node states '
+                 'of %r from local mirror', len(self.known_roles),
+                 len(self.known_environments), len(self.mirrored_states),
+                 endpoint)
+        thread = threading.Thread(target=self.revalidate,
+                                  name='occo-configmanager-revalidate')
+        thread.daemon = True
+        thread.start()
+
+    def revalidate(self):
+        """
+        Check the mirrored state against the server: one listing of roles and
+        environments, and partial searches for the mirrored nodes.
+        """
+        endpoint = self.chefapi.url
+        try:
+            roles = set(chef.Role.list(api=self.chefapi))
+            for role in self.mirror.roles(endpoint):
+                if role not in roles:
+                    self.forget_role(role)
+            environments = set(chef.Environment.list(api=self.chefapi))
+            for env in self.mirror.environments(endpoint):
+                if env not in environments:
+                    self.remember_environment(env, False)
+            names = sorted(self.mirrored_states)
+            for i in range(0, len(names), SEARCH_CHUNK_SIZE):
+                chunk = names[i:i+SEARCH_CHUNK_SIZE]
+                seen = set()
+                for row in partial_search(
+                        self.chefapi, 'node',
+                        names_query(chunk),
+                        GetNodeStates.keys):
+                    self.observe_ohai_time(row['name'], row.get('ohai_time'))
+                    self.mirrored_states.pop(row['name'], None)
+                    seen.add(row['name'])
+                for name in chunk:
+                    if name not in seen:
+                        self.mirrored_states.pop(name, None)
+                        self.mirror.forget_node_state(endpoint, name)
+            log.info('[CM] Revalidated local mirror of %r', endpoint)
+        except Exception:
+            log.exception('[CM] Revalidating local mirror of %r failed:',
+                          endpoint)
+        finally:
+            self.mirrored_states = dict()
+            self.revalidated.set()
+
+    def mirrored_node_state(self, node_name):
+        """
+        The mirrored state of a node, if it has not been revalidated yet.
+        """
+        if self.revalidated.is_set():
+            return None
+        entry = self.mirrored_states.get(node_name)
+        return None if entry is None else entry[0]
 
     def role_name(self, resolved_node_definition):
         return '{infra_id}_{name}'.format(**resolved_node_definition)
@@ -235,16 +1044,183 @@ class ChefConfigManager(ConfigManager):
     def bootstrap_recipe_name(self):
         return 'recipe[connect]'
 
+    def connection_stats(self):
+        return self.chefapi.connection_stats()
+
+    def cached_node_attributes(self, node_name):
+        entry = self.node_attributes.get(node_name)
+        return dict() if entry is None else entry[1]
+
+    def cache_node_attributes(self, node_name, ohai_time, values):
+        """
+        Add attribute values to the cache of a node. Values cached for a
+        different ``ohai_time`` are discarded.
+
+        :returns: All cached attribute values of the node.
+        """
+        with self.node_attributes.lock:
+            entry = self.node_attributes.get(node_name)
+            cached = dict() if entry is None or entry[0] != ohai_time \
+                else dict(entry[1])
+            cached.update(values)
+            self.node_attributes.set(node_name, (ohai_time, cached))
+        return cached
+
+    def observe_ohai_time(self, node_name, ohai_time):
+        """
+        Discard the cached attributes of a node if it has run chef-client
+        since they were queried.
+        """
+        with self.node_attributes.lock:
+            entry = self.node_attributes.get(node_name)
+            if entry is not None and entry[0] != ohai_time:
+                self.node_attributes.pop(node_name)
+        if self.mirror is not None:
+            self.mirror.record_node_state(
+                self.chefapi.url, node_name, node_state(ohai_time))
+
+    def forget_node_attributes(self, node_name):
+        self.node_attributes.pop(node_name)
+
+    def forget_node(self, node_name):
+        """
+        Forget everything known about a deleted node.
+        """
+        self.forget_node_attributes(node_name)
+        self.forget_saved_node(node_name)
+        if self.mirror is not None:
+            self.mirror.forget_node_state(self.chefapi.url, node_name)
+
+    def close(self):
+        """
+        Release the connections of the backend. The backend remains usable;
+        connections are re-opened on demand.
+        """
+        if getattr(self, 'chefapi', None) is not None:
+            self.chefapi.close()
+        if getattr(self, 'async_chefapi', None) is not None:
+            self.async_chefapi.close_soon()
+
+    async def close_async(self):
+        if getattr(self, 'async_chefapi', None) is not None:
+            await self.async_chefapi.close()
+
     @util.wet_method(list())
     def list_environments(self):
+        if not self.revalidated.is_set():
+            return self.mirror.environments(self.chefapi.url, self.mirror_max_age)
         log.debug('Listing environments')
         return list(chef.Environment.list(api=self.chefapi))
 
     @util.wet_method(list())
     def list_roles(self):
+        if not self.revalidated.is_set():
+            return self.mirror.roles(self.chefapi.url, self.mirror_max_age)
         log.debug('Listing roles')
         return list(chef.Role.list(api=self.chefapi))
 
+    def is_node_saved(self, node_name, digest):
+        entry = self.saved_nodes.get(node_name)
+        return entry is not None and entry[1] == digest
+
+    def remember_saved_node(self, node_name, infra_id, digest):
+        self.saved_nodes.set(node_name, (infra_id, digest))
+
+    def forget_saved_node(self, node_name):
+        self.saved_nodes.pop(node_name)
+
+    def forget_saved_nodes(self, infra_id):
+        for node_name, entry in self.saved_nodes.items():
+            if entry[0] == infra_id:
+                self.saved_nodes.pop(node_name)
+
+    def remember_environment(self, name, exists):
+        self.known_environments.set(
+            name, exists,
+            ENVIRONMENT_EXISTS_TTL if exists else ENVIRONMENT_MISSING_TTL)
+        if self.mirror is not None:
+            if exists:
+                self.mirror.record_environment(self.chefapi.url, name)
+            else:
+                self.mirror.forget_environment(self.chefapi.url, name)
+
+    def remember_role(self, role):
+        self.known_roles.set(role, True)
+        if self.mirror is not None:
+            self.mirror.record_role(self.chefapi.url, role)
+
+    def forget_role(self, role):
+        self.known_roles.pop(role)
+        if self.mirror is not None:
+            self.mirror.forget_role(self.chefapi.url, role)
+
+    @util.wet_method(True)
+    def environment_exists(self, name):
+        """
+        Check whether an environment exists, querying only that environment,
+        and only if the answer is not cached.
+        """
+        exists = self.known_environments.get(name)
+        if exists is None:
+            exists = self.chef_object_exists(
+                '{0}/{1}'.format(chef.Environment.url, name))
+            self.remember_environment(name, exists)
+        return exists
+
+    def chef_object_exists(self, url):
+        try:
+            self.chefapi.api_request('GET', url)
+            return True
+        except ChefServerNotFoundError:
+            return False
+
+    @util.wet_method(False)
+    def ensure_role(self, role):
+        """
+        Create a role unless it exists. Only the given role is queried on the
+        server, and only if it is not known already.
+
+        :returns: :data:`True` iff the role had to be created.
+        """
+        if role in self.known_roles:
+            return False
+        with self.role_lock:
+            # Checked again: another thread may have created it meanwhile
+            if role in self.known_roles:
+                return False
+            chef_role = chef.Role(role, api=self.chefapi, skip_load=True)
+            log.debug('Querying role %r', role)
+            created = not self.chef_object_exists(chef_role.url)
+            if created:
+                log.info('Registering role %r', role)
+                chef_role.save()
+            self.remember_role(role)
+            return created
+
+    async def ensure_role_async(self, role):
+        """
+        Awaitable variant of :meth:`ensure_role`.
+        """
+        if role in self.known_roles:
+            return False
+        try:
+            await self.async_chefapi.request('GET', '/roles/' + role)
+            created = False
+        except ChefServerNotFoundError:
+            log.info('Registering role %r', role)
+            try:
+                await self.async_chefapi.request(
+                    'POST', chef.Role.url,
+                    data=chef.Role(role, api=self.chefapi, skip_load=True))
+                created = True
+            except ChefServerError as ex:
+                # Created concurrently
+                if ex.code != 409:
+                    raise
+                created = False
+        self.remember_role(role)
+        return created
+
     def cri_drop_infrastructure(self, infra_id):
         return DropInfrastructure(infra_id)
 
@@ -257,15 +1233,27 @@ class ChefConfigManager(ConfigManager):
     def cri_register_node(self, resolved_node_definition):
         return RegisterNode(resolved_node_definition)
 
+    def cri_register_nodes(self, resolved_node_definitions):
+        return RegisterNodes(resolved_node_definitions)
+
     def cri_drop_node(self, instance_data):
         return DropNode(instance_data)
 
     def cri_get_node_state(self, instance_data):
         return GetNodeState(instance_data)
 
+    def cri_get_node_states(self, instance_data_list):
+        return GetNodeStates(instance_data_list)
+
+    def cri_get_infrastructure_state(self, infra_id):
+        return GetInfrastructureState(infra_id)
+
     def cri_get_node_attribute(self, node_id, attribute):
         return GetNodeAttribute(node_id, attribute)
 
+    def cri_get_node_attributes(self, node_id, attributes):
+        return GetNodeAttributes(node_id, attributes)
+
     def cri_resolve_attributes(self, node_def):
         return DummyCommand(dict())
 
@@ -274,18 +1262,5 @@ class ChefConfigManager(ConfigManager):
 
 @factory.register(CMSchemaChecker, PROTOCOL_ID)
 class ChefSchemaChecker(CMSchemaChecker):
-    def __init__(self):
-#        super(__init__(), self)
-        self.req_keys = ["type", "endpoint", "run_list"]
-        self.opt_keys = []
-    def perform_check(self, data):
-        missing_keys = CMSchemaChecker.get_missing_keys(self, data, self.req_keys)
-        if missing_keys:
-            msg = "Missing key(s): " + ', '.join(str(key) for key in missing_keys)
-            raise SchemaError(msg)
-        valid_keys = self.req_keys + self.opt_keys
-        invalid_keys = CMSchemaChecker.get_invalid_keys(self, data, valid_keys)
-        if invalid_keys:
-            msg = "Unknown key(s): " + ', '.join(str(key) for key in invalid_keys)
-            raise SchemaError(msg)
-        return True
+    req_keys = ["type", "endpoint", "run_list"]
+    opt_keys = ["max_connections", "mirror", "mirror_max_age"]
@@ -0,0 +1,521 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" Sharded Chef Service Composer module for OCCO
+
+Spreads the nodes of infrastructures over several Chef servers. Example
+``config_management`` section::
+
+    config_management:
+        type: chef_sharded
+        endpoints:
+            - https://chef1.example.com/organizations/occo
+            - https://chef2.example.com/organizations/occo
+        run_list: [ 'recipe[app]' ]
+
+"""
+
+__all__  = [ 'ShardedChefConfigManager', 'HashRing' ]
+
+from occo.configmanager import ConfigManager, Command, CMSchemaChecker
+from occo.configmanager.aio import await_command
+from occo.configmanager.cache import TTLCache
+from occo.plugins.configmanager.chef import ChefConfigManager, \
+    DummyCommand, GetNodeStates, MAX_CONNECTIONS, MIRROR_MAX_AGE
+import occo.util as util
+import occo.util.factory as factory
+import asyncio
+import bisect
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from chef.exceptions import ChefServerNotFoundError
+from occo.exceptions import SchemaError
+import occo.constants.status as status
+
+PROTOCOL_ID='chef_sharded'
+
+VIRTUAL_NODES=128
+
+PLACEMENT_CACHE_SIZE=100000
+ABSENT_NODE_TTL=10
+
+log = logging.getLogger('occo.configmanager')
+
+def ring_hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+class HashRing(object):
+    """
+    Consistent hash ring placing keys on shards.
+
+    Each shard is represented by ``virtual_nodes`` points on the ring, and a
+    key belongs to the shard of the first point following its hash. Adding
+    or removing a shard only moves the keys of the points it gains or loses,
+    i.e. about ``1/len(shards)`` of all keys.
+    """
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        points = sorted((ring_hash('{0}#{1}'.format(shard, i)), shard)
+                        for shard in shards for i in range(virtual_nodes))
+        if not points:
+            raise ValueError('No shards specified')
+        self.hashes = [h for h, _ in points]
+        self.shards = [s for _, s in points]
+
+    def get(self, key):
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.shards[index]
+
+class OnShard(Command):
+    """
+    Perform a command on a single shard.
+    """
+    def __init__(self, shard, command):
+        Command.__init__(self)
+        self.shard = shard
+        self.command = command
+
+    def perform(self, cm):
+        return self.command.perform(self.shard)
+
+    async def perform_async(self, cm):
+        return await await_command(self.command, self.shard)
+
+class OnShards(Command):
+    """
+    Perform commands on several shards concurrently.
+
+    :param commands: A list of ``(shard, command)`` pairs.
+    :param combine: Called with the list of ``(shard, result)`` pairs to
+        compute the result.
+    """
+    def __init__(self, commands, combine):
+        Command.__init__(self)
+        self.commands = commands
+        self.combine = combine
+
+    def perform(self, cm):
+        if len(self.commands) == 1:
+            shard, command = self.commands[0]
+            return self.combine([(shard, command.perform(shard))])
+        futures = [(shard, cm.executor.submit(command.perform, shard))
+                   for shard, command in self.commands]
+        return self.combine([(shard, f.result()) for shard, f in futures])
+
+    async def perform_async(self, cm):
+        results = await asyncio.gather(
+            *[await_command(command, shard) for shard, command in self.commands])
+        return self.combine(
+            [(shard, r) for (shard, _), r in zip(self.commands, results)])
+
+def is_unknown(state):
+    return state == status.UNKNOWN
+
+class OnNodeShard(Command):
+    """
+    Perform a command on the shard holding a node.
+
+    The command is performed on the shard the node is placed on (see
+    :meth:`ShardedChefConfigManager.shard`). If the node is missing there
+    (e.g. it was registered before a shard was added), the command is
+    performed on the other shards, and the placement of the node is recorded
+    if found. Nodes recently missing from every shard are not looked for
+    again (see :meth:`ShardedChefConfigManager.is_absent`).
+
+    :param make_command: Called with a shard to create the command.
+    :param missing: Predicate telling whether a result means that the node
+        is missing; :exc:`~chef.exceptions.ChefServerNotFoundError` always
+        does.
+    """
+    def __init__(self, node_id, make_command, missing=lambda result: False):
+        Command.__init__(self)
+        self.node_id = node_id
+        self.make_command = make_command
+        self.missing = missing
+
+    def attempt(self, shard):
+        """
+        :returns: A ``(found, result)`` pair; ``result`` is the exception
+            raised if the node was not found.
+        """
+        try:
+            result = self.make_command(shard).perform(shard)
+        except ChefServerNotFoundError as ex:
+            return False, ex
+        return not self.missing(result), result
+
+    async def attempt_async(self, shard):
+        try:
+            result = await await_command(self.make_command(shard), shard)
+        except ChefServerNotFoundError as ex:
+            return False, ex
+        return not self.missing(result), result
+
+    def outcome(self, result):
+        if isinstance(result, ChefServerNotFoundError):
+            raise result
+        return result
+
+    def perform(self, cm):
+        shard = cm.shard(self.node_id)
+        found, result = self.attempt(shard)
+        if not found and not cm.is_absent(self.node_id):
+            others = cm.other_shards(shard)
+            for other, (found, other_result) in zip(
+                    others, cm.executor.map(self.attempt, others)):
+                if found:
+                    cm.place(self.node_id, other)
+                    return other_result
+            cm.mark_absent(self.node_id)
+        return self.outcome(result)
+
+    async def perform_async(self, cm):
+        shard = cm.shard(self.node_id)
+        found, result = await self.attempt_async(shard)
+        if not found and not cm.is_absent(self.node_id):
+            others = cm.other_shards(shard)
+            attempts = await asyncio.gather(
+                *[self.attempt_async(other) for other in others])
+            for other, (found, other_result) in zip(others, attempts):
+                if found:
+                    cm.place(self.node_id, other)
+                    return other_result
+            cm.mark_absent(self.node_id)
+        return self.outcome(result)
+
+class NodeStatesOnShards(Command):
+    """
+    Query the state of many nodes on the shards they are placed on. Nodes
+    unknown on their shard are looked for on the other shards, and their
+    placement is recorded if found.
+
+    Only searches are sent to the other shards: nodes held by a shard other
+    than their own have been registered before the ring changed, so they are
+    indexed already. Nodes recently missing from every shard are not looked
+    for again.
+    """
+    def __init__(self, instance_data_list):
+        Command.__init__(self)
+        self.instance_data_list = instance_data_list
+
+    def queries(self, cm):
+        return [(shard, shard.cri_get_node_states(group))
+                for shard, group in cm.group_by_shard(self.instance_data_list)]
+
+    def missing(self, cm, states):
+        return [i for i in self.instance_data_list
+                if is_unknown(states.get(i['node_id']))
+                and not cm.is_absent(i['node_id'])]
+
+    def fallback_queries(self, cm, missing):
+        queries = list()
+        for shard in cm.all_shards():
+            group = [i for i in missing if cm.shard(i['node_id']) is not shard]
+            if group:
+                queries.append((shard, GetNodeStates(group, search_only=True)))
+        return queries
+
+    def merge_fallback(self, cm, states, missing, results):
+        for shard, result in results:
+            for node_id, state in result.items():
+                if not is_unknown(state):
+                    cm.place(node_id, shard)
+                    states[node_id] = state
+        for i in missing:
+            if is_unknown(states.get(i['node_id'])):
+                cm.mark_absent(i['node_id'])
+        return states
+
+    @util.wet_method(dict())
+    def perform(self, cm):
+        states = OnShards(self.queries(cm), merge_dicts).perform(cm)
+        missing = self.missing(cm, states)
+        queries = self.fallback_queries(cm, missing)
+        if not queries:
+            return states
+        return OnShards(queries, lambda results: self.merge_fallback(
+            cm, states, missing, results)).perform(cm)
+
+    @util.wet_method(dict())
+    async def perform_async(self, cm):
+        states = await OnShards(self.queries(cm), merge_dicts).perform_async(cm)
+        missing = self.missing(cm, states)
+        queries = self.fallback_queries(cm, missing)
+        if not queries:
+            return states
+        return await OnShards(queries, lambda results: self.merge_fallback(
+            cm, states, missing, results)).perform_async(cm)
+
+class DropNodeOnShard(Command):
+    """
+    Drop a node from the shard holding it.
+    """
+    def __init__(self, instance_data):
+        Command.__init__(self)
+        self.instance_data = instance_data
+        self.locate = OnNodeShard(
+            instance_data['node_id'],
+            lambda shard: shard.cri_get_node_state(instance_data), is_unknown)
+
+    def drop(self, cm):
+        shard = cm.shard(self.instance_data['node_id'])
+        cm.unplace(self.instance_data['node_id'])
+        return shard, shard.cri_drop_node(self.instance_data)
+
+    @util.wet_method()
+    def perform(self, cm):
+        self.locate.perform(cm)
+        shard, command = self.drop(cm)
+        return command.perform(shard)
+
+    @util.wet_method()
+    async def perform_async(self, cm):
+        await self.locate.perform_async(cm)
+        shard, command = self.drop(cm)
+        return await await_command(command, shard)
+
+class WithRoles(Command):
+    """
+    Replicate roles to every shard, then perform a command.
+    """
+    def __init__(self, roles, command):
+        Command.__init__(self)
+        self.roles = roles
+        self.command = command
+
+    def perform(self, cm):
+        cm.replicate_roles(self.roles)
+        return self.command.perform(cm)
+
+    async def perform_async(self, cm):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, cm.replicate_roles, self.roles)
+        return await await_command(self.command, cm)
+
+def merge_dicts(results):
+    merged = dict()
+    for _, result in results:
+        merged.update(result or dict())
+    return merged
+
+def all_true(results):
+    return all(result for _, result in results)
+
+def merge_summaries(results):
+    """
+    Merge the summaries of :class:`~occo.plugins.configmanager.chef.DropInfrastructure`,
+    prefixing paths with the endpoint of their shard.
+    """
+    summary = dict(deleted=list(), skipped=list(), failed=dict())
+    for shard, result in results:
+        if not result:
+            continue
+        for key in ('deleted', 'skipped'):
+            summary[key].extend('{0}/{1}'.format(shard.endpoint, path)
+                                for path in result[key])
+        summary['failed'].update(
+            ('{0}/{1}'.format(shard.endpoint, path), error)
+            for path, error in result['failed'].items())
+    return summary
+
+@factory.register(ConfigManager, PROTOCOL_ID)
+class ShardedChefConfigManager(ConfigManager):
+    """
+    Chef config manager distributing nodes over several Chef servers.
+
+    Each node is placed on one of the ``endpoints`` by consistent hashing of
+    its id (see :class:`HashRing`), and node operations are routed to that
+    shard. Environments and roles are replicated to every shard.
+    Infrastructure-wide operations are performed on all shards concurrently.
+
+    Nodes are not migrated when the list of endpoints changes, so about
+    ``1/len(endpoints)`` of them are not on their shard after a shard is
+    added. Such nodes are looked for on the other shards when missing, and
+    their actual placement is remembered (at most
+    :data:`PLACEMENT_CACHE_SIZE` of them). Nodes missing from every shard are
+    not looked for again for :data:`ABSENT_NODE_TTL` seconds.
+
+    :param list endpoints: The URLs of the Chef servers.
+    :param auth_data: The authentication data used for every endpoint; or a
+        dictionary mapping endpoints to their authentication data.
+    :param int virtual_nodes: Number of points of each shard on the hash
+        ring.
+    :param str mirror: Local mirror file shared by the shards (see
+        :class:`~occo.plugins.configmanager.chef.ChefConfigManager`).
+    :param float mirror_max_age: Age in seconds above which mirrored entries
+        are ignored.
+    """
+    def __init__(self, endpoints, auth_data, max_connections=MAX_CONNECTIONS,
+                 virtual_nodes=VIRTUAL_NODES, mirror=None,
+                 mirror_max_age=MIRROR_MAX_AGE, **cfg):
+        # Missing authentication data is reported by the shards
+        self.shards = dict(
+            (endpoint, ChefConfigManager(
+                endpoint, (auth_data or dict()).get(endpoint, auth_data),
+                max_connections=max_connections, mirror=mirror,
+                mirror_max_age=mirror_max_age))
+            for endpoint in endpoints)
+        for endpoint, shard in self.shards.items():
+            shard.endpoint = endpoint
+        self.ring = HashRing(sorted(self.shards), virtual_nodes)
+        # node id -> endpoint, for nodes not on their shard of the ring
+        self.placements = TTLCache(maxsize=PLACEMENT_CACHE_SIZE)
+        # node ids recently missing from every shard
+        self.absent = TTLCache(maxsize=PLACEMENT_CACHE_SIZE,
+                               ttl=ABSENT_NODE_TTL)
+        self.executor = ThreadPoolExecutor(
+            max_workers=2 * len(self.shards),
+            thread_name_prefix='occo-configmanager-shards')
+
+    def shard(self, node_id):
+        endpoint = self.placements.get(node_id) or self.ring.get(node_id)
+        return self.shards[endpoint]
+
+    def place(self, node_id, shard):
+        """
+        Record that a node is held by a shard other than its shard on the
+        ring.
+        """
+        log.debug('[CM] Node %r found on shard %r', node_id, shard.endpoint)
+        self.placements.set(node_id, shard.endpoint)
+        self.absent.pop(node_id)
+
+    def unplace(self, node_id):
+        self.placements.pop(node_id)
+
+    def is_absent(self, node_id):
+        """
+        Whether a node has been missing from every shard recently, so it is
+        not looked for on shards other than its own.
+        """
+        return node_id in self.absent
+
+    def mark_absent(self, node_id):
+        log.debug('[CM] Node %r not found on any shard', node_id)
+        self.absent.set(node_id, True)
+
+    def all_shards(self):
+        return [self.shards[endpoint] for endpoint in sorted(self.shards)]
+
+    def other_shards(self, shard):
+        return [s for s in self.all_shards() if s is not shard]
+
+    def group_by_shard(self, data_list):
+        groups = dict()
+        for data in data_list:
+            groups.setdefault(self.shard(data['node_id']).endpoint,
+                              list()).append(data)
+        return [(self.shards[endpoint], group)
+                for endpoint, group in sorted(groups.items())]
+
+    def on_all_shards(self, make_command, combine):
+        return OnShards([(shard, make_command(shard))
+                         for shard in self.all_shards()], combine)
+
+    def role_name(self, resolved_node_definition):
+        return self.all_shards()[0].role_name(resolved_node_definition)
+
+    def replicate_roles(self, roles):
+        """
+        Ensure that every shard has the given roles.
+        """
+        futures = [self.executor.submit(shard.ensure_role, role)
+                   for shard in self.all_shards() for role in roles]
+        for f in futures:
+            f.result()
+
+    def connection_stats(self):
+        return dict((endpoint, shard.connection_stats())
+                    for endpoint, shard in self.shards.items())
+
+    def close(self):
+        for shard in self.all_shards():
+            shard.close()
+
+    async def close_async(self):
+        for shard in self.all_shards():
+            await shard.close_async()
+
+    def cri_drop_infrastructure(self, infra_id):
+        return self.on_all_shards(
+            lambda shard: shard.cri_drop_infrastructure(infra_id),
+            merge_summaries)
+
+    def cri_create_infrastructure(self, infra_id):
+        return self.on_all_shards(
+            lambda shard: shard.cri_create_infrastructure(infra_id),
+            lambda results: None)
+
+    def cri_infrastructure_exists(self, infra_id):
+        return self.on_all_shards(
+            lambda shard: shard.cri_infrastructure_exists(infra_id),
+            all_true)
+
+    def cri_register_node(self, resolved_node_definition):
+        shard = self.shard(resolved_node_definition['node_id'])
+        return WithRoles(
+            [self.role_name(resolved_node_definition)],
+            OnShard(shard, shard.cri_register_node(resolved_node_definition)))
+
+    def cri_register_nodes(self, resolved_node_definitions):
+        roles = sorted(set(self.role_name(d) for d in resolved_node_definitions))
+        return WithRoles(roles, OnShards(
+            [(shard, shard.cri_register_nodes(group))
+             for shard, group in self.group_by_shard(resolved_node_definitions)],
+            merge_dicts))
+
+    def cri_drop_node(self, instance_data):
+        return DropNodeOnShard(instance_data)
+
+    def cri_get_node_state(self, instance_data):
+        return OnNodeShard(
+            instance_data['node_id'],
+            lambda shard: shard.cri_get_node_state(instance_data), is_unknown)
+
+    def cri_get_node_states(self, instance_data_list):
+        return NodeStatesOnShards(instance_data_list)
+
+    def cri_get_infrastructure_state(self, infra_id):
+        return self.on_all_shards(
+            lambda shard: shard.cri_get_infrastructure_state(infra_id),
+            merge_dicts)
+
+    def cri_get_node_attribute(self, node_id, attribute):
+        return OnNodeShard(
+            node_id,
+            lambda shard: shard.cri_get_node_attribute(node_id, attribute))
+
+    def cri_get_node_attributes(self, node_id, attributes):
+        return OnNodeShard(
+            node_id,
+            lambda shard: shard.cri_get_node_attributes(node_id, attributes))
+
+    def cri_resolve_attributes(self, node_def):
+        return DummyCommand(dict())
+
+    def perform(self, instruction):
+        instruction.perform(self)
+
+@factory.register(CMSchemaChecker, PROTOCOL_ID)
+class ShardedChefSchemaChecker(CMSchemaChecker):
+    req_keys = ["type", "endpoints", "run_list"]
+    opt_keys = ["max_connections", "virtual_nodes", "mirror", "mirror_max_age"]
+
+    def perform_check(self, data):
+        CMSchemaChecker.perform_check(self, data)
+        endpoints = data['endpoints']
+        if not isinstance(endpoints, list) or not endpoints \
+                or not all(isinstance(e, str) for e in endpoints):
+            raise SchemaError("Key 'endpoints' must be a non-empty list of URLs")
+        return True
@@ -22,7 +22,9 @@
 
 __all__ = [ 'DummyConfigManager' ]
 
-from occo.configmanager import ConfigManager, Command
+from occo.configmanager import ConfigManager, Command, dotted_attribute, \
+    node_config_management
+import occo.infobroker as ib
 import occo.util as util
 import occo.util.factory as factory
 import logging
@@ -42,6 +44,25 @@ class DummyCommand(Command):
     def perform(self, cm):
         return self.retval
 
+class GetInfrastructureState(Command):
+    """
+    Report the nodes of an infrastructure served by a backend that does not
+    track nodes ready, like the node state queries of such backends do.
+
+    The nodes are listed by the info broker (``node.find``); nodes using
+    another protocol are left to their own config manager sections.
+    """
+    def __init__(self, infra_id, protocol):
+        Command.__init__(self)
+        self.infra_id = infra_id
+        self.protocol = protocol
+
+    def perform(self, cm):
+        nodes = ib.main_info_broker.get('node.find', infra_id=self.infra_id)
+        return dict(
+            (node['node_id'], status.READY) for node in nodes
+            if node_config_management(node).get('type') == self.protocol)
+
 @factory.register(ConfigManager, 'dummy')
 class DummyConfigManager(ConfigManager):
     def __init__(self, name='dummy', **kwargs):
@@ -59,15 +80,30 @@ class DummyConfigManager(ConfigManager):
     def cri_register_node(self, resolved_node_definition):
         return DummyCommand()
 
+    def cri_register_nodes(self, resolved_node_definitions):
+        return DummyCommand(dict(
+            (d['node_id'], None) for d in resolved_node_definitions))
+
     def cri_drop_node(self, instance_data):
         return DummyCommand()
 
     def cri_get_node_state(self, instance_data):
         return DummyCommand("ready")
 
+    def cri_get_node_states(self, instance_data_list):
+        return DummyCommand(dict(
+            (i['node_id'], status.READY) for i in instance_data_list))
+
+    def cri_get_infrastructure_state(self, infra_id):
+        return GetInfrastructureState(infra_id, PROTOCOL_ID)
+
     def cri_get_node_attribute(self, node_id, attribute):
         return DummyCommand("dummy attribute")
 
+    def cri_get_node_attributes(self, node_id, attributes):
+        return DummyCommand(dict(
+            (dotted_attribute(a), "dummy attribute") for a in attributes))
+
     def cri_resolve_attributes(self, node_def):
         return DummyCommand(dict())
 
@@ -22,12 +22,12 @@
 
 __all__  = [ 'PuppetSoloConfigManager' ]
 
-from occo.configmanager import ConfigManager, Command, CMSchemaChecker
+from occo.configmanager import ConfigManager, Command, dotted_attribute, CMSchemaChecker
 import occo.util as util
 import occo.util.factory as factory
+from occo.plugins.configmanager.dummy import GetInfrastructureState
 import logging
 
-from occo.exceptions import SchemaError
 import occo.constants.status as status
 
 PROTOCOL_ID='puppet_solo'
@@ -42,7 +42,15 @@ class DummyCommand(Command):
     def perform(self, cm):
         return self.retval
 
+def join_keys(cm_section, key):
+    return ' '.join([ str(k) for k in cm_section.get(key) or dict() ])
+
 class ResolveAttributes(Command):
+    """
+    Assemble the ``puppet`` attributes of a node from its
+    ``config_management`` section. Debug output is only formatted when
+    debug logging is enabled.
+    """
     def __init__(self, node_def):
         Command.__init__(self)
         self.node_def = node_def
@@ -51,26 +59,16 @@ class ResolveAttributes(Command):
         cm_section = self.node_def.get('config_management')
         attributes=dict()
         attributes['puppet']=dict()
-        #HERE COMES adding string content to the 3 sections, based on value of cm_section
-        attributes['puppet']['modules']=""
-        attributes['puppet']['manifests']=""
-        attributes['puppet']['attributes']=""
-        #Create modules string
-        modules_dict = cm_section.get('modules',None)
-        if modules_dict:
-           attributes['puppet']['modules'] = ' '.join([ str(k) for k in cm_section.get('modules',dict())])
-        log.debug("Puppet solo config manager attributes modules string: %r\n",attributes['puppet']['modules'])
-        #Create manifests string
-        manifests_dict = cm_section.get('manifests',None)
-        if manifests_dict:
-           attributes['puppet']['manifests'] = ' '.join([ str(k) for k in cm_section.get('manifests',dict())])
-        log.debug("Puppet solo config manager attributes manifests string: %r\n",attributes['puppet']['manifests'])
-        #Create attributes string
-        attributes_dict = cm_section.get('attributes',None)
-        if attributes_dict:
-           attributes['puppet']['attributes'] = ' '.join([ str(k) for k in cm_section.get('attributes',dict())])
-        log.debug("Puppet solo config manager attributes string: %r\n",attributes['puppet']['attributes'])
-
+        attributes['puppet']['modules'] = join_keys(cm_section, 'modules')
+        attributes['puppet']['manifests'] = join_keys(cm_section, 'manifests')
+        attributes['puppet']['attributes'] = join_keys(cm_section, 'attributes')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Puppet solo config manager attributes modules string: %r",
+                      attributes['puppet']['modules'])
+            log.debug("Puppet solo config manager attributes manifests string: %r",
+                      attributes['puppet']['manifests'])
+            log.debug("Puppet solo config manager attributes string: %r",
+                      attributes['puppet']['attributes'])
         return attributes
 
 @factory.register(ConfigManager, PROTOCOL_ID)
@@ -93,15 +91,30 @@ class PuppetSoloConfigManager(ConfigManager):
     def cri_register_node(self, resolved_node_definition):
         return DummyCommand()
 
+    def cri_register_nodes(self, resolved_node_definitions):
+        return DummyCommand(dict(
+            (d['node_id'], None) for d in resolved_node_definitions))
+
     def cri_drop_node(self, instance_data):
         return DummyCommand()
 
     def cri_get_node_state(self, instance_data):
         return DummyCommand("ready")
 
+    def cri_get_node_states(self, instance_data_list):
+        return DummyCommand(dict(
+            (i['node_id'], status.READY) for i in instance_data_list))
+
+    def cri_get_infrastructure_state(self, infra_id):
+        return GetInfrastructureState(infra_id, PROTOCOL_ID)
+
     def cri_get_node_attribute(self, node_id, attribute):
         return DummyCommand("dummy attribute")
 
+    def cri_get_node_attributes(self, node_id, attributes):
+        return DummyCommand(dict(
+            (dotted_attribute(a), "dummy attribute") for a in attributes))
+
     def cri_resolve_attributes(self, node_def):
         ##TODO: fill parameters in both cri_ method and the constructor of command
         return ResolveAttributes(node_def)
@@ -111,17 +124,5 @@ class PuppetSoloConfigManager(ConfigManager):
 
 @factory.register(CMSchemaChecker, PROTOCOL_ID)
 class PuppetSchemaChecker(CMSchemaChecker):
-    def __init__(self):
-        self.req_keys = ["type", "manifests"]
-        self.opt_keys = ["modules", "attributes"]
-    def perform_check(self, data):
-        missing_keys = CMSchemaChecker.get_missing_keys(self, data, self.req_keys)
-        if missing_keys:
-            msg = "Missing key(s): " + ', '.join(str(key) for key in missing_keys)
-            raise SchemaError(msg)
-        valid_keys = self.req_keys + self.opt_keys
-        invalid_keys = CMSchemaChecker.get_invalid_keys(self, data, valid_keys)
-        if invalid_keys:
-            msg = "Unknown key(s): " + ', '.join(str(key) for key in invalid_keys)
-            raise SchemaError(msg)
-        return True
+    req_keys = ["type", "manifests"]
+    opt_keys = ["modules", "attributes"]
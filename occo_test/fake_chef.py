@@ -0,0 +1,162 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+""" In-memory Chef servers for testing the Chef backends
+
+:func:`fake_chef` replaces the API objects of the Chef backends created in
+its context with :class:`FakeChefAPI` objects, which serve requests from the
+:class:`FakeChefServer` of their endpoint in :data:`servers`.
+
+"""
+
+import contextlib
+import json
+import re
+import unittest.mock
+from urllib.parse import parse_qs
+import pkg_resources
+import chef
+from chef.exceptions import ChefServerError, ChefServerNotFoundError
+from chef.utils import json as chef_json
+
+#: Fake servers by endpoint URL; cleared by :func:`fake_chef`.
+servers = dict()
+
+ATTRIBUTE_PRECEDENCE = ('automatic', 'override', 'normal', 'default')
+
+def lookup(obj, path):
+    """
+    Resolve an attribute path the way partial search does: top-level keys
+    first, then the merged node attributes.
+    """
+    candidates = [obj] + [obj.get(level, dict()) for level in ATTRIBUTE_PRECEDENCE]
+    for value in candidates:
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            return value
+    return None
+
+class FakeChefServer(object):
+    """
+    Objects of a Chef server, stored by URL path (e.g. ``/nodes/n1``).
+
+    :ivar set unindexed: Names of objects missing from search results.
+    :ivar list requests: ``(method, path)`` of each request served.
+    :ivar error: If set, raised instead of serving requests.
+    """
+    def __init__(self):
+        self.objects = dict()
+        self.unindexed = set()
+        self.requests = list()
+        self.error = None
+
+    def add_node(self, name, environment='_default', ohai_time=None, **normal):
+        node = dict(name=name, chef_environment=environment,
+                    normal=normal, automatic=dict())
+        if ohai_time is not None:
+            node['automatic']['ohai_time'] = ohai_time
+        self.objects['/nodes/' + name] = node
+        return node
+
+    def count(self, method, prefix=''):
+        return len([r for r in self.requests
+                    if r[0] == method and r[1].startswith(prefix)])
+
+    def handle(self, method, path, data):
+        self.requests.append((method, path))
+        if self.error is not None:
+            raise self.error
+        path, _, query = path.partition('?')
+        if path.startswith('/search/'):
+            return self.search(path[len('/search/'):], parse_qs(query), data)
+        if path.count('/') == 1:
+            if method == 'GET':
+                return dict((url.rsplit('/', 1)[1], url)
+                            for url in self.objects if url.startswith(path + '/'))
+            url = '{0}/{1}'.format(path, data['name'])
+            if url in self.objects:
+                raise ChefServerError('Conflict: ' + url, 409)
+            self.objects[url] = data
+            return data
+        if path not in self.objects:
+            raise ChefServerNotFoundError('Not found: ' + path, 404)
+        if method == 'PUT':
+            self.objects[path] = data
+        elif method == 'DELETE':
+            return self.objects.pop(path)
+        return self.objects[path]
+
+    def search(self, index, query, keys):
+        field, _, values = query['q'][0].partition(':')
+        values = set(re.sub(r'\\(.)', r'\1', value)
+                     for value in values.strip('()').split(' OR '))
+        start, rows = int(query['start'][0]), int(query['rows'][0])
+        prefix = '/{0}s/'.format(index)
+        def match(value):
+            return value in values or any(
+                v.endswith('*') and str(value).startswith(v[:-1])
+                for v in values)
+        matches = [(url, obj) for url, obj in sorted(self.objects.items())
+                   if url.startswith(prefix)
+                   and obj.get('name') not in self.unindexed
+                   and match(obj.get(field))]
+        return dict(total=len(matches), start=start, rows=[
+            dict(url=url, data=dict((key, lookup(obj, path))
+                                    for key, path in keys.items()))
+            for url, obj in matches[start:start+rows]])
+
+def get_server(url):
+    """
+    The fake server of an endpoint, created on first use.
+    """
+    return servers.setdefault(url.rstrip('/'), FakeChefServer())
+
+class FakeChefAPI(chef.ChefAPI):
+    """
+    :class:`chef.ChefAPI` serving requests from the fake server of its
+    endpoint, instead of sending them.
+    """
+    def __init__(self, url, key=None, client=None, max_connections=None, **kwargs):
+        self.url = url.rstrip('/')
+        self.version = '0.10.8'
+        self.version_parsed = pkg_resources.parse_version(self.version)
+        self.server = get_server(url)
+        self.closed = False
+
+    def api_request(self, method, path, headers={}, data=None):
+        if data is not None:
+            # Serialized the way ChefAPI does
+            data = json.loads(chef_json.dumps(data))
+        return self.server.handle(method, path, data)
+
+    def connection_stats(self):
+        return dict(requests=len(self.server.requests))
+
+    def close(self):
+        self.closed = True
+
+@contextlib.contextmanager
+def fake_chef():
+    """
+    Context in which Chef backends are created with :class:`FakeChefAPI`
+    objects, and without the asynchronous API. Yields :data:`servers`.
+    """
+    servers.clear()
+    with unittest.mock.patch('occo.plugins.configmanager.chef.PooledChefAPI',
+                             FakeChefAPI), \
+            unittest.mock.patch('occo.plugins.configmanager.chef.aiohttp', None):
+        yield servers
@@ -0,0 +1,79 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+
+import threading
+import unittest
+from occo.configmanager.batch import CommandBatch, DependencyFailed
+
+class Step(object):
+    def __init__(self, name, log, fail=False, wait_for=None):
+        self.name = name
+        self.log = log
+        self.fail = fail
+        self.wait_for = wait_for
+
+    def perform(self, cm):
+        if self.wait_for is not None:
+            self.wait_for.wait(5)
+        self.log.append(self.name)
+        if self.fail:
+            raise ValueError(self.name)
+        return self.name.upper()
+
+class CommandBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.log = list()
+        self.batch = CommandBatch(max_workers=4)
+
+    def add(self, name, depends_on=(), **kwargs):
+        return self.batch.add(None, Step(name, self.log, **kwargs), depends_on)
+
+    def test_results_in_order_of_addition(self):
+        # The first command completes last
+        release = threading.Event()
+        self.add('a', wait_for=release)
+        self.add('b')
+        c = self.add('c')
+        self.add('d', depends_on=[c])
+        threading.Timer(0.1, release.set).start()
+        results = self.batch.run()
+        self.assertEqual([r.value for r in results], ['A', 'B', 'C', 'D'])
+        self.assertEqual(self.log[-1], 'a')
+
+    def test_dependencies_performed_first(self):
+        env = self.add('env')
+        nodes = [self.add('node{0}'.format(i), depends_on=[env])
+                 for i in range(3)]
+        self.add('check', depends_on=nodes)
+        self.batch.run()
+        self.assertEqual(self.log[0], 'env')
+        self.assertEqual(self.log[-1], 'check')
+
+    def test_failed_dependency_skips_dependents(self):
+        env = self.add('env', fail=True)
+        node = self.add('node', depends_on=[env])
+        self.add('check', depends_on=[node])
+        self.add('other')
+        results = self.batch.run()
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertIsInstance(results[1].error, DependencyFailed)
+        self.assertEqual(results[1].error.dependency, env)
+        self.assertIsInstance(results[2].error, DependencyFailed)
+        self.assertEqual(results[2].error.dependency, node)
+        self.assertEqual(results[3].value, 'OTHER')
+        self.assertEqual(sorted(self.log), ['env', 'other'])
+
+    def test_unknown_dependency(self):
+        self.assertRaises(ValueError, self.add, 'a', depends_on=[0])
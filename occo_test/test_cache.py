@@ -0,0 +1,158 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+
+import threading
+import unittest
+from occo.configmanager.cache import TTLCache, SingleFlight, canonical_hash
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class TTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=3, ttl=10, clock=self.clock)
+
+    def test_expiry(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=20)
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+        self.clock.now += 10
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(self.cache.stats()['expirations'], 2)
+
+    def test_lru_eviction(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertEqual(sorted(self.cache.keys()), ['a', 'c', 'd'])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_get_or_set(self):
+        calls = list()
+        def factory():
+            calls.append(1)
+            return 'value'
+        self.assertEqual(self.cache.get_or_set('a', factory), 'value')
+        self.assertEqual(self.cache.get_or_set('a', factory), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_discard_if(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.assertEqual(self.cache.discard_if(lambda k: k != 'b'), 2)
+        self.assertEqual(self.cache.keys(), ['b'])
+
+class DiscardCallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.discarded = list()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock,
+                              on_discard=lambda k, v: self.discarded.append(v))
+
+    def test_eviction_and_expiry(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.assertEqual(self.discarded, ['a'])
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.discarded, ['a', 'b'])
+
+    def test_replace(self):
+        value = object()
+        self.cache.set('a', value)
+        self.cache.set('a', value)
+        self.assertEqual(self.discarded, [])
+        self.cache.set('a', 'other')
+        self.assertEqual(self.discarded, [value])
+
+    def test_discard_if_and_clear(self):
+        for key in 'ab':
+            self.cache.set(key, key)
+        self.cache.discard_if(lambda k: k == 'a')
+        self.assertEqual(self.discarded, ['a'])
+        self.assertEqual(self.cache.pop('b'), 'b')
+        self.cache.set('c', 'c')
+        self.cache.clear()
+        self.assertEqual(self.discarded, ['a', 'c'])
+
+    def test_get_or_set_race(self):
+        def factory():
+            # Another thread stores a value meanwhile
+            self.cache.set('a', 'stored')
+            return 'created'
+        self.assertEqual(self.cache.get_or_set('a', factory), 'stored')
+        self.assertEqual(self.discarded, ['created'])
+
+class SingleFlightTest(unittest.TestCase):
+    def run_concurrently(self, fun, callers=5):
+        flight = SingleFlight()
+        results, errors = list(), list()
+        def call():
+            try:
+                results.append(flight.do('key', fun))
+            except Exception as ex:
+                errors.append(ex)
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for t in threads:
+            t.start()
+        return flight, threads, results, errors
+
+    def test_coalescing(self):
+        started, release = threading.Event(), threading.Event()
+        calls = list()
+        def fun():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+        flight, threads, results, errors = self.run_concurrently(fun)
+        started.wait(5)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flight), 0)
+
+    def test_exception_propagated(self):
+        release = threading.Event()
+        def fun():
+            release.wait(5)
+            raise KeyError('missing')
+        flight, threads, results, errors = self.run_concurrently(fun, 3)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(ex, KeyError) for ex in errors))
+
+    def test_sequential_calls_not_coalesced(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+class CanonicalHashTest(unittest.TestCase):
+    def test_key_order(self):
+        a, b = dict(x=1, y=[1, 2]), dict(y=[1, 2], x=1)
+        self.assertEqual(canonical_hash(a), canonical_hash(b))
+        self.assertNotEqual(canonical_hash(a, sort_keys=False),
+                            canonical_hash(b, sort_keys=False))
@@ -0,0 +1,213 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import occo.constants.status as status
+from chef.exceptions import ChefServerError, ChefServerNotFoundError
+from occo.plugins.configmanager.chef import ChefConfigManager, \
+    SEARCH_CHUNK_SIZE, ENVIRONMENT_MISSING_TTL
+from occo_test.fake_chef import fake_chef
+
+ENDPOINT = 'http://chef.example.com/organizations/occo'
+AUTH_DATA = dict(client_name='occo', client_key='key')
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def instance_data(node_id, infra_id='infra'):
+    return dict(node_id=node_id, infra_id=infra_id)
+
+def node_def(node_id, name='web', infra_id='infra', **attributes):
+    return dict(node_id=node_id, name=name, infra_id=infra_id,
+                config_management=dict(run_list=['recipe[app]']),
+                attributes=attributes)
+
+class ChefTestCase(unittest.TestCase):
+    def setUp(self):
+        with fake_chef() as servers:
+            self.cm = ChefConfigManager(ENDPOINT, AUTH_DATA)
+        self.server = servers[ENDPOINT]
+
+    def perform(self, command):
+        return command.perform(self.cm)
+
+class NodeStatesTest(ChefTestCase):
+    def test_bulk_query(self):
+        for i in range(3):
+            self.server.add_node('n{0}'.format(i), ohai_time=1.0)
+        self.server.add_node('n3')
+        # Not indexed yet: queried by itself
+        self.server.add_node('n4', ohai_time=1.0)
+        self.server.unindexed.add('n4')
+        nodes = [instance_data('n{0}'.format(i)) for i in range(6)]
+        states = self.perform(self.cm.cri_get_node_states(nodes + nodes[:2]))
+        self.assertEqual(states, dict(
+            n0=status.READY, n1=status.READY, n2=status.READY,
+            n3=status.PENDING, n4=status.READY, n5=status.UNKNOWN))
+        self.assertEqual(self.server.count('POST', '/search/node'), 1)
+        self.assertEqual(self.server.count('GET', '/nodes/'), 2)
+
+    def test_chunks(self):
+        count = 2 * SEARCH_CHUNK_SIZE + 1
+        nodes = [instance_data('n{0}'.format(i)) for i in range(count)]
+        for node in nodes:
+            self.server.add_node(node['node_id'], ohai_time=1.0)
+        states = self.perform(self.cm.cri_get_node_states(nodes * 2))
+        self.assertEqual(len(states), count)
+        self.assertEqual(self.server.count('POST', '/search/node'), 3)
+        self.assertEqual(self.server.count('GET', '/nodes/'), 0)
+
+class CloseTest(ChefTestCase):
+    def test_close(self):
+        self.cm.close()
+        self.assertTrue(self.cm.chefapi.closed)
+
+class RolesTest(ChefTestCase):
+    def test_role_checked_once(self):
+        node_defs = [node_def('n{0}'.format(i)) for i in range(3)]
+        results = self.perform(self.cm.cri_register_nodes(node_defs))
+        self.assertEqual(results, dict(n0=None, n1=None, n2=None))
+        self.assertIn('/roles/infra_web', self.server.objects)
+        self.assertEqual(self.server.count('GET', '/roles/'), 1)
+        self.assertEqual(self.server.count('POST', '/roles'), 1)
+        self.perform(self.cm.cri_register_node(node_def('n3')))
+        self.assertEqual(self.server.count('GET', '/roles'), 1)
+
+    def test_existing_role_not_saved(self):
+        self.server.objects['/roles/infra_web'] = dict(name='infra_web')
+        self.perform(self.cm.cri_register_node(node_def('n0')))
+        self.assertEqual(self.server.count('POST', '/roles'), 0)
+        self.assertEqual(self.server.count('PUT', '/roles'), 0)
+
+class DropInfrastructureTest(ChefTestCase):
+    def setUp(self):
+        ChefTestCase.setUp(self)
+        for env in ('infra', 'other'):
+            self.server.objects['/environments/' + env] = dict(name=env)
+        for role in ('infra_web', 'infra_db', 'other_web'):
+            self.server.objects['/roles/' + role] = dict(name=role)
+        self.server.add_node('n1', 'infra')
+        self.server.add_node('n2', 'infra')
+        self.server.add_node('n3', 'other')
+        self.server.objects['/clients/n1'] = dict(name='n1')
+
+    def test_only_infrastructure_deleted(self):
+        summary = self.perform(self.cm.cri_drop_infrastructure('infra'))
+        self.assertEqual(sorted(summary['deleted']), [
+            'clients/n1', 'environments/infra', 'nodes/n1', 'nodes/n2',
+            'roles/infra_db', 'roles/infra_web'])
+        self.assertEqual(summary['skipped'], ['clients/n2'])
+        self.assertEqual(summary['failed'], dict())
+        self.assertEqual(sorted(self.server.objects), [
+            '/environments/other', '/nodes/n3', '/roles/other_web'])
+        # Scoped searches instead of listing every object
+        self.assertEqual(self.server.count('GET', '/nodes'), 0)
+        self.assertEqual(self.server.count('GET', '/roles'), 0)
+
+    def test_failures_reported(self):
+        self.server.error = ChefServerError('Internal Server Error', 500)
+        summary = self.perform(self.cm.cri_drop_infrastructure('infra'))
+        self.assertEqual(sorted(summary['failed']),
+                         ['environments/infra', 'search'])
+        self.assertNotIn('infra', self.cm.known_environments)
+
+class NodeAttributesTest(ChefTestCase):
+    def setUp(self):
+        ChefTestCase.setUp(self)
+        self.node = self.server.add_node('n1', ohai_time=1.0, a=1,
+                                         b=dict(c=2))
+
+    def attributes(self, *attributes):
+        return self.perform(self.cm.cri_get_node_attributes('n1', attributes))
+
+    def test_only_missing_attributes_queried(self):
+        self.assertEqual(self.attributes('a'), dict(a=1))
+        self.assertEqual(self.attributes('a', ['b', 'c']), {'a': 1, 'b.c': 2})
+        self.assertEqual(self.attributes('b.c', 'a'), {'a': 1, 'b.c': 2})
+        self.assertEqual(self.server.count('POST', '/search/node'), 2)
+
+    def test_chef_run_invalidates(self):
+        self.attributes('a')
+        self.node['normal']['a'] = 3
+        self.node['automatic']['ohai_time'] = 2.0
+        self.perform(self.cm.cri_get_node_states([instance_data('n1')]))
+        self.assertEqual(self.attributes('a'), dict(a=3))
+
+    def test_unresolved(self):
+        self.assertRaises(KeyError, self.attributes, 'a', 'missing')
+
+    def test_missing_node(self):
+        self.assertRaises(ChefServerNotFoundError, self.perform,
+                          self.cm.cri_get_node_attributes('n2', ['a']))
+
+class EnvironmentTest(ChefTestCase):
+    def setUp(self):
+        ChefTestCase.setUp(self)
+        self.clock = self.cm.known_environments.clock = FakeClock()
+
+    def exists(self):
+        return self.perform(self.cm.cri_infrastructure_exists('infra'))
+
+    def test_missing_environment_rechecked(self):
+        self.assertFalse(self.exists())
+        self.assertFalse(self.exists())
+        # Only the environment itself is queried, environments are not listed
+        self.assertEqual(self.server.requests, [('GET', '/environments/infra')])
+        self.server.objects['/environments/infra'] = dict(name='infra')
+        self.clock.now += ENVIRONMENT_MISSING_TTL
+        self.assertTrue(self.exists())
+        self.assertEqual(self.server.count('GET', '/environments'), 2)
+
+    def test_created_environment_known(self):
+        self.perform(self.cm.cri_create_infrastructure('infra'))
+        requests = len(self.server.requests)
+        self.assertTrue(self.exists())
+        self.assertEqual(len(self.server.requests), requests)
+
+    def test_dropped_environment_forgotten(self):
+        self.perform(self.cm.cri_create_infrastructure('infra'))
+        self.perform(self.cm.cri_drop_infrastructure('infra'))
+        self.assertFalse(self.exists())
+
+class SaveNodeTest(ChefTestCase):
+    def saves(self):
+        # Saving always tries PUT first
+        return self.server.count('PUT', '/nodes')
+
+    def test_unchanged_node_not_saved(self):
+        self.perform(self.cm.cri_register_node(node_def('n0', port=80)))
+        self.perform(self.cm.cri_register_node(node_def('n0', port=80)))
+        self.perform(self.cm.cri_register_nodes([node_def('n0', port=80)]))
+        self.assertEqual(self.saves(), 1)
+        node = self.server.objects['/nodes/n0']
+        self.assertEqual(node['chef_environment'], 'infra')
+        self.assertEqual(node['run_list'],
+                         ['role[infra_web]', 'recipe[connect]', 'recipe[app]'])
+        self.assertEqual(node['normal'], dict(port=80))
+
+    def test_changed_node_saved(self):
+        self.perform(self.cm.cri_register_node(node_def('n0', port=80)))
+        self.perform(self.cm.cri_register_node(node_def('n0', port=8080)))
+        self.assertEqual(self.saves(), 2)
+        self.assertEqual(self.server.objects['/nodes/n0']['normal'],
+                         dict(port=8080))
+
+    def test_dropped_node_saved(self):
+        self.perform(self.cm.cri_register_node(node_def('n0')))
+        self.perform(self.cm.cri_drop_node(instance_data('n0')))
+        self.perform(self.cm.cri_register_node(node_def('n0')))
+        self.assertIn('/nodes/n0', self.server.objects)
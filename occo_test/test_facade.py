@@ -0,0 +1,182 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import asyncio
+import unittest
+import occo.constants.status as status
+import occo.infobroker as ib
+import occo.util.factory as factory
+from chef.exceptions import ChefServerError
+from occo.configmanager import ConfigManager, ConfigManagerError
+from occo.configmanager.aio import AsyncConfigManager
+from occo.plugins.configmanager.dummy import DummyCommand
+from occo_test.fake_chef import fake_chef, get_server
+
+class FakeInfoBroker(object):
+    """
+    Answers queries from a dictionary mapping keys to values, or to functions
+    computing them from the arguments of the query.
+    """
+    def __init__(self, **answers):
+        self.answers = answers
+
+    def get(self, key, *args, **kwargs):
+        answer = self.answers[key]
+        return answer(*args, **kwargs) if callable(answer) else answer
+
+@factory.register(ConfigManager, 'partial')
+class PartialConfigManager(ConfigManager):
+    """
+    Answers bulk commands for the first node only, like backends in dry-run
+    mode, which answer none.
+    """
+    def __init__(self, **cfg):
+        pass
+
+    def cri_register_nodes(self, resolved_node_definitions):
+        return DummyCommand(dict(
+            (d['node_id'], None) for d in resolved_node_definitions[:1]))
+
+def node_def(node_id, protocol='dummy', infra_id='infra'):
+    return dict(node_id=node_id, infra_id=infra_id, name=node_id,
+                config_management=dict(type=protocol, endpoint=protocol))
+
+class FacadeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.broker = FakeInfoBroker(**{'backends.auth_data': dict()})
+        self.saved_brokers = ib.main_info_broker, ib.real_main_info_broker
+        ib.main_info_broker = ib.real_main_info_broker = self.broker
+        self.cm = ConfigManager()
+
+    def tearDown(self):
+        ib.main_info_broker, ib.real_main_info_broker = self.saved_brokers
+
+class RegisterNodesTest(FacadeTestCase):
+    def setUp(self):
+        FacadeTestCase.setUp(self)
+        self.node_defs = [node_def('p1', 'partial'), node_def('p2', 'partial'),
+                          node_def('d1')]
+
+    def test_every_node_reported(self):
+        self.assertEqual(self.cm.register_nodes(self.node_defs),
+                         dict(p1=None, p2=None, d1=None))
+
+    def test_every_node_reported_async(self):
+        results = asyncio.run(
+            AsyncConfigManager(self.cm).register_nodes(self.node_defs))
+        self.assertEqual(results, dict(p1=None, p2=None, d1=None))
+
+CHEF_ENDPOINT = 'http://chef.example.com/organizations/occo'
+
+class MixedInfrastructureTest(FacadeTestCase):
+    sections = [dict(type='chef', endpoint=CHEF_ENDPOINT, run_list=[]),
+                dict(type='dummy', name='dummy'),
+                dict(type='puppet_solo', manifests=[])]
+
+    def setUp(self):
+        FacadeTestCase.setUp(self)
+        nodes = [self.instance_data('c1', self.sections[0]),
+                 self.instance_data('c2', self.sections[0]),
+                 self.instance_data('d1', self.sections[1]),
+                 self.instance_data('d2', None),
+                 self.instance_data('p1', self.sections[2]),
+                 self.instance_data('other', None, 'other_infra')]
+        self.broker.answers.update({
+            'config_managers': self.sections,
+            'backends.auth_data': dict(client_name='occo', client_key='key'),
+            'node.find': lambda infra_id: [
+                n for n in nodes if n['infra_id'] == infra_id]})
+        self.fake_chef = fake_chef()
+        self.fake_chef.__enter__()
+        self.server = get_server(CHEF_ENDPOINT)
+        self.server.add_node('c1', 'infra', ohai_time=1.0)
+        self.server.add_node('c2', 'infra')
+        self.expected = dict(c1=status.READY, c2=status.PENDING,
+                             d1=status.READY, d2=status.READY, p1=status.READY)
+
+    def tearDown(self):
+        self.fake_chef.__exit__(None, None, None)
+        FacadeTestCase.tearDown(self)
+
+    def instance_data(self, node_id, cfg, infra_id='infra'):
+        return dict(node_id=node_id, infra_id=infra_id,
+                    resolved_node_definition=dict(config_management=cfg))
+
+    def test_every_section_reports_its_nodes(self):
+        self.assertEqual(self.cm.get_infrastructure_state('infra'),
+                         self.expected)
+
+    def test_every_section_reports_its_nodes_async(self):
+        states = asyncio.run(
+            AsyncConfigManager(self.cm).get_infrastructure_state('infra'))
+        self.assertEqual(states, self.expected)
+
+    def test_failed_section_reported(self):
+        self.server.error = ChefServerError('Internal Server Error', 500)
+        with self.assertRaises(ConfigManagerError) as cm:
+            self.cm.get_infrastructure_state('infra')
+        self.assertEqual(list(cm.exception.errors), ['#0 chef ({0})'.format(
+            CHEF_ENDPOINT)])
+
+    def test_failed_section_reported_async(self):
+        self.server.error = ChefServerError('Internal Server Error', 500)
+        with self.assertRaises(ConfigManagerError) as cm:
+            asyncio.run(
+                AsyncConfigManager(self.cm).get_infrastructure_state('infra'))
+        self.assertEqual(list(cm.exception.errors), ['#0 chef ({0})'.format(
+            CHEF_ENDPOINT)])
+
+class AsyncFacadeTest(FacadeTestCase):
+    def setUp(self):
+        FacadeTestCase.setUp(self)
+        self.broker.answers['backends.auth_data'] = dict(
+            client_name='occo', client_key='key')
+        self.fake_chef = fake_chef()
+        self.fake_chef.__enter__()
+        self.server = get_server(CHEF_ENDPOINT)
+        self.server.add_node('c1', ohai_time=1.0)
+        self.cm = AsyncConfigManager(ConfigManager(collect_metrics=True))
+
+    def tearDown(self):
+        self.fake_chef.__exit__(None, None, None)
+        FacadeTestCase.tearDown(self)
+
+    def node(self, node_id, protocol):
+        cfg = dict(type=protocol, endpoint=CHEF_ENDPOINT) \
+            if protocol == 'chef' else dict(type=protocol)
+        return dict(node_id=node_id, infra_id='infra',
+                    resolved_node_definition=dict(config_management=cfg))
+
+    def commands(self):
+        return dict((entry['labels']['command'], entry)
+                    for entry in self.cm.config_manager.metrics.snapshot()
+                    ['occo_configmanager_command'])
+
+    def test_node_states_by_backend(self):
+        nodes = [self.node('c1', 'chef'), self.node('c2', 'chef'),
+                 self.node('d1', 'dummy')]
+        states = asyncio.run(self.cm.get_node_states(nodes))
+        self.assertEqual(states, dict(c1=status.READY, c2=status.UNKNOWN,
+                                      d1=status.READY))
+        self.assertEqual(self.server.count('POST', '/search/node'), 1)
+        entry = self.commands()['GetNodeStates']
+        self.assertEqual(entry['labels']['protocol'], 'chef')
+        self.assertEqual((entry['count'], entry['errors']), (1, 0))
+
+    def test_failed_command_recorded(self):
+        self.server.error = ChefServerError('Internal Server Error', 500)
+        with self.assertRaises(ChefServerError):
+            asyncio.run(self.cm.get_node_states([self.node('c1', 'chef')]))
+        entry = self.commands()['GetNodeStates']
+        self.assertEqual((entry['count'], entry['errors']), (1, 1))
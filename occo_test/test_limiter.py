@@ -0,0 +1,128 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import asyncio
+import unittest
+from occo.configmanager.limiter import AdaptiveLimiter, LimiterTimeout
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def run_rounds(limiter, clock, latency, rounds):
+    """
+    Keep the limiter fully used: in each round, start as many requests as
+    the limit allows, then complete them in the order of their latencies.
+
+    :param latency: Called as ``latency(index, concurrency)``; returns the
+        ``(request_class, latency)`` of a request.
+    :returns: The number of completed requests per second.
+    """
+    completed, begin = 0, clock.now
+    for _ in range(rounds):
+        start = clock.now
+        requests = list()
+        for index in range(int(limiter.limit)):
+            limiter.acquire()
+            requests.append(latency(index, int(limiter.limit)))
+        for request_class, elapsed in sorted(requests, key=lambda r: r[1]):
+            clock.now = start + elapsed
+            limiter.release(start, request_class=request_class)
+            completed += 1
+    return completed / (clock.now - begin)
+
+class LimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = AdaptiveLimiter(initial_limit=10, max_limit=100,
+                                       clock=self.clock)
+
+    def test_mixed_request_classes(self):
+        # An idle server answering fast and slow requests is not overloaded
+        def latency(index, concurrency):
+            return ('GET /nodes', 0.01) if index % 2 else ('POST /search', 0.12)
+        run_rounds(self.limiter, self.clock, latency, 500)
+        self.assertEqual(self.limiter.overloads, 0)
+        self.assertEqual(self.limiter.stats()['limit'], 100)
+
+    def test_uniform_latency(self):
+        run_rounds(self.limiter, self.clock,
+                   lambda index, concurrency: ('POST /search', 0.12), 500)
+        self.assertEqual(self.limiter.overloads, 0)
+        self.assertEqual(self.limiter.stats()['limit'], 100)
+
+    def test_overloaded_server(self):
+        # Serves 10 requests at a time in 0.1s; more requests queue up
+        capacity, service_time = 10, 0.1
+        def latency(index, concurrency):
+            return ('GET /nodes',
+                    service_time * max(1.0, float(concurrency) / capacity))
+        throughput = run_rounds(self.limiter, self.clock, latency, 1000)
+        self.assertGreater(self.limiter.overloads, 0)
+        self.assertLess(self.limiter.stats()['limit'], 5 * capacity)
+        self.assertGreaterEqual(self.limiter.stats()['limit'], capacity)
+        self.assertAlmostEqual(throughput, capacity / service_time, delta=1)
+
+    def test_errors_shrink_limit_once_per_round_trip(self):
+        starts = [self.limiter.acquire() for _ in range(5)]
+        self.clock.now += 0.01
+        for start in starts:
+            self.limiter.release(start, overloaded=True)
+        self.assertEqual(self.limiter.stats()['limit'], 7)
+        self.assertEqual(self.limiter.overloads, 5)
+
+    def test_queue_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_wait=0)
+        limiter.acquire()
+        self.assertRaises(LimiterTimeout, limiter.acquire)
+        self.assertEqual(limiter.stats()['timeouts'], 1)
+
+    def test_async_waiter_granted_on_release(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        async def main():
+            start = await limiter.acquire_async()
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.stats()['queued'], 1)
+            limiter.release(start)
+            await waiter
+            self.assertEqual(limiter.stats()['in_flight'], 1)
+        asyncio.run(main())
+
+    def test_cancelled_async_waiter_gives_back_slot(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        async def main():
+            start = await limiter.acquire_async()
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            limiter.release(start)
+            await asyncio.gather(waiter, return_exceptions=True)
+            await asyncio.sleep(0)
+        asyncio.run(main())
+        stats = limiter.stats()
+        self.assertEqual((stats['in_flight'], stats['queued']), (0, 0))
+
+    def test_async_queue_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_wait=0.01)
+        async def main():
+            await limiter.acquire_async()
+            with self.assertRaises(LimiterTimeout):
+                await limiter.acquire_async()
+        asyncio.run(main())
+        stats = limiter.stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['timeouts']),
+                         (1, 0, 1))
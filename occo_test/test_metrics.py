@@ -0,0 +1,54 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.configmanager.metrics import Metrics
+
+LABELS = (('protocol', 'chef'), ('command', 'GetNodeState'))
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(enabled=True, buckets=(0.1, 1.0))
+
+    def test_histogram(self):
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            self.metrics.observe('op', LABELS, seconds)
+        self.metrics.observe('op', LABELS, 0.5, error=True)
+        entry, = self.metrics.snapshot()['op']
+        self.assertEqual(entry['labels'],
+                         dict(protocol='chef', command='GetNodeState'))
+        self.assertEqual(entry['buckets'], {'0.1': 2, '1.0': 4, '+Inf': 5})
+        self.assertEqual((entry['count'], entry['errors']), (5, 1))
+        self.assertAlmostEqual(entry['sum'], 3.15)
+
+    def test_timed_errors(self):
+        def fail():
+            raise KeyError('missing')
+        self.assertEqual(self.metrics.timed('op', LABELS, len, 'abc'), 3)
+        self.assertRaises(KeyError, self.metrics.timed, 'op', LABELS, fail)
+        entry, = self.metrics.snapshot()['op']
+        self.assertEqual((entry['count'], entry['errors']), (2, 1))
+
+    def test_disabled(self):
+        metrics = Metrics()
+        self.assertEqual(metrics.timed('op', LABELS, len, 'abc'), 3)
+        self.assertEqual(metrics.snapshot(), dict())
+
+    def test_prometheus_text(self):
+        self.metrics.observe('op', (('endpoint', 'a"b'),), 0.5, error=True)
+        lines = self.metrics.prometheus_text().splitlines()
+        self.assertIn('# TYPE op_seconds histogram', lines)
+        self.assertIn('op_seconds_bucket{endpoint="a\\"b",le="1.0"} 1', lines)
+        self.assertIn('op_seconds_count{endpoint="a\\"b"} 1', lines)
+        self.assertIn('op_errors_total{endpoint="a\\"b"} 1', lines)
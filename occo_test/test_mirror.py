@@ -0,0 +1,97 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import occo.constants.status as status
+from occo.configmanager.mirror import LocalMirror, get_mirror, \
+    claim_warm_start, close_mirrors
+from occo.plugins.configmanager.chef import ChefConfigManager
+from occo_test.fake_chef import fake_chef, get_server
+
+ENDPOINT = 'http://chef.example.com/organizations/occo'
+AUTH_DATA = dict(client_name='occo', client_key='key')
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class MirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'mirror.db')
+
+    def tearDown(self):
+        close_mirrors()
+        shutil.rmtree(self.tmpdir)
+
+class LocalMirrorTest(MirrorTestCase):
+    def setUp(self):
+        MirrorTestCase.setUp(self)
+        self.clock = FakeClock()
+        self.mirror = LocalMirror(self.path, clock=self.clock)
+
+    def tearDown(self):
+        self.mirror.close()
+        MirrorTestCase.tearDown(self)
+
+    def test_persisted(self):
+        self.mirror.record_role(ENDPOINT, 'r1')
+        self.mirror.record_role('other', 'r2')
+        self.mirror.record_node_state(ENDPOINT, 'n1', status.READY)
+        self.mirror.close()
+        self.mirror = LocalMirror(self.path)
+        self.assertEqual(self.mirror.roles(ENDPOINT), ['r1'])
+        self.assertEqual(self.mirror.node_states(ENDPOINT),
+                         dict(n1=(status.READY, 1000.0)))
+
+    def test_forget(self):
+        self.mirror.record_environment(ENDPOINT, 'e1')
+        self.mirror.flush()
+        self.mirror.forget_environment(ENDPOINT, 'e1')
+        self.assertEqual(self.mirror.environments(ENDPOINT), [])
+
+    def test_max_age(self):
+        self.mirror.record_role(ENDPOINT, 'old')
+        self.clock.now += 100
+        self.mirror.record_role(ENDPOINT, 'new')
+        self.assertEqual(self.mirror.roles(ENDPOINT, max_age=50), ['new'])
+        self.assertEqual(sorted(self.mirror.roles(ENDPOINT)), ['new', 'old'])
+
+class WarmStartTest(MirrorTestCase):
+    def test_claimed_once(self):
+        self.assertTrue(claim_warm_start(self.path, ENDPOINT))
+        self.assertFalse(claim_warm_start(self.path, ENDPOINT))
+        self.assertTrue(claim_warm_start(self.path, 'other'))
+
+    def test_revalidated_against_server(self):
+        mirror = get_mirror(self.path)
+        mirror.record_role(ENDPOINT, 'infra_web')
+        mirror.record_role(ENDPOINT, 'infra_gone')
+        mirror.record_node_state(ENDPOINT, 'n1', status.READY)
+        with fake_chef():
+            server = get_server(ENDPOINT)
+            server.objects['/roles/infra_web'] = dict(name='infra_web')
+            cm = ChefConfigManager(ENDPOINT, AUTH_DATA, mirror=self.path)
+        self.assertTrue(cm.revalidated.wait(5))
+        # Loaded from the mirror, then checked with a single listing
+        self.assertIn('infra_web', cm.known_roles)
+        self.assertNotIn('infra_gone', cm.known_roles)
+        self.assertEqual(mirror.roles(ENDPOINT), ['infra_web'])
+        self.assertEqual(mirror.node_states(ENDPOINT), dict())
+        self.assertEqual(server.count('GET', '/roles'), 1)
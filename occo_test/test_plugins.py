@@ -0,0 +1,63 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+import unittest.mock
+import occo.configmanager.plugins as plugins
+import occo.plugins.configmanager.dummy
+from occo.configmanager import ConfigManager
+
+class PluginModuleTest(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.object(
+            plugins, 'entry_point_modules',
+            dict(custom='my_package.my_plugin', dummy='my_package.dummy'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shipped_plugins_first(self):
+        self.assertEqual(plugins.plugin_module('dummy'),
+                         'occo.plugins.configmanager.dummy')
+
+    def test_entry_points(self):
+        self.assertEqual(plugins.plugin_module('custom'),
+                         'my_package.my_plugin')
+
+    def test_unknown_protocol(self):
+        self.assertIsNone(plugins.plugin_module('unknown'))
+
+class LoadPluginTest(unittest.TestCase):
+    def load(self, protocol):
+        with unittest.mock.patch.object(plugins.importlib,
+                                        'import_module') as import_module:
+            plugins.load_plugin(ConfigManager, protocol)
+        return [c[0][0] for c in import_module.call_args_list]
+
+    def test_registered_protocol_not_imported(self):
+        self.assertEqual(self.load('dummy'), [])
+
+    def test_unregistered_protocol_imported(self):
+        with unittest.mock.patch.dict(ConfigManager.backends):
+            ConfigManager.backends.pop('chef', None)
+            self.assertEqual(self.load('chef'),
+                             ['occo.plugins.configmanager.chef'])
+
+    def test_unknown_protocol_not_imported(self):
+        with unittest.mock.patch.object(plugins, 'entry_point_modules', dict()):
+            self.assertEqual(self.load('unknown'), [])
+
+    def test_instantiate_loads_plugin(self):
+        with unittest.mock.patch.object(plugins, 'load_plugin') as load_plugin:
+            ConfigManager.instantiate('dummy')
+        load_plugin.assert_called_once_with(ConfigManager, 'dummy')
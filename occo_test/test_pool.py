@@ -0,0 +1,59 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.configmanager.pool import BackendPool
+
+class FakeBackend(object):
+    def __init__(self, protocol, auth_data, **cfg):
+        self.endpoint = cfg.get('endpoint')
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def section(endpoint, protocol='chef'):
+    return dict(type=protocol, endpoint=endpoint)
+
+class BackendPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = BackendPool(FakeBackend, maxsize=2)
+
+    def test_reuse(self):
+        backend = self.pool.get(section('a'), dict(key='k'))
+        self.assertIs(self.pool.get(section('a'), dict(key='k')), backend)
+        self.assertIsNot(self.pool.get(section('a'), dict(key='other')), backend)
+
+    def test_evicted_backend_closed(self):
+        first = self.pool.get(section('a'), None)
+        self.pool.get(section('b'), None)
+        self.pool.get(section('c'), None)
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.pool.values()), 2)
+
+    def test_invalidated_backend_closed(self):
+        a = self.pool.get(section('a'), None)
+        b = self.pool.get(section('b'), None)
+        self.assertEqual(self.pool.invalidate('chef', 'a'), 1)
+        self.assertEqual((a.closed, b.closed), (True, False))
+        self.assertIsNot(self.pool.get(section('a'), None), a)
+
+    def test_backend_without_close(self):
+        class Unclosable(object):
+            def __init__(self, protocol, auth_data, **cfg):
+                pass
+        pool = BackendPool(Unclosable, maxsize=1)
+        pool.get(section('a'), None)
+        pool.get(section('b'), None)
+        self.assertEqual(pool.stats()['evictions'], 1)
@@ -0,0 +1,33 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.plugins.configmanager.puppet_solo import PuppetSoloConfigManager
+
+class ResolveAttributesTest(unittest.TestCase):
+    def resolve(self, cm_section):
+        cm = PuppetSoloConfigManager(type='puppet_solo')
+        node_def = dict(config_management=cm_section)
+        return cm.cri_resolve_attributes(node_def).perform(cm)
+
+    def test_strings_keep_section_order(self):
+        attributes = self.resolve(dict(
+            modules=dict(b=1, a=2), manifests=['site.pp', 'app.pp']))
+        self.assertEqual(attributes, dict(puppet=dict(
+            modules='b a', manifests='site.pp app.pp', attributes='')))
+
+    def test_results_independent(self):
+        section = dict(modules=dict(a=1))
+        self.resolve(section)['puppet']['modules'] = 'changed'
+        self.assertEqual(self.resolve(section)['puppet']['modules'], 'a')
@@ -0,0 +1,41 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+import unittest
+from occo.configmanager import CMSchemaChecker
+from occo.exceptions import SchemaError
+
+class CheckSectionsTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertTrue(CMSchemaChecker.check_sections([
+            dict(type='puppet_solo', manifests=['site.pp']),
+            dict(type='puppet_solo', manifests=[], modules=dict())]))
+
+    def test_errors_reported_at_once(self):
+        sections = [dict(type='puppet_solo', manifests=[]),
+                    dict(manifests=[]),
+                    dict(type='puppet_solo'),
+                    dict(type='puppet_solo', manifests=[], port=1),
+                    dict(type='no_such_protocol')]
+        with self.assertRaises(SchemaError) as cm:
+            CMSchemaChecker.check_sections(sections)
+        self.assertEqual([index for index, _ in cm.exception.errors],
+                         [1, 2, 3, 4])
+
+    def test_same_section_checked_again(self):
+        section = dict(type='puppet_solo', manifests=[])
+        self.assertIsNone(CMSchemaChecker.check_section(section))
+        section['port'] = 1
+        self.assertEqual(CMSchemaChecker.check_section(section),
+                         'Unknown key(s): port')
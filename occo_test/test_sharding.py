@@ -0,0 +1,139 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+
+import asyncio
+import unittest
+import occo.constants.status as status
+from chef.exceptions import ChefServerNotFoundError
+from occo.plugins.configmanager.chef_sharded import HashRing, \
+    ShardedChefConfigManager
+from occo_test.fake_chef import fake_chef
+
+class HashRingTest(unittest.TestCase):
+    keys = ['node-{0}'.format(i) for i in range(10000)]
+
+    def placement(self, ring):
+        return dict((key, ring.get(key)) for key in self.keys)
+
+    def test_deterministic(self):
+        shards = ['a', 'b', 'c']
+        self.assertEqual(self.placement(HashRing(shards)),
+                         self.placement(HashRing(list(reversed(shards)))))
+
+    def test_balance(self):
+        placement = self.placement(HashRing(['a', 'b', 'c', 'd']))
+        for shard in 'abcd':
+            share = sum(1 for s in placement.values() if s == shard)
+            self.assertAlmostEqual(share / float(len(self.keys)), 0.25,
+                                   delta=0.07)
+
+    def test_adding_shard_moves_few_keys(self):
+        before = self.placement(HashRing(['a', 'b', 'c', 'd']))
+        after = self.placement(HashRing(['a', 'b', 'c', 'd', 'e']))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        # Only keys moving to the new shard, about a fifth of them
+        self.assertTrue(all(after[key] == 'e' for key in moved))
+        self.assertAlmostEqual(len(moved) / float(len(self.keys)), 0.2,
+                               delta=0.05)
+
+    def test_no_shards(self):
+        self.assertRaises(ValueError, HashRing, [])
+
+ENDPOINTS = ['http://chef{0}.example.com/organizations/occo'.format(i)
+             for i in range(3)]
+AUTH_DATA = dict(client_name='occo', client_key='key')
+
+class ShardFallbackTest(unittest.TestCase):
+    """
+    Nodes registered before the ring changed are held by a shard other than
+    their own.
+    """
+    def setUp(self):
+        with fake_chef() as servers:
+            self.cm = ShardedChefConfigManager(ENDPOINTS, AUTH_DATA)
+        self.servers = servers
+        own, other = ENDPOINTS[0], ENDPOINTS[1]
+        self.owned, self.moved, self.missing = [
+            node_id for node_id in ('node-{0}'.format(i) for i in range(100))
+            if self.cm.ring.get(node_id) == own][:3]
+        servers[own].add_node(self.owned, ohai_time=1.0, role='db')
+        servers[other].add_node(self.moved, ohai_time=1.0, role='web')
+        self.own, self.other = servers[own], servers[other]
+
+    def tearDown(self):
+        self.cm.executor.shutdown()
+
+    def requests(self, method, prefix=''):
+        return sum(server.count(method, prefix)
+                   for server in self.servers.values())
+
+    def perform(self, command):
+        return command.perform(self.cm)
+
+    def test_node_attribute(self):
+        self.assertEqual(
+            self.perform(self.cm.cri_get_node_attribute(self.moved, 'role')),
+            'web')
+        self.assertEqual(self.cm.shard(self.moved).endpoint, ENDPOINTS[1])
+        own_requests = len(self.own.requests)
+        self.perform(self.cm.cri_get_node_attribute(self.moved, 'role'))
+        self.assertEqual(len(self.own.requests), own_requests)
+
+    def test_node_attributes(self):
+        self.assertEqual(
+            self.perform(self.cm.cri_get_node_attributes(self.moved, ['role'])),
+            dict(role='web'))
+        self.assertEqual(self.cm.shard(self.moved).endpoint, ENDPOINTS[1])
+
+    def test_unindexed_node_attributes(self):
+        self.other.unindexed.add(self.moved)
+        self.assertEqual(
+            self.perform(self.cm.cri_get_node_attributes(self.moved, ['role'])),
+            dict(role='web'))
+
+    def test_missing_node_attribute(self):
+        command = self.cm.cri_get_node_attribute(self.missing, 'role')
+        self.assertRaises(ChefServerNotFoundError, self.perform, command)
+        requests = self.requests('GET')
+        self.assertRaises(ChefServerNotFoundError, self.perform, command)
+        # Only its own shard is asked again
+        self.assertEqual(self.requests('GET'), requests + 1)
+
+    def test_node_states(self):
+        nodes = [dict(node_id=node_id)
+                 for node_id in (self.owned, self.moved, self.missing)]
+        expected = {self.owned: status.READY, self.moved: status.READY,
+                    self.missing: status.UNKNOWN}
+        self.assertEqual(self.perform(self.cm.cri_get_node_states(nodes)),
+                         expected)
+        self.assertEqual(self.cm.shard(self.moved).endpoint, ENDPOINTS[1])
+        # Nodes missing from the search are only queried on their own shard
+        self.assertEqual(self.own.count('GET', '/nodes/'), 2)
+        self.assertEqual(self.requests('GET', '/nodes/'), 2)
+        searches = self.requests('POST', '/search/')
+        self.assertEqual(self.perform(self.cm.cri_get_node_states(nodes)),
+                         expected)
+        # One search on each of the two shards holding the nodes
+        self.assertEqual(self.requests('POST', '/search/'), searches + 2)
+
+    def test_node_states_async(self):
+        nodes = [dict(node_id=node_id)
+                 for node_id in (self.owned, self.moved, self.missing)]
+        command = self.cm.cri_get_node_states(nodes)
+        states = asyncio.run(command.perform_async(self.cm))
+        self.assertEqual(states, {self.owned: status.READY,
+                                  self.moved: status.READY,
+                                  self.missing: status.UNKNOWN})
+        self.assertTrue(self.cm.is_absent(self.missing))
@@ -0,0 +1,98 @@
+### Copyright 2014, MTA SZTAKI, www.sztaki.hu
+###
+### Licensed under the Apache License, Version 2.0 (the "License");
+### you may not use this file except in compliance with the License.
+### You may obtain a copy of the License at
+###
+###    http://www.apache.org/licenses/LICENSE-2.0
+###
+### Unless required by applicable law or agreed to in writing, software
+### distributed under the License is distributed on an "AS IS" BASIS,
+### WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+### See the License for the specific language governing permissions and
+### limitations under the License.
+
+
+import unittest
+import occo.constants.status as status
+from occo.configmanager.state import NodeStateCache, NodeStatusTable
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class NodeStateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = NodeStateCache(ready_ttl=10, pending_ttl=1,
+                                    max_pending_ttl=8, other_ttl=1,
+                                    clock=self.clock)
+        self.queries = 0
+
+    def fetch(self, state):
+        def query():
+            self.queries += 1
+            return state
+        return self.cache.fetch('n1', query, 'infra')
+
+    def test_pending_backoff(self):
+        # Pending states are re-polled after 1, 2, 4, 8, 8 seconds
+        lifetimes = list()
+        for _ in range(5):
+            self.fetch(status.PENDING)
+            queries, waited = self.queries, 0
+            while self.queries == queries:
+                self.clock.now += 0.5
+                waited += 0.5
+                self.fetch(status.PENDING)
+            lifetimes.append(waited)
+        self.assertEqual(lifetimes, [1, 2, 4, 8, 8])
+
+    def test_backoff_reset(self):
+        self.fetch(status.PENDING)
+        self.clock.now += 1
+        self.fetch(status.PENDING)
+        self.assertEqual(self.cache.table.get('n1').streak, 1)
+        self.clock.now += 2
+        self.fetch(status.READY)
+        self.assertEqual(self.cache.table.get('n1').streak, 0)
+
+    def test_ready_ttl(self):
+        self.fetch(status.READY)
+        self.clock.now += 9
+        self.assertEqual(self.fetch(status.PENDING), status.READY)
+        self.clock.now += 1
+        self.assertEqual(self.fetch(status.PENDING), status.PENDING)
+        self.assertEqual(self.queries, 2)
+
+    def test_backend_recorded(self):
+        self.cache.fetch('n1', lambda: (status.READY, 'backend'), 'infra')
+        self.assertEqual(self.cache.table.get('n1').backend, 'backend')
+
+    def test_infrastructure(self):
+        self.cache.put('n1', status.READY, 'i1')
+        self.cache.put('n2', status.UNKNOWN, 'i1')
+        self.cache.put('n3', status.READY, 'i2')
+        self.clock.now += 1
+        self.assertEqual(self.cache.infrastructure('i1'), dict(n1=status.READY))
+        self.cache.invalidate_infrastructure('i1')
+        self.assertIsNone(self.cache.get('n1'))
+        self.assertEqual(self.cache.get('n3'), status.READY)
+
+class NodeStatusTableTest(unittest.TestCase):
+    def test_shrink(self):
+        table = NodeStatusTable(maxsize=10, clock=lambda: 0)
+        for i in range(11):
+            table.put('n{0}'.format(i), status.READY, 0, 100, 'infra')
+        self.assertEqual(len(table), 9)
+        self.assertIsNone(table.get('n0'))
+        self.assertEqual(len(table.infrastructure('infra')), 9)
+
+    def test_move_between_infrastructures(self):
+        table = NodeStatusTable()
+        table.put('n1', status.READY, 0, 100, 'i1')
+        table.put('n1', status.READY, 0, 100, 'i2')
+        self.assertEqual(table.infrastructure('i1'), [])
+        self.assertEqual(len(table.infrastructure('i2')), 1)
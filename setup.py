@@ -31,6 +31,7 @@ setuptools.setup(
     py_modules=[
         'occo.plugins.configmanager.dummy',
         'occo.plugins.configmanager.chef',
+        'occo.plugins.configmanager.chef_sharded',
         'occo.plugins.configmanager.puppet_solo',
     ],
     scripts=[],
@@ -42,5 +43,16 @@ setuptools.setup(
         'pychef',
         'OCCO-InfoBroker',
         'OCCO-Util',
-    ]
+    ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
+    entry_points={
+        'occo.configmanager.plugins': [
+            'chef = occo.plugins.configmanager.chef',
+            'chef_sharded = occo.plugins.configmanager.chef_sharded',
+            'dummy = occo.plugins.configmanager.dummy',
+            'puppet_solo = occo.plugins.configmanager.puppet_solo',
+        ],
+    },
 )